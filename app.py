@@ -1,20 +1,44 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session, g, Response, make_response, stream_with_context, stream_template
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from flask_mail import Mail, Message
+from flask_mail import Mail
+import hashlib
+import io
 import sqlite3
 from datetime import datetime, timedelta
 import os
 import requests
-import random
-import string
-from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+from cache import ResponseCache, TieredCache
+from database import get_pool, init_db
+from ledger import order_balances, ledger_totals
+from summary import dashboard_figures
+from rollups import BUCKET_LABELS, sales_report
+from cogs import pending_count as cogs_pending_count, refresh as refresh_costs
+from stock import insert_orders, stock_in, stock_out
+from export import EXPORTS, fetch_page, parse_since, select_rows, stream_csv, stream_json_array, stream_ndjson
+from search import SEARCH_LIMIT, product_variants, search_products
+from importer import KINDS as IMPORT_KINDS, Importer, detect_format, iter_records
+from mailer import enqueue_email, get_dispatcher, outbox_connection, pending_count, start_dispatcher
+from metrics import RequestMetrics
+from retention import last_run as last_retention_run
+from backup import last_run as last_backup_run
+from passwords import HasherBusy, PasswordHasher
+from replica import ReportReader
+from otp_store import RateLimited, create_store
+from versions import data_version
 
 # โหลด Environment Variables จากไฟล์ .env สำหรับการพัฒนาบนเครื่อง
 load_dotenv()
 
 app = Flask(__name__)
 
+# จับเวลาแต่ละ request + นับ/จับเวลา SQL และเปิด /metrics (ดู metrics.py)
+request_metrics = RequestMetrics()
+request_metrics.init_app(app)
+
+# สร้าง/อัปเดตโครงสร้างฐานข้อมูลก่อนเริ่มรับ request
+init_db()
+
 # --- การตั้งค่าทั่วไป ---
 app.secret_key = os.environ.get('SECRET_KEY', 'default-fallback-key')
 RECAPTCHA_SECRET_KEY = os.environ.get('RECAPTCHA_SECRET_KEY')
@@ -28,6 +52,14 @@ app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = ('Your App Name', app.config['MAIL_USERNAME'])
 
 mail = Mail(app)
+# อีเมลถูกส่งโดย thread เบื้องหลังจากตาราง email_outbox ใน auth.db (ดู mailer.py)
+start_dispatcher(app, mail)
+
+# Hash/ตรวจรหัสผ่านใน process pool แยก จำกัดจำนวนงานพร้อมกัน (ดู passwords.py)
+password_hasher = PasswordHasher()
+
+# รหัส OTP เก็บแยกจากตาราง users (ดู otp_store.py)
+otp_store = create_store()
 
 # --- ตั้งค่า Flask-Login ---
 login_manager = LoginManager()
@@ -40,35 +72,107 @@ class User(UserMixin):
         self.username = username
         self.email = email
 
+# Cache ข้อมูลผู้ใช้ ลดการ query ตาราง users ทุก request ที่ต้องล็อกอิน
+# (ตั้ง user_cache.shared เป็น backend กลาง เช่น Redis เพื่อแชร์ระหว่าง worker ได้)
+user_cache = TieredCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', 4096)),
+                         ttl=float(os.environ.get('USER_CACHE_TTL', 300)))
+
+# Cache ผลลัพธ์ของ API อ่านอย่างเดียว ต่อ (user, path, query string, data version) ดู conditional_response()
+response_cache = ResponseCache(maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE', 512)),
+                               ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 600)),
+                               max_entry_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 128 * 1024)))
+
+# หน้า report อ่านจาก snapshot หรือ replica แยกจาก connection ที่ใช้เขียน (REPORT_READS, ดู replica.py)
+report_reader = ReportReader()
+
+def invalidate_user(user_id):
+    user_cache.delete(f'user:{user_id}')
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    user_data = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
-    if user_data:
-        return User(id=user_data['id'], username=user_data['username'], email=user_data['email'])
-    return None
+    user_data = user_cache.get(f'user:{user_id}')
+    if user_data is None:
+        conn = get_db_connection()
+        row = conn.execute('SELECT id, username, email FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        user_data = dict(row)
+        user_cache.set(f'user:{user_id}', user_data)
+    return User(**user_data)
 
 def get_db_connection():
-    conn = sqlite3.connect('inventory.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """
+    คืน connection ของ request ปัจจุบันจาก pool (ใช้ซ้ำทั้ง request)
+    และจะถูกคืนเข้า pool อัตโนมัติใน teardown
+    """
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+        request_metrics.attach(g.db)
+    return g.db
 
-def generate_otp(length=6):
-    return ''.join(random.choices(string.digits, k=length))
+def get_report_connection():
+    """
+    Read-only connection สำหรับหน้า report ตาม REPORT_READS (ดู replica.py)
+    ห้ามเขียนผ่าน connection นี้ งานเขียน (เช่น refresh_costs) ใช้ get_db_connection()
+    """
+    if report_reader.mode == 'primary':
+        return get_db_connection()
+    if 'report_db' not in g:
+        g.report_db = report_reader.acquire()
+        request_metrics.attach(g.report_db)
+    return g.report_db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        request_metrics.detach(conn)
+        get_pool().release(conn)
+    conn = g.pop('report_db', None)
+    if conn is not None:
+        request_metrics.detach(conn)
+        report_reader.release(conn)
+
+def queue_figures():
+    """Backlog gauges read from the database on each /metrics scrape."""
+    conn = get_db_connection()
+    figures = {
+        'cogs_pending': cogs_pending_count(conn),
+        'email_outbox_pending': pending_count(outbox_connection()),
+    }
+    retention = last_retention_run(conn)
+    if retention:
+        figures['retention_last_run'] = retention
+    backup = last_backup_run(conn)
+    if backup:
+        figures['backup_last_run'] = backup
+    return figures
+
+request_metrics.collect('db_pool', lambda: get_pool().stats())
+request_metrics.collect('report_reads', report_reader.stats)
+request_metrics.collect('user_cache', user_cache.stats)
+request_metrics.collect('response_cache', response_cache.stats)
+request_metrics.collect('password', password_hasher.stats)
+request_metrics.collect('mail_dispatcher', lambda: get_dispatcher() and get_dispatcher().stats())
+request_metrics.collect('app', queue_figures)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text format, figures for this worker process (see metrics.py)."""
+    return request_metrics.response()
 
 def send_otp_email(recipient_email, otp):
     """
-    ส่งอีเมลพร้อมรหัส OTP และคืนค่าสถานะพร้อมข้อความ Error (ถ้ามี)
+    ใส่อีเมลรหัส OTP ลงคิว (email_outbox) แล้วคืนค่าทันที ไม่รอ SMTP
+    คืนค่าสถานะพร้อมข้อความ Error (ถ้ามี)
     """
     try:
-        msg = Message('Your Verification Code', recipients=[recipient_email])
-        msg.body = f'Your verification code is: {otp}\nThis code will expire in 10 minutes.'
-        mail.send(msg)
+        enqueue_email(recipient_email, 'Your Verification Code',
+                      f'Your verification code is: {otp}\nThis code will expire in {otp_store.ttl // 60} minutes.')
+        start_dispatcher(app, mail)  # เริ่มใหม่ถ้า process นี้เพิ่ง fork มา
         return True, None  # คืนค่าว่าสำเร็จ และไม่มี Error
-    except Exception as e:
-        # พิมพ์ Error ที่เกิดขึ้นจริงลงใน Log ของเซิร์ฟเวอร์
-        print(f"ERROR: [Flask-Mail] - {e}")
+    except sqlite3.Error as e:
+        print(f"ERROR: [outbox] - {e}")
         return False, str(e) # คืนค่าว่าล้มเหลว และส่งข้อความ Error กลับไป
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -87,39 +191,43 @@ def register():
         conn = get_db_connection()
         if conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone():
             flash('Username นี้มีผู้ใช้งานแล้ว', 'danger')
-            conn.close()
             return redirect(url_for('register'))
         if conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone():
             flash('Email นี้มีผู้ใช้งานแล้ว', 'danger')
-            conn.close()
             return redirect(url_for('register'))
 
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-        otp = generate_otp()
-        otp_expiry = datetime.now() + timedelta(minutes=10)
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HasherBusy:
+            flash('ระบบกำลังมีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้ง', 'danger')
+            return redirect(url_for('register'))
+        try:
+            otp = otp_store.issue('register', email)
+        except RateLimited:
+            flash('ขอรหัสยืนยันบ่อยเกินไป กรุณารอสักครู่แล้วลองใหม่', 'danger')
+            return redirect(url_for('register'))
 
         try:
-            conn.execute(
-                'INSERT INTO users (username, email, password, otp, otp_expiry, is_verified) VALUES (?, ?, ?, ?, ?, ?)',
-                (username, email, hashed_password, otp, otp_expiry.strftime('%Y-%m-%d %H:%M:%S'), False)
+            cursor = conn.execute(
+                'INSERT INTO users (username, email, password, is_verified) VALUES (?, ?, ?, ?)',
+                (username, email, hashed_password, False)
             )
             conn.commit()
+            invalidate_user(cursor.lastrowid)
         except sqlite3.Error as e:
-            conn.close()
             flash(f'เกิดข้อผิดพลาดกับฐานข้อมูล: {e}', 'danger')
             return redirect(url_for('register'))
 
         # --- ปรับปรุงการจัดการ Error ตรงนี้ ---
         success, error_message = send_otp_email(email, otp)
         if success:
-            conn.close()
             flash('ลงทะเบียนสำเร็จ! กรุณาตรวจสอบอีเมลเพื่อนำรหัสมายืนยันตัวตน', 'info')
             return redirect(url_for('verify_registration', email=email))
         else:
             # ถ้าส่งอีเมลไม่สำเร็จ ให้ลบ user ที่เพิ่งสร้างออกไป
             conn.execute('DELETE FROM users WHERE email = ?', (email,))
             conn.commit()
-            conn.close()
+            invalidate_user(cursor.lastrowid)
             flash('เกิดข้อผิดพลาดในการส่งอีเมลยืนยัน กรุณาลองใหม่อีกครั้ง', 'danger')
             return redirect(url_for('register'))
 
@@ -130,23 +238,21 @@ def verify_registration(email):
     if request.method == 'POST':
         submitted_otp = request.form.get('otp')
         conn = get_db_connection()
-        user_data = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        user_data = conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
 
         if not user_data:
             flash('ไม่พบอีเมลนี้ในระบบ', 'danger')
             return redirect(url_for('register'))
 
-        otp_expiry = datetime.strptime(user_data['otp_expiry'], '%Y-%m-%d %H:%M:%S')
-
-        if user_data['otp'] == submitted_otp and datetime.now() < otp_expiry:
+        verified, _ = otp_store.verify('register', email, submitted_otp)
+        if verified:
             # ยืนยันสำเร็จ
-            conn.execute('UPDATE users SET is_verified = ?, otp = NULL, otp_expiry = NULL WHERE email = ?', (True, email))
+            conn.execute('UPDATE users SET is_verified = ? WHERE email = ?', (True, email))
             conn.commit()
-            conn.close()
+            invalidate_user(user_data['id'])
             flash('ยืนยันอีเมลสำเร็จ! กรุณาล็อกอิน', 'success')
             return redirect(url_for('login'))
         else:
-            conn.close()
             flash('รหัส OTP ไม่ถูกต้องหรือหมดอายุแล้ว', 'danger')
             return redirect(url_for('verify_registration', email=email))
 
@@ -164,21 +270,34 @@ def login():
         password = request.form.get('password')
         conn = get_db_connection()
         user_data = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        
-        if user_data and check_password_hash(user_data['password'], password):
+
+        password_ok = False
+        if user_data:
+            try:
+                password_ok, new_hash = password_hasher.verify(user_data['password'], password)
+            except HasherBusy:
+                flash('ระบบกำลังมีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้ง', 'danger')
+                return redirect(url_for('login'))
+            if new_hash:
+                # hash เก่า (pbkdf2 หรือ cost ต่ำกว่าที่ตั้งไว้) -> เปลี่ยนเป็น hash ปัจจุบัน
+                conn.execute('UPDATE users SET password = ? WHERE id = ?', (new_hash, user_data['id']))
+                conn.commit()
+
+        if password_ok:
             if not user_data['is_verified']:
                 flash('บัญชีของคุณยังไม่ได้ยืนยันอีเมล กรุณาตรวจสอบอีเมลของคุณ', 'warning')
-                conn.close()
                 return redirect(url_for('verify_registration', email=email))
 
             # ขั้นตอนที่ 1: รหัสผ่านถูกต้อง -> เริ่ม 2FA
-            otp = generate_otp()
-            otp_expiry = datetime.now() + timedelta(minutes=10)
-            conn.execute('UPDATE users SET otp = ?, otp_expiry = ? WHERE id = ?', (otp, otp_expiry.strftime('%Y-%m-%d %H:%M:%S'), user_data['id']))
-            conn.commit()
-            conn.close()
+            # (ไม่เขียนตาราง users อีกต่อไป รหัสเก็บใน otp_store)
+            try:
+                otp = otp_store.issue('login', email, user_data['id'])
+            except RateLimited:
+                flash('ขอรหัสยืนยันบ่อยเกินไป กรุณารอสักครู่แล้วลองใหม่', 'danger')
+                return redirect(url_for('login'))
 
-            if send_otp_email(email, otp):
+            success, _ = send_otp_email(email, otp)
+            if success:
                 session['user_id_to_verify'] = user_data['id'] # เก็บ id ไว้ใน session ชั่วคราว
                 flash('กรุณาตรวจสอบอีเมลเพื่อนำรหัสมายืนยันการล็อกอิน', 'info')
                 return redirect(url_for('verify_login'))
@@ -186,7 +305,6 @@ def login():
                 flash('เกิดข้อผิดพลาดในการส่งรหัสยืนยัน', 'danger')
                 return redirect(url_for('login'))
         else:
-            conn.close()
             flash('Email หรือ Password ไม่ถูกต้อง', 'danger')
             return redirect(url_for('login'))
             
@@ -199,27 +317,22 @@ def verify_login():
 
     user_id = session['user_id_to_verify']
     conn = get_db_connection()
-    user_data = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    user_data = conn.execute('SELECT id, username, email FROM users WHERE id = ?', (user_id,)).fetchone()
 
     if request.method == 'POST':
         submitted_otp = request.form.get('otp')
-        otp_expiry = datetime.strptime(user_data['otp_expiry'], '%Y-%m-%d %H:%M:%S')
+        verified, otp_user_id = otp_store.verify('login', user_data['email'], submitted_otp)
 
-        if user_data['otp'] == submitted_otp and datetime.now() < otp_expiry:
+        if verified and otp_user_id == user_data['id']:
             # ยืนยัน 2FA สำเร็จ
-            conn.execute('UPDATE users SET otp = NULL, otp_expiry = NULL WHERE id = ?', (user_id,))
-            conn.commit()
-            conn.close()
             user = User(id=user_data['id'], username=user_data['username'], email=user_data['email'])
             login_user(user)
             session.pop('user_id_to_verify', None) # ล้าง session
             return redirect(url_for('dashboard'))
         else:
-            conn.close()
             flash('รหัส OTP ไม่ถูกต้องหรือหมดอายุแล้ว', 'danger')
             return redirect(url_for('verify_login'))
 
-    conn.close()
     return render_template('verify.html', email=user_data['email'], action_url=url_for('verify_login'))
 
 
@@ -237,50 +350,13 @@ def logout():
 @app.route('/')
 @login_required
 def dashboard():
-    conn = get_db_connection()
     user_id = current_user.id
-    
-    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    sales = conn.execute('SELECT s.*, p.factory_sku, p.name, p.details FROM sales s JOIN products p ON s.product_id = p.product_id WHERE s.deleted_at IS NULL AND s.user_id = ?', (user_id,)).fetchall()
-    products = conn.execute('SELECT * FROM products WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    payments = conn.execute('SELECT * FROM payments WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
+    refresh_costs(get_db_connection(), user_id)  # ใช้ต้นทุนของรายการที่เพิ่งบันทึกด้วย
+    conn = get_report_connection()
+    figures = dashboard_figures(conn, user_id)
     low_stock_products = conn.execute('SELECT * FROM products WHERE stock <= 10 AND deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
+    return render_template('dashboard.html', low_stock_products=low_stock_products, **figures)
 
-    total_stock_remaining_data = conn.execute('SELECT SUM(stock) as total FROM products WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchone()
-    total_stock_remaining = total_stock_remaining_data['total'] if total_stock_remaining_data and total_stock_remaining_data['total'] is not None else 0
-
-
-    cost_map = {o['factory_sku']: o['cost_per_item'] for o in orders}
-    total_revenue = sum(s['quantity'] * s['price_per_item'] for s in sales)
-    total_items_sold = sum(s['quantity'] for s in sales)
-    total_cost_of_goods_sold = sum(cost_map.get(s['factory_sku'], 0) * s['quantity'] for s in sales)
-    net_profit = total_revenue - total_cost_of_goods_sold
-    net_profit_margin = (net_profit / total_revenue * 100) if total_revenue > 0 else 0
-    current_stock_value = sum(cost_map.get(p['factory_sku'], 0) * p['stock'] for p in products)
-    
-    product_profit = {}
-    for sale in sales:
-        profit = (sale['price_per_item'] - cost_map.get(sale['factory_sku'], 0)) * sale['quantity']
-        product_key = f"{sale['name']} ({sale['details']})"
-        product_profit[product_key] = product_profit.get(product_key, 0) + profit
-        
-    top_profitable_products = sorted(product_profit.items(), key=lambda item: item[1], reverse=True)[:5]
-    total_order_costs = sum(o['quantity'] * o['cost_per_item'] for o in orders)
-    total_payments_sum = sum(p['amount'] for p in payments)
-    total_outstanding = total_order_costs - total_payments_sum
-
-    conn.close()
-    return render_template('dashboard.html', 
-                           net_profit=net_profit, 
-                           total_revenue=total_revenue, 
-                           total_cost_of_goods_sold=total_cost_of_goods_sold, 
-                           net_profit_margin=net_profit_margin, 
-                           total_items_sold=total_items_sold, 
-                           current_stock_value=current_stock_value, 
-                           top_profitable_products=top_profitable_products, 
-                           low_stock_products=low_stock_products, 
-                           total_outstanding=total_outstanding,
-                           total_stock_remaining=total_stock_remaining)
 @app.route('/forms/stock-in')
 @login_required
 def forms_stock_in():
@@ -290,186 +366,284 @@ def forms_stock_in():
 @login_required
 def forms_stock_out():
     return render_template('stock_out_forms.html')
+
+# header ที่ต้องเก็บไว้กับ body ใน response cache
+CACHED_HEADERS = ('Content-Disposition',)
+
+def _cache_entry(body, response):
+    return body, response.mimetype, {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+
+def _cache_streamed_body(key, body, response):
+    """Passes a streamed body through and caches it at the end if it stayed small enough."""
+    chunks, size = [], 0
+    try:
+        for chunk in body:
+            yield chunk
+            if chunks is not None:
+                chunks.append(chunk.encode() if isinstance(chunk, str) else chunk)
+                size += len(chunks[-1])
+                if size > response_cache.max_entry_bytes:
+                    chunks = None  # ใหญ่เกินไป ส่งต่ออย่างเดียว
+        if chunks is not None:
+            response_cache.set(key, _cache_entry(b''.join(chunks), response))
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+def conditional_response(build, conn=None):
+    """
+    Answers a read-only GET from the current user's data version (versions.py):
+    304 when the client's ETag is still current, the cached body when this
+    worker already built it at the same version, otherwise build(), cached
+    if it is small enough. Call refresh_costs() first, since applying
+    queued costs changes the version. Pass the connection build() reads
+    from, so a replica's older data gets that replica's version.
+    """
+    conn = conn or get_db_connection()
+    user_id = current_user.id
+    version = data_version(conn, user_id)
+    key = (user_id, request.path, request.query_string, version)
+    digest = hashlib.blake2b(repr(key[1:3]).encode(), digest_size=6).hexdigest()
+    etag = f'{user_id}-{version}-{digest}'
+    if request.if_none_match.contains_weak(etag):
+        response_cache.count_not_modified()
+        response = Response(status=304)
+    else:
+        cached = response_cache.get(key)
+        if cached is not None:
+            body, mimetype, headers = cached
+            response = Response(body, mimetype=mimetype, headers=headers)
+        else:
+            response = make_response(build())
+            if response.status_code != 200:
+                return response
+            if response.is_streamed:
+                response.response = _cache_streamed_body(key, response.response, response)
+            else:
+                response_cache.set(key, _cache_entry(response.get_data(), response))
+    response.set_etag(etag, weak=True)
+    # เบราว์เซอร์เก็บได้แต่ต้องถามทุกครั้ง (ได้ 304 ถ้าไม่มีอะไรเปลี่ยน)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def report_range():
+    """Parses ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive) into (start, end exclusive) dates."""
+    start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() + timedelta(days=1) if request.args.get('to') else None
+    return start, end
+
 @app.route('/api/performance_data')
 @login_required
 def performance_data():
-    conn = get_db_connection()
-    user_id = current_user.id
-    sales = conn.execute('SELECT sale_date, quantity, price_per_item, product_id FROM sales WHERE deleted_at IS NULL AND user_id = ? ORDER BY sale_date ASC', (user_id,)).fetchall()
-    orders = conn.execute('SELECT factory_sku, cost_per_item FROM orders WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    cost_map = {o['factory_sku']: o['cost_per_item'] for o in orders}
-    daily_data = {}
-
-    for sale in sales:
-        day = datetime.strptime(sale['sale_date'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-        
-        if day not in daily_data:
-            daily_data[day] = {'revenue': 0, 'cost': 0, 'profit': 0}
-            
-        revenue = sale['quantity'] * sale['price_per_item']
-        
-        product_info = conn.execute('SELECT factory_sku FROM products WHERE product_id = ? AND user_id = ?', (sale['product_id'], user_id)).fetchone()
-        cost = 0
-        if product_info:
-            factory_sku = product_info['factory_sku']
-            cost_per_item = cost_map.get(factory_sku, 0)
-            cost = cost_per_item * sale['quantity']
-        
-        daily_data[day]['revenue'] += revenue
-        daily_data[day]['cost'] += cost
-        daily_data[day]['profit'] += (revenue - cost)
-        
-    conn.close()
-
-    sorted_days = sorted(daily_data.keys())
-    chart_data = {
-        'labels': sorted_days,
-        'datasets': [
-            {'label': 'ยอดขาย', 'data': [daily_data[day]['revenue'] for day in sorted_days], 'borderColor': 'rgba(75, 192, 192, 1)', 'tension': 0.1},
-            {'label': 'ต้นทุน', 'data': [daily_data[day]['cost'] for day in sorted_days], 'borderColor': 'rgba(255, 99, 132, 1)', 'tension': 0.1},
-            {'label': 'กำไร', 'data': [daily_data[day]['profit'] for day in sorted_days], 'borderColor': 'rgba(54, 162, 235, 1)', 'tension': 0.1}
-        ]
-    }
-    return jsonify(chart_data)
+    """
+    Revenue/cost/profit per day, week or month, answered from the sales rollups.
+    Optional query parameters: from=YYYY-MM-DD, to=YYYY-MM-DD (inclusive)
+    and granularity=day|week|month (default day).
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in BUCKET_LABELS:
+        return jsonify({'error': 'granularity must be one of: day, week, month'}), 400
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be dates in YYYY-MM-DD format'}), 400
+
+    refresh_costs(get_db_connection(), current_user.id)
+    conn = get_report_connection()
+
+    def build():
+        rows = sales_report(conn, current_user.id, granularity, start, end)
+        # ยอดรวมเป็นสตางค์ (จำนวนเต็ม) แปลงเป็นบาทตอนส่งออกเท่านั้น
+        labels = [row['bucket'] for row in rows]
+        chart_data = {
+            'labels': labels,
+            'datasets': [
+                {'label': 'ยอดขาย', 'data': [row['revenue_satang'] / 100 for row in rows], 'borderColor': 'rgba(75, 192, 192, 1)', 'tension': 0.1},
+                {'label': 'ต้นทุน', 'data': [row['cost_satang'] / 100 for row in rows], 'borderColor': 'rgba(255, 99, 132, 1)', 'tension': 0.1},
+                {'label': 'กำไร', 'data': [(row['revenue_satang'] - row['cost_satang']) / 100 for row in rows], 'borderColor': 'rgba(54, 162, 235, 1)', 'tension': 0.1}
+            ]
+        }
+        return jsonify(chart_data)
+    return conditional_response(build, conn)
+
+@app.route('/api/reports')
+@login_required
+def api_reports():
+    """
+    Sales report from the rollup tables.
+    ?granularity=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD&group=total|product
+    """
+    granularity = request.args.get('granularity', 'month')
+    group = request.args.get('group', 'total')
+    if granularity not in BUCKET_LABELS:
+        return jsonify({'error': 'granularity must be one of: day, week, month'}), 400
+    if group not in ('total', 'product'):
+        return jsonify({'error': 'group must be total or product'}), 400
+    try:
+        start, end = report_range()
+    except ValueError:
+        return jsonify({'error': 'from/to must be dates in YYYY-MM-DD format'}), 400
+
+    refresh_costs(get_db_connection(), current_user.id)
+    conn = get_report_connection()
+
+    def build():
+        rows = sales_report(conn, current_user.id, granularity, start, end, by_product=(group == 'product'))
+        items = []
+        for row in rows:
+            item = dict(row)
+            item['revenue'] = item.pop('revenue_satang') / 100
+            item['cost'] = item.pop('cost_satang') / 100
+            item['profit'] = round(item['revenue'] - item['cost'], 2)
+            items.append(item)
+        return jsonify({'granularity': granularity, 'group': group,
+                        'from': request.args.get('from'), 'to': request.args.get('to'), 'items': items})
+    return conditional_response(build, conn)
 
 @app.route('/accounting')
 @login_required
 def accounting_page():
-    conn = get_db_connection()
-    user_id = current_user.id
-    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ? ORDER BY order_date DESC', (user_id,)).fetchall()
-    payments = conn.execute('SELECT * FROM payments WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    
-    payments_map = {}
-    for payment in payments:
-        order_id = payment['order_id']
-        payments_map[order_id] = payments_map.get(order_id, 0) + payment['amount']
-
-    accounting_data = []
-    total_order_costs = 0
-    total_paid_amount = 0
-
-    for order in orders:
-        order_id = order['order_id']
-        total_cost = order['quantity'] * order['cost_per_item']
-        paid_amount = payments_map.get(order_id, 0)
-        outstanding = total_cost - paid_amount
-
-        accounting_data.append({
-            'order_id': order_id,
-            'product_details': order['product_details'],
-            'factory_sku': order['factory_sku'],
-            'order_date': order['order_date'],
-            'total_cost': total_cost,
-            'paid_amount': paid_amount,
-            'outstanding': outstanding
-        })
-        total_order_costs += total_cost
-        total_paid_amount += paid_amount
-
-    total_outstanding = total_order_costs - total_paid_amount
-    conn.close()
-    
+    conn = get_report_connection()
+    accounting_data = order_balances(conn, current_user.id)
+    total_order_costs, total_paid_amount, total_outstanding = ledger_totals(accounting_data)
+
     return render_template('accounting.html', 
                            accounting_data=accounting_data,
                            total_order_costs=total_order_costs,
                            total_paid_amount=total_paid_amount,
                            total_outstanding=total_outstanding)
 
+def export_response(kind):
+    """
+    Shared handler for the JSON APIs and /data exports.
+    ?limit=N&after=<id>&since=<date> returns one keyset page;
+    otherwise every row is streamed as a JSON array, or as NDJSON/CSV with ?format=.
+    Answers go through conditional_response() (ETag/304 and the response cache).
+    """
+    try:
+        after = request.args.get('after', type=int)
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS'}), 400
+    limit = request.args.get('limit', type=int)
+    fmt = request.args.get('format', 'json')
+    conn = get_db_connection()
+    user_id = current_user.id
+
+    def build():
+        if limit:
+            return jsonify(fetch_page(conn, kind, user_id, limit, after, since))
+        cursor = select_rows(conn, kind, user_id, after, since)
+        if fmt == 'csv':
+            return Response(stream_with_context(stream_csv(cursor)), mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename={kind}.csv'})
+        if fmt == 'ndjson':
+            return Response(stream_with_context(stream_ndjson(cursor)), mimetype='application/x-ndjson')
+        return Response(stream_with_context(stream_json_array(cursor)), mimetype='application/json')
+    return conditional_response(build)
+
 @app.route('/api/products')
 @login_required
 def api_products():
-    conn = get_db_connection()
-    products = conn.execute('SELECT * FROM products WHERE deleted_at IS NULL AND user_id = ?', (current_user.id,)).fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in products])
+    return export_response('products')
 
 @app.route('/api/orders')
 @login_required
 def api_orders():
+    return export_response('orders')
+
+@app.route('/api/products/search')
+@login_required
+def api_product_search():
+    """
+    ?q=<text>&limit=N returns the best matching products (name, sku, factory_sku, details);
+    ?sku=<exact sku> returns every variant of that SKU for the details picker.
+    """
     conn = get_db_connection()
-    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ?', (current_user.id,)).fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in orders])
+
+    def build():
+        if request.args.get('sku'):
+            rows = product_variants(conn, current_user.id, request.args['sku'])
+        else:
+            rows = search_products(conn, current_user.id, request.args.get('q', ''),
+                                   request.args.get('limit', SEARCH_LIMIT, type=int))
+        return jsonify([dict(row) for row in rows])
+    return conditional_response(build)
+
+@app.route('/data/export/<item_type>')
+@login_required
+def data_export(item_type):
+    if item_type not in EXPORTS:
+        return jsonify({'error': f'unknown export: {item_type}'}), 404
+    return export_response(item_type)
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    """
+    Bulk import from an uploaded CSV, JSON array or NDJSON file.
+    Form fields: file, kind (products/orders/sales/payments), optional format
+    and skip (records already imported by an earlier, interrupted upload).
+    """
+    kind = request.form.get('kind')
+    upload = request.files.get('file')
+    if kind not in IMPORT_KINDS or upload is None:
+        return jsonify({'error': f'file and kind ({", ".join(sorted(IMPORT_KINDS))}) are required'}), 400
+
+    fmt = request.form.get('format') or detect_format(upload.filename)
+    skip = request.form.get('skip', 0, type=int)
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    importer = Importer(get_db_connection(), current_user.id, kind)
+    try:
+        result = importer.run(iter_records(stream, fmt), skip)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'imported': importer.imported, 'skipped': importer.skipped}), 400
+    return jsonify(result)
 
 @app.route('/submit_order', methods=['POST'])
 @login_required
 def submit_order():
-    product_details_list = request.form.getlist('product_details[]')
-    factory_sku_list = request.form.getlist('factory_sku[]')
-    quantity_list = request.form.getlist('quantity[]')
-    cost_per_item_list = request.form.getlist('cost_per_item[]')
-
     conn = get_db_connection()
-    user_id = current_user.id
-    for product_details, factory_sku, quantity, cost_per_item in zip(product_details_list, factory_sku_list, quantity_list, cost_per_item_list):
-        if product_details and factory_sku and quantity and cost_per_item:
-            conn.execute('INSERT INTO orders (product_details, factory_sku, quantity, cost_per_item, order_date, user_id) VALUES (?, ?, ?, ?, ?, ?)',
-                         (product_details, factory_sku, int(quantity), float(cost_per_item), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id))
-    conn.commit()
-    conn.close()
+    insert_orders(conn, current_user.id,
+                  request.form.getlist('product_details[]'),
+                  request.form.getlist('factory_sku[]'),
+                  request.form.getlist('quantity[]'),
+                  request.form.getlist('cost_per_item[]'))
     flash('คุณได้บันทึกข้อมูล "สั่งซื้อ" เรียบร้อยแล้ว!')
     return redirect(url_for('forms_stock_in'))
 
 @app.route('/submit_stock_in', methods=['POST'])
 @login_required
 def submit_stock_in():
-    product_name_list = request.form.getlist('product_name[]')
-    sku_list = request.form.getlist('sku[]')
-    factory_sku_list = request.form.getlist('factory_sku[]')
-    details_list = request.form.getlist('details[]')
-    quantity_list = request.form.getlist('quantity[]')
-    group_index_list = request.form.getlist('group_index[]')
-    
     conn = get_db_connection()
-    user_id = current_user.id
-    for main_index, (product_name, sku, factory_sku) in enumerate(zip(product_name_list, sku_list, factory_sku_list)):
-        for i, details in enumerate(details_list):
-            if i < len(group_index_list) and int(group_index_list[i]) == main_index:
-                quantity = quantity_list[i]
-                if product_name and sku and factory_sku and details and quantity:
-                    quantity_int = int(quantity)
-                    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    existing_product = conn.execute('SELECT * FROM products WHERE sku = ? AND details = ? AND user_id = ?', (sku, details, user_id)).fetchone()
-                    if existing_product:
-                        conn.execute('UPDATE products SET stock = stock + ? WHERE sku = ? AND details = ? AND user_id = ?', (quantity_int, sku, details, user_id))
-                    else:
-                        conn.execute('INSERT INTO products (name, sku, factory_sku, details, stock, created_at, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                                     (product_name, sku, factory_sku, details, quantity_int, created_at, user_id))
-    conn.commit()
-    conn.close()
+    stock_in(conn, current_user.id,
+             request.form.getlist('product_name[]'),
+             request.form.getlist('sku[]'),
+             request.form.getlist('factory_sku[]'),
+             request.form.getlist('details[]'),
+             request.form.getlist('quantity[]'),
+             request.form.getlist('group_index[]'))
     flash('คุณได้บันทึกข้อมูล "รับของ" เรียบร้อยแล้ว!')
     return redirect(url_for('forms_stock_in'))
 
 @app.route('/submit_stock_out', methods=['POST'])
 @login_required
 def submit_stock_out():
-    sku_list = request.form.getlist('sku[]')
-    details_list = request.form.getlist('details[]')
-    quantity_list = request.form.getlist('quantity[]')
-    price_list = request.form.getlist('price[]')
-    group_index_list = request.form.getlist('group_index[]')
-
     conn = get_db_connection()
-    user_id = current_user.id
-    for main_index, sku in enumerate(sku_list):
-        for i, details in enumerate(details_list):
-            if i < len(group_index_list) and int(group_index_list[i]) == main_index:
-                quantity = quantity_list[i]
-                price = price_list[i]
-                if details and quantity and price:
-                    quantity_int = int(quantity)
-                    price_float = float(price)
-                    sale_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    product = conn.execute('SELECT product_id FROM products WHERE sku = ? AND details = ? AND user_id = ?', (sku, details, user_id)).fetchone()
-                    if product:
-                        product_id = product['product_id']
-                        conn.execute('INSERT INTO sales (product_id, quantity, price_per_item, sale_date, user_id) VALUES (?, ?, ?, ?, ?)',
-                                     (product_id, quantity_int, price_float, sale_date, user_id))
-                        conn.execute('UPDATE products SET stock = stock - ? WHERE product_id = ? AND user_id = ?', (quantity_int, product_id, user_id))
-    conn.commit()
-    conn.close()
-    flash('คุณได้บันทึกข้อมูล "ขายออก" เรียบร้อยแล้ว!')
+    results = stock_out(conn, current_user.id,
+                        request.form.getlist('sku[]'),
+                        request.form.getlist('details[]'),
+                        request.form.getlist('quantity[]'),
+                        request.form.getlist('price[]'),
+                        request.form.getlist('group_index[]'))
+    not_found = [f"{r['sku']} ({r['details']})" for r in results if r['status'] == 'not_found']
+    if not_found:
+        flash(f'ไม่พบสินค้า: {", ".join(not_found)}', 'warning')
+    short = [f"{r['sku']} ({r['details']}) มี {r['available']} ชิ้น" for r in results if r['status'] == 'insufficient_stock']
+    if short:
+        flash(f'สต็อกไม่พอ ไม่ได้บันทึกการขาย: {", ".join(short)}', 'warning')
+    if any(r['status'] == 'sold' for r in results):
+        flash('คุณได้บันทึกข้อมูล "ขายออก" เรียบร้อยแล้ว!')
     return redirect(url_for('forms_stock_out'))
 
 @app.route('/submit_payment', methods=['POST'])
@@ -494,25 +668,24 @@ def submit_payment():
         flash('บันทึกการชำระเงินเรียบร้อยแล้ว!')
     else:
         flash('ไม่พบ Order ID หรือคุณไม่มีสิทธิ์ในการชำระเงินนี้', 'danger')
-    conn.close()
     return redirect(url_for('accounting_page'))
     
 @app.route('/data')
 @login_required
 def data_management():
-    conn = get_db_connection()
+    # ส่ง cursor ให้ template แล้ว stream ออกไปทีละแถว ไม่ต้อง fetchall() ทั้งตาราง
+    conn = get_report_connection()
     user_id = current_user.id
-    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ? ORDER BY order_id DESC', (user_id,)).fetchall()
-    products = conn.execute('SELECT * FROM products WHERE deleted_at IS NULL AND user_id = ? ORDER BY product_id DESC', (user_id,)).fetchall()
+    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ? ORDER BY order_id DESC', (user_id,))
+    products = conn.execute('SELECT * FROM products WHERE deleted_at IS NULL AND user_id = ? ORDER BY product_id DESC', (user_id,))
     sales_with_details = conn.execute('''
         SELECT s.sale_id, p.sku, p.details, s.quantity, s.price_per_item, s.sale_date, s.updated_at
         FROM sales s
         JOIN products p ON s.product_id = p.product_id
         WHERE s.deleted_at IS NULL AND s.user_id = ?
         ORDER BY s.sale_id DESC
-    ''', (user_id,)).fetchall()
-    conn.close()
-    return render_template('data_management.html',
+    ''', (user_id,))
+    return stream_template('data_management.html',
                            orders=orders, products=products, sales_with_details=sales_with_details)
 
 @app.route('/delete/<item_type>/<int:item_id>')
@@ -528,7 +701,6 @@ def soft_delete(item_type, item_id):
     elif item_type == 'sale':
         conn.execute('UPDATE sales SET deleted_at = ? WHERE sale_id = ? AND user_id = ?', (delete_time, item_id, user_id))
     conn.commit()
-    conn.close()
     flash(f'ลบข้อมูล {item_type} หมายเลข {item_id} สำเร็จ (ย้ายไปถังขยะ)', 'success')
     return redirect(url_for('data_management'))
 
@@ -541,7 +713,6 @@ def trash_bin():
     deleted_orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NOT NULL AND deleted_at >= ? AND user_id = ?', (three_days_ago, user_id)).fetchall()
     deleted_products = conn.execute('SELECT * FROM products WHERE deleted_at IS NOT NULL AND deleted_at >= ? AND user_id = ?', (three_days_ago, user_id)).fetchall()
     deleted_sales = conn.execute('SELECT * FROM sales WHERE deleted_at IS NOT NULL AND deleted_at >= ? AND user_id = ?', (three_days_ago, user_id)).fetchall()
-    conn.close()
     return render_template('trash.html', orders=deleted_orders, products=deleted_products, sales=deleted_sales)
 
 @app.route('/restore/<item_type>/<int:item_id>')
@@ -556,24 +727,14 @@ def restore_item(item_type, item_id):
     elif item_type == 'sale':
         conn.execute('UPDATE sales SET deleted_at = NULL WHERE sale_id = ? AND user_id = ?', (item_id, user_id))
     conn.commit()
-    conn.close()
     flash(f'กู้คืนข้อมูล {item_type} หมายเลข {item_id} สำเร็จ', 'success')
     return redirect(url_for('trash_bin'))
 
 @app.route('/outstanding')
 @login_required
 def outstanding_page():
-    conn = get_db_connection()
-    user_id = current_user.id
-    orders = conn.execute('SELECT * FROM orders WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    outstanding_items = []
-    for order in orders:
-        payments_for_order = conn.execute('SELECT SUM(amount) as total_paid FROM payments WHERE order_id = ? AND user_id = ?', (order['order_id'], user_id)).fetchone()
-        total_paid = payments_for_order['total_paid'] if payments_for_order['total_paid'] else 0
-        outstanding_amount = (order['quantity'] * order['cost_per_item']) - total_paid
-        if outstanding_amount > 0:
-            outstanding_items.append({'factory_sku': order['factory_sku'], 'amount': outstanding_amount, 'order_id': order['order_id']})
-    conn.close()
+    conn = get_report_connection()
+    outstanding_items = order_balances(conn, current_user.id, outstanding_only=True)
     return render_template('outstanding.html', outstanding_items=outstanding_items)
 
 @app.route('/edit/order/<int:order_id>', methods=['GET', 'POST'])
@@ -589,12 +750,10 @@ def edit_order(order_id):
         conn.execute('UPDATE orders SET product_details = ?, factory_sku = ?, quantity = ?, cost_per_item = ?, updated_at = ? WHERE order_id = ? AND user_id = ?',
              (product_details, factory_sku, quantity, cost_per_item, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), order_id, user_id))
         conn.commit()
-        conn.close()
         flash('แก้ไขข้อมูล Order สำเร็จ', 'success')
         return redirect(url_for('data_management'))
     
     order = conn.execute('SELECT * FROM orders WHERE order_id = ? AND user_id = ?', (order_id, user_id)).fetchone()
-    conn.close()
     if order is None:
         flash('ไม่พบข้อมูล Order หรือคุณไม่มีสิทธิ์เข้าถึง', 'danger')
         return redirect(url_for('data_management'))
@@ -611,15 +770,17 @@ def edit_product(product_id):
         factory_sku = request.form['factory_sku']
         details = request.form['details']
         stock = int(request.form['stock'])
-        conn.execute('UPDATE products SET name = ?, sku = ?, factory_sku = ?, details = ?, stock = ?, updated_at = ? WHERE product_id = ? AND user_id = ?',
-             (name, sku, factory_sku, details, stock, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), product_id, user_id))
+        try:
+            conn.execute('UPDATE products SET name = ?, sku = ?, factory_sku = ?, details = ?, stock = ?, updated_at = ? WHERE product_id = ? AND user_id = ?',
+                 (name, sku, factory_sku, details, stock, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), product_id, user_id))
+        except sqlite3.IntegrityError:
+            flash('มีสินค้า SKU และรายละเอียดนี้อยู่แล้ว', 'danger')
+            return redirect(url_for('edit_product', product_id=product_id))
         conn.commit()
-        conn.close()
         flash('แก้ไขข้อมูล Product สำเร็จ', 'success')
         return redirect(url_for('data_management'))
         
     product = conn.execute('SELECT * FROM products WHERE product_id = ? AND user_id = ?', (product_id, user_id)).fetchone()
-    conn.close()
     if product is None:
         flash('ไม่พบข้อมูล Product หรือคุณไม่มีสิทธิ์เข้าถึง', 'danger')
         return redirect(url_for('data_management'))
@@ -637,13 +798,11 @@ def edit_sale(sale_id):
         conn.execute('UPDATE sales SET product_id = ?, quantity = ?, price_per_item = ?, updated_at = ? WHERE sale_id = ? AND user_id = ?',
              (product_id, quantity, price_per_item, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sale_id, user_id))
         conn.commit()
-        conn.close()
         flash('แก้ไขข้อมูล Sale สำเร็จ', 'success')
         return redirect(url_for('data_management'))
         
     sale = conn.execute('SELECT * FROM sales WHERE sale_id = ? AND user_id = ?', (sale_id, user_id)).fetchone()
     products = conn.execute('SELECT * FROM products WHERE deleted_at IS NULL AND user_id = ?', (user_id,)).fetchall()
-    conn.close()
     if sale is None:
         flash('ไม่พบข้อมูล Sale หรือคุณไม่มีสิทธิ์เข้าถึง', 'danger')
         return redirect(url_for('data_management'))
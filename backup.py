@@ -0,0 +1,357 @@
+"""
+Online backups of the database with the sqlite3 backup API, plus restore.
+
+A run copies the database into BACKUP_DIR with Connection.backup(), in
+steps of BACKUP_STEP_PAGES pages. The source connection holds one read
+transaction for the whole copy, so every step reads the same WAL snapshot.
+Writers keep committing in the meantime. Without that read transaction,
+SQLite restarts a stepped backup whenever another connection writes, and
+on a busy database it may never finish. The copy is then checked with
+PRAGMA integrity_check (BACKUP_VERIFY=quick for quick_check, off to skip),
+gzip-compressed and renamed into place as <name>-YYYYmmdd-HHMMSS.db.gz. Only
+the newest BACKUP_KEEP snapshots are kept. Each run reports how long the
+copy, check and compression took and their MB/s, and logs to backup_runs.
+
+    python backup.py                        # one backup
+    python backup.py --loop                 # one every BACKUP_INTERVAL_SECONDS
+    python backup.py list
+    python backup.py restore                # newest snapshot -> DATABASE_PATH
+    python backup.py restore --at '2026-10-01 18:00' --name inventory --database /tmp/check.db
+    python backup.py restore backups/inventory-20261001-180000.db.gz --force
+
+A restore checks the snapshot first, then writes it into the target through
+the backup API as well, so the target's WAL and shared-memory files stay
+consistent. An existing target is only overwritten with --force, and its
+current contents are first saved as <target>.before-restore. Stop the app
+before restoring over the live database.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 14))
+BACKUP_INTERVAL_SECONDS = float(os.environ.get('BACKUP_INTERVAL_SECONDS', 3600))
+# 1024 pages = 4 MiB ต่อ step เมื่อ page_size 4096
+BACKUP_STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 1024))
+# หยุดพักระหว่าง step เพื่อจำกัด I/O ของการ backup (0 = ไม่พัก)
+BACKUP_STEP_PAUSE_SECONDS = float(os.environ.get('BACKUP_STEP_PAUSE_SECONDS', 0))
+# gzip 1 เร็วกว่า 6 ราว 3 เท่า ไฟล์ใหญ่ขึ้นเล็กน้อย; 0 = ไม่บีบอัด เก็บเป็นไฟล์ .db
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', 1))
+BACKUP_VERIFY = os.environ.get('BACKUP_VERIFY', 'integrity')
+
+VERIFY_PRAGMAS = {'integrity': 'integrity_check', 'quick': 'quick_check'}
+SNAPSHOT_TIME_FORMAT = '%Y%m%d-%H%M%S'
+CHUNK_BYTES = 1024 * 1024
+
+BACKUP_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS backup_runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        path TEXT NOT NULL,
+        ok INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        bytes INTEGER NOT NULL,
+        compressed_bytes INTEGER NOT NULL,
+        details TEXT NOT NULL
+    )
+    ''',
+]
+
+
+class BackupError(Exception):
+    """Raised when a copy fails its integrity check or there is no snapshot to restore."""
+
+
+def create_backup_tables(c):
+    for statement in BACKUP_SCHEMA:
+        c.execute(statement)
+
+def _mb_per_second(size, seconds):
+    return round(size / 1048576 / seconds, 1) if seconds > 0 else None
+
+def _stem(database):
+    return os.path.splitext(os.path.basename(database))[0]
+
+def list_snapshots(directory=BACKUP_DIR, stem=None):
+    """[(taken at, path)] oldest first, for every snapshot of `stem` (default: all databases)."""
+    pattern = re.compile(rf'^({re.escape(stem) if stem else ".+"})-(\d{{8}}-\d{{6}})\.db(\.gz)?$')
+    snapshots = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        match = pattern.match(name)
+        if match:
+            taken_at = datetime.strptime(match.group(2), SNAPSHOT_TIME_FORMAT)
+            snapshots.append((taken_at, os.path.join(directory, name)))
+    return sorted(snapshots)
+
+def copy_online(database, target, step_pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE_SECONDS):
+    """
+    Copies `database` into the new file `target` a step at a time from one
+    read snapshot. Returns pages, page size, steps and the longest step.
+    """
+    source = sqlite3.connect(database, timeout=30)
+    copy = sqlite3.connect(target)
+    steps = 0
+    longest = 0.0
+    step_started = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal steps, longest, step_started
+        steps += 1
+        longest = max(longest, time.perf_counter() - step_started)
+        if pause:
+            time.sleep(pause)
+        step_started = time.perf_counter()
+
+    try:
+        # เปิด read transaction ค้างไว้ทั้งการคัดลอก ทุก step อ่าน snapshot เดียวกัน
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(copy, pages=step_pages, progress=progress)
+        source.rollback()
+        copy.execute('PRAGMA journal_mode = DELETE')
+        page_size = copy.execute('PRAGMA page_size').fetchone()[0]
+        pages = copy.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        copy.close()
+        source.close()
+    return {'pages': pages, 'page_size': page_size, 'steps': steps, 'longest_step_ms': round(longest * 1000, 1)}
+
+def verify(path, mode=BACKUP_VERIFY):
+    """Runs integrity_check (or quick_check) on an uncompressed database file; raises BackupError if it fails."""
+    if mode == 'off':
+        return
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute(f'PRAGMA {VERIFY_PRAGMAS[mode]}')]
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+    finally:
+        conn.close()
+    if problems != ['ok']:
+        raise BackupError(f"{path} failed {VERIFY_PRAGMAS[mode]}: {'; '.join(problems[:5])}")
+
+def compress(path, target, level=BACKUP_COMPRESSION_LEVEL):
+    with open(path, 'rb') as src, gzip.open(target, 'wb', compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_BYTES)
+
+def decompress(path, target):
+    with gzip.open(path, 'rb') as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_BYTES)
+
+def rotate(directory, stem, keep=BACKUP_KEEP):
+    """Deletes all but the newest `keep` snapshots of `stem`. Returns the removed paths."""
+    snapshots = list_snapshots(directory, stem)
+    removed = [path for _, path in snapshots[:-keep]] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def record_run(database, metrics):
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        with conn:
+            create_backup_tables(conn)
+            conn.execute('''
+                INSERT INTO backup_runs (started_at, path, ok, seconds, bytes, compressed_bytes, details)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (metrics['started_at'], metrics.get('path', ''), int(metrics['ok']), metrics['seconds'],
+                  metrics.get('bytes', 0), metrics.get('compressed_bytes', 0), json.dumps(metrics)))
+    finally:
+        conn.close()
+
+def run(database, directory=BACKUP_DIR, keep=BACKUP_KEEP, step_pages=BACKUP_STEP_PAGES,
+        pause=BACKUP_STEP_PAUSE_SECONDS, level=BACKUP_COMPRESSION_LEVEL, verify_mode=BACKUP_VERIFY, name=None):
+    """
+    One backup of `database` into `directory`. Returns a metrics dict with
+    the time and MB/s of each phase, and logs it to backup_runs. A copy
+    that fails its check is deleted, and BackupError is raised.
+    """
+    if not os.path.exists(database):
+        raise BackupError(f'{database} not found')
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    now = datetime.now()
+    stem = name or _stem(database)
+    name = f'{stem}-{now.strftime(SNAPSHOT_TIME_FORMAT)}.db'
+    final = os.path.join(directory, name + ('.gz' if level else ''))
+    temporary = os.path.join(directory, f'.{name}.tmp')
+    metrics = {'started_at': now.strftime('%Y-%m-%d %H:%M:%S'), 'database': database, 'ok': False}
+    try:
+        phase = time.perf_counter()
+        metrics.update(copy_online(database, temporary, step_pages, pause))
+        metrics['bytes'] = metrics['pages'] * metrics['page_size']
+        metrics['copy_seconds'] = round(time.perf_counter() - phase, 3)
+
+        phase = time.perf_counter()
+        verify(temporary, verify_mode)
+        metrics['verify'] = verify_mode
+        metrics['verify_seconds'] = round(time.perf_counter() - phase, 3)
+
+        phase = time.perf_counter()
+        if level:
+            compress(temporary, temporary + '.gz', level)
+            os.remove(temporary)
+            os.replace(temporary + '.gz', final)
+        else:
+            os.replace(temporary, final)
+        metrics['compress_seconds'] = round(time.perf_counter() - phase, 3)
+        metrics['compressed_bytes'] = os.path.getsize(final)
+        metrics['path'] = final
+        metrics['removed'] = rotate(directory, stem, keep)
+        metrics['ok'] = True
+    except BaseException as e:
+        metrics['error'] = str(e)
+        raise
+    finally:
+        for path in (temporary, temporary + '.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+        metrics['seconds'] = round(time.perf_counter() - started, 3)
+        for phase in ('copy', 'verify', 'compress'):
+            if f'{phase}_seconds' in metrics:
+                metrics[f'{phase}_mb_per_second'] = _mb_per_second(metrics['bytes'], metrics[f'{phase}_seconds'])
+        try:
+            record_run(database, metrics)
+        except sqlite3.Error as e:
+            print(f"ERROR: [backup] - could not log the run: {e}")
+    return metrics
+
+def last_run(conn):
+    """The most recent run from backup_runs (None before the first one), for metrics."""
+    row = conn.execute('SELECT started_at, ok, seconds, bytes, compressed_bytes FROM backup_runs ORDER BY id DESC LIMIT 1').fetchone()
+    if row is None:
+        return None
+    result = dict(zip(['started_at', 'ok', 'seconds', 'bytes', 'compressed_bytes'], row))
+    result['age_seconds'] = round((datetime.now() - datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')).total_seconds())
+    return result
+
+def find_snapshot(directory, stem, at=None):
+    """The newest snapshot of `stem`, or the newest one taken at or before `at`."""
+    candidates = [(taken_at, path) for taken_at, path in list_snapshots(directory, stem) if at is None or taken_at <= at]
+    if not candidates:
+        raise BackupError(f"no snapshot of {stem} in {directory}{f' taken at or before {at}' if at else ''}")
+    return candidates[-1][1]
+
+def restore(snapshot, database, force=False, verify_mode=BACKUP_VERIFY):
+    """
+    Writes `snapshot` (.db or .db.gz) into `database` and returns a metrics
+    dict. An existing database is only overwritten with force=True, after
+    it is saved as <database>.before-restore.
+    """
+    exists = os.path.exists(database)
+    if exists and not force:
+        raise BackupError(f'{database} exists; pass --force to overwrite it')
+    started = time.perf_counter()
+    metrics = {'snapshot': snapshot, 'database': database}
+    temporary = f'{database}.restore.tmp'
+    try:
+        phase = time.perf_counter()
+        if snapshot.endswith('.gz'):
+            decompress(snapshot, temporary)
+        else:
+            shutil.copyfile(snapshot, temporary)
+        metrics['bytes'] = os.path.getsize(temporary)
+        metrics['decompress_seconds'] = round(time.perf_counter() - phase, 3)
+
+        phase = time.perf_counter()
+        verify(temporary, verify_mode)
+        metrics['verify_seconds'] = round(time.perf_counter() - phase, 3)
+
+        if exists:
+            metrics['saved_as'] = f'{database}.before-restore'
+            if os.path.exists(metrics['saved_as']):
+                os.remove(metrics['saved_as'])
+            copy_online(database, metrics['saved_as'])
+
+        phase = time.perf_counter()
+        source = sqlite3.connect(temporary)
+        target = sqlite3.connect(database, timeout=30)
+        try:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode = WAL')
+        finally:
+            target.close()
+            source.close()
+        metrics['write_seconds'] = round(time.perf_counter() - phase, 3)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    metrics['seconds'] = round(time.perf_counter() - started, 3)
+    metrics['write_mb_per_second'] = _mb_per_second(metrics['bytes'], metrics['write_seconds'])
+    return metrics
+
+def _print_run(metrics):
+    size = metrics['bytes'] / 1048576
+    print(f"  {metrics['path']}: {size:.1f} MiB -> {metrics['compressed_bytes'] / 1048576:.1f} MiB "
+          f"({metrics['compressed_bytes'] / metrics['bytes']:.0%}) in {metrics['seconds']}s")
+    for phase in ('copy', 'verify', 'compress'):
+        rate = metrics.get(f'{phase}_mb_per_second')
+        rate = f'{rate} MB/s' if rate else '-'
+        extra = f", {metrics['steps']} steps, longest {metrics['longest_step_ms']} ms" if phase == 'copy' else ''
+        print(f"  {phase:<9} {metrics[f'{phase}_seconds']:>8.3f}s  {rate}{extra}")
+    if size:
+        print(f"  about {metrics['seconds'] / size * 1024 / 60:.1f} min per GiB at this rate")
+    for path in metrics['removed']:
+        print(f'  rotated out {path}')
+
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Online backups of the database, and restore.')
+    parser.add_argument('command', nargs='?', choices=('run', 'list', 'restore'), default='run')
+    parser.add_argument('snapshot', nargs='?', help='restore: snapshot file (default: the newest, or see --at)')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--directory', default=BACKUP_DIR)
+    parser.add_argument('--name', help='snapshot name prefix (default: the --database file name without .db)')
+    parser.add_argument('--keep', type=int, default=BACKUP_KEEP)
+    parser.add_argument('--step-pages', type=int, default=BACKUP_STEP_PAGES)
+    parser.add_argument('--verify', choices=('integrity', 'quick', 'off'), default=BACKUP_VERIFY)
+    parser.add_argument('--loop', action='store_true', help=f'back up every BACKUP_INTERVAL_SECONDS ({BACKUP_INTERVAL_SECONDS:g}s)')
+    parser.add_argument('--at', help="restore: newest snapshot taken at or before 'YYYY-MM-DD HH:MM'")
+    parser.add_argument('--force', action='store_true', help='restore: overwrite an existing database')
+    args = parser.parse_args(argv)
+    stem = args.name or _stem(args.database)
+
+    if args.command == 'list':
+        for taken_at, path in list_snapshots(args.directory, stem):
+            print(f'{taken_at:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path) / 1048576:>10.1f} MiB  {path}')
+        return 0
+
+    if args.command == 'restore':
+        try:
+            at = datetime.strptime(args.at, '%Y-%m-%d %H:%M') if args.at else None
+            snapshot = args.snapshot or find_snapshot(args.directory, stem, at)
+            metrics = restore(snapshot, args.database, args.force, args.verify)
+        except (BackupError, ValueError) as e:
+            print(f'ERROR: {e}')
+            return 1
+        print(f"restored {snapshot} -> {args.database}: {metrics['bytes'] / 1048576:.1f} MiB in {metrics['seconds']}s "
+              f"(write {metrics['write_mb_per_second']} MB/s)")
+        if 'saved_as' in metrics:
+            print(f"previous contents saved as {metrics['saved_as']}")
+        return 0
+
+    while True:
+        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} backup of {args.database}")
+        try:
+            _print_run(run(args.database, args.directory, args.keep, args.step_pages, verify_mode=args.verify, name=stem))
+        except (BackupError, sqlite3.Error, OSError) as e:
+            print(f'ERROR: [backup] - {e}')
+            if not args.loop:
+                return 1
+        if not args.loop:
+            return 0
+        time.sleep(BACKUP_INTERVAL_SECONDS)
+
+if __name__ == '__main__':
+    sys.exit(main())
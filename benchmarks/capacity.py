@@ -0,0 +1,271 @@
+"""
+Concurrent-user capacity of the gunicorn.conf.py profiles (sync, gthread and
+gevent), measured on the same dataset with the same number of workers.
+
+Each profile gets its own copy of the database and its own gunicorn. The
+run then steps through the --users levels. At each level, every simulated
+user sends a request drawn from the load_test.py routes (without the
+whole-table pages, see --exclude), waits --think-ms and repeats for
+--duration seconds. --slow-readers adds clients that keep downloading the
+largest tenant's CSV export at --slow-read-kbps, like phones on a poor
+connection. They are left out of the latency figures, but whatever serves
+them is busy until the download ends.
+
+A profile's capacity is the highest level that, like every level below it,
+keeps p95 within --slo-ms with under 1% errors.
+
+    python benchmarks/datagen.py --database /tmp/bench.db --tenants 20
+    python benchmarks/capacity.py --database /tmp/bench.db --workers 2 --users 2,4,8,16,32,64
+    python benchmarks/capacity.py --database /tmp/bench.db --profiles sync,gevent --slow-readers 4 --read-only
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from load_test import ROUTES, HttpTarget, Tenant, dataset_info, percentile, start_gunicorn
+
+MAX_ERROR_RATE = 0.01
+# หน้าที่ดึงข้อมูลทั้งตาราง วัดแยกรายหน้าด้วย load_test.py ส่วน export ใช้เป็นงานของ --slow-readers
+DEFAULT_EXCLUDE = r'^(data_management|export_sales_csv|api_import|metrics)$'
+EXPORT_PATH = '/data/export/sales?format=csv'
+
+
+def copy_database(source, target):
+    """A consistent copy through the backup API (the WAL is included)."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def load_tenants(database, limit):
+    conn = sqlite3.connect(database)
+    try:
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+        if limit:
+            user_ids = user_ids[:limit]
+        tenants = [tenant for tenant in (Tenant(conn, user_id) for user_id in user_ids)
+                   if tenant.products and tenant.orders and tenant.sales]
+        largest = conn.execute('SELECT user_id FROM sales WHERE deleted_at IS NULL '
+                               'GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1').fetchone()
+    finally:
+        conn.close()
+    return tenants, largest[0] if largest else None
+
+
+class SlowReader(threading.Thread):
+    """Downloads `path` over and over, reading at most `rate_kbps` KB per second."""
+
+    CHUNK = 1024
+
+    def __init__(self, url, cookie, path, rate_kbps, stop):
+        super().__init__(daemon=True)
+        parts = urllib.parse.urlsplit(url)
+        self.address = (parts.hostname, parts.port or 80)
+        self.request = (f'GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n'
+                        f'Cookie: session={cookie}\r\n\r\n').encode()
+        self.interval = self.CHUNK / (rate_kbps * 1024)
+        self.stop = stop
+        self.downloads = 0
+        self.errors = 0
+
+    def _download(self):
+        with socket.socket() as sock:
+            # receive buffer เล็ก ให้ server ส่งได้เร็วเท่าที่ client อ่านจริงเท่านั้น
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.settimeout(60)
+            sock.connect(self.address)
+            sock.sendall(self.request)
+            while not self.stop.is_set():
+                if not sock.recv(self.CHUNK):
+                    return True
+                time.sleep(self.interval)
+        return False
+
+    def run(self):
+        while not self.stop.is_set():
+            try:
+                if self._download():
+                    self.downloads += 1
+            except OSError:
+                self.errors += 1
+                time.sleep(0.5)
+
+
+def run_level(target, tenants, routes, users, duration, think, seed):
+    """`users` closed-loop clients for `duration` seconds -> one result row (times in ms)."""
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    times, failures = [], []
+
+    def user(number):
+        rng = random.Random(f'{seed}:{users}:{number}')
+        while time.monotonic() < deadline:
+            name, _, method, build = rng.choice(routes)
+            tenant = rng.choice(tenants)
+            spec = build(tenant, rng)
+            started = time.perf_counter()
+            try:
+                status, _, _ = target.request(tenant.user_id, method, spec)
+                error = f'{status} {name}' if status >= 400 else None
+            except Exception as e:
+                error = f'{type(e).__name__} {name}'
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if error:
+                    failures.append(error)
+                else:
+                    times.append(elapsed)
+            if think:
+                time.sleep(rng.uniform(0.5, 1.5) * think / 1000)
+
+    threads = [threading.Thread(target=user, args=(number,), daemon=True) for number in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    times.sort()
+    total = len(times) + len(failures)
+    return {
+        'users': users,
+        'requests': total,
+        'rps': round(total / elapsed, 1),
+        'p50': round(percentile(times, 0.50), 1),
+        'p95': round(percentile(times, 0.95), 1),
+        'p99': round(percentile(times, 0.99), 1),
+        'error_rate': round(len(failures) / total, 4) if total else 0.0,
+        'first_error': failures[0] if failures else None,
+    }
+
+def within_slo(row, slo_ms):
+    return row['requests'] > 0 and row['p95'] <= slo_ms and row['error_rate'] < MAX_ERROR_RATE
+
+def run_profile(profile, args, tenants, routes, largest, workdir):
+    database = os.path.join(workdir, f'{profile}.db')
+    copy_database(args.database, database)
+    server, url = start_gunicorn(database, args.workers, args.threads, profile,
+                                 {'GUNICORN_WORKER_CONNECTIONS': str(args.worker_connections),
+                                  'GUNICORN_TIMEOUT': str(args.timeout)})
+    target = HttpTarget(url, args.secret_key, server, timeout=args.timeout)
+    stop = threading.Event()
+    readers = []
+    levels = []
+    try:
+        for name, _, method, build in routes:
+            rng = random.Random(f'{args.seed}:warmup:{name}')
+            tenant = rng.choice(tenants)
+            target.request(tenant.user_id, method, build(tenant, rng))
+
+        if args.slow_readers and largest is not None:
+            cookie = target.session_cookie(largest)
+            readers = [SlowReader(url, cookie, EXPORT_PATH, args.slow_read_kbps, stop) for _ in range(args.slow_readers)]
+            for reader in readers:
+                reader.start()
+
+        for users in args.users:
+            row = run_level(target, tenants, routes, users, args.duration, args.think_ms, args.seed)
+            row['ok'] = within_slo(row, args.slo_ms)
+            row['rss_mb'] = round(target.rss() / 1048576, 1)
+            levels.append(row)
+            print(f"  {profile:<8} {users:>5} users  {row['rps']:>8.1f} req/s  p50 {row['p50']:>8.1f}  "
+                  f"p95 {row['p95']:>8.1f}  p99 {row['p99']:>8.1f} ms  errors {row['error_rate']:>6.2%}  "
+                  f"rss {row['rss_mb']} MB{'' if row['ok'] else '  over SLO'}", flush=True)
+            if not row['ok'] and not args.keep_going:
+                break
+    finally:
+        stop.set()
+        target.close()
+
+    best = None
+    for row in levels:
+        if not row['ok']:
+            break
+        best = row
+    return {
+        'capacity_users': best['users'] if best else 0,
+        'rps_at_capacity': best['rps'] if best else 0.0,
+        'p95_at_capacity': best['p95'] if best else None,
+        'slow_downloads': sum(reader.downloads for reader in readers),
+        'levels': levels,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the concurrent-user capacity of the gunicorn profiles.')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'inventory.db'))
+    parser.add_argument('--profiles', default='sync,gthread,gevent')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers, the same for every profile')
+    parser.add_argument('--threads', type=int, default=8, help='threads per worker (gthread)')
+    parser.add_argument('--worker-connections', type=int, default=200, help='greenlets per worker (gevent)')
+    parser.add_argument('--users', default='1,2,4,8,16,32,64', help='comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--think-ms', type=float, default=0, help='mean pause between one user\'s requests')
+    parser.add_argument('--slo-ms', type=float, default=500, help='p95 latency a level must stay within')
+    parser.add_argument('--slow-readers', type=int, default=0, help='clients downloading a large export slowly')
+    parser.add_argument('--slow-read-kbps', type=float, default=64)
+    parser.add_argument('--routes', help='regular expression: only routes whose name matches')
+    parser.add_argument('--exclude', default=DEFAULT_EXCLUDE, help='regular expression: routes left out of the mix')
+    parser.add_argument('--read-only', action='store_true', help='skip the routes that write')
+    parser.add_argument('--tenants', type=int, default=0, help='use only the first N users (0 = all)')
+    parser.add_argument('--timeout', type=int, default=30, help='client and gunicorn worker timeout in seconds')
+    parser.add_argument('--keep-going', action='store_true', help='run every level even after one misses the SLO')
+    parser.add_argument('--secret-key', default=os.environ.get('SECRET_KEY', 'default-fallback-key'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+    args.users = [int(level) for level in args.users.split(',')]
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f'{args.database} not found; create it with benchmarks/datagen.py')
+    tenants, largest = load_tenants(args.database, args.tenants)
+    if not tenants:
+        raise SystemExit('no user has products, orders and sales; run benchmarks/datagen.py first')
+    routes = [route for route in ROUTES
+              if not (args.exclude and re.search(args.exclude, route[0]))
+              and (not args.routes or re.search(args.routes, route[0]))
+              and not (args.read_only and (route[2] == 'POST' or route[1] in ('soft_delete', 'restore_item')))]
+    dataset = dataset_info(args.database)
+    print(f"{len(tenants)} tenants, {dataset['sales']:,} sales, {len(routes)} routes, {args.workers} workers, "
+          f"{args.duration:g}s per level, SLO p95 <= {args.slo_ms:g} ms, {args.slow_readers} slow readers")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='capacity-') as workdir:
+        for profile in args.profiles.split(','):
+            results[profile] = run_profile(profile, args, tenants, routes, largest, workdir)
+
+    print()
+    print(f"{'profile':<10} {'capacity':>9} {'req/s':>9} {'p95 ms':>9} {'slow downloads':>15}")
+    for profile, result in results.items():
+        p95 = '-' if result['p95_at_capacity'] is None else f"{result['p95_at_capacity']:.1f}"
+        print(f"{profile:<10} {result['capacity_users']:>9} {result['rps_at_capacity']:>9.1f} {p95:>9} "
+              f"{result['slow_downloads']:>15}")
+
+    if args.output:
+        report = {
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'dataset': dataset,
+            'settings': {key: value for key, value in vars(args).items() if key not in ('secret_key', 'output')},
+            'python': sys.version.split()[0],
+            'sqlite': sqlite3.sqlite_version,
+            'profiles': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f'Results written to {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
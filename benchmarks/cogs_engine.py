@@ -0,0 +1,162 @@
+"""
+Benchmarks the cost-of-goods engine (cogs.py) on a large generated dataset:
+a full replay of every SKU, incremental refreshes after new sales, a
+back-dated edit that replays one SKU, and the dashboard/report reads before
+(cost_map from the latest order per factory_sku) and after (precomputed
+sales.cost_satang and cogs_state).
+
+    python benchmarks/cogs_engine.py --sales 1000000 --skus 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cogs  # noqa: E402
+from database import init_db  # noqa: E402
+from importer import defer_indexes, restore_indexes  # noqa: E402
+from rollups import sales_report  # noqa: E402
+from summary import dashboard_figures  # noqa: E402
+
+START = 1577836800  # 2020-01-01
+SPAN = 5 * 365 * 86400
+
+# การอ่านแบบเดิม: ต้นทุนต่อหน่วยจาก order ล่าสุดของแต่ละ factory_sku คำนวณใหม่ทุก request
+BEFORE_DASHBOARD_SQL = '''
+    WITH cost_map AS (
+        SELECT factory_sku, cost_per_item_satang, MAX(order_id)
+        FROM orders WHERE deleted_at IS NULL AND user_id = ?
+        GROUP BY factory_sku
+    )
+    SELECT p.product_id, p.stock, COALESCE(ps.quantity_sold, 0), COALESCE(ps.revenue_satang, 0),
+           COALESCE(c.cost_per_item_satang, 0)
+    FROM products p
+    LEFT JOIN product_profit_summary ps ON ps.user_id = p.user_id AND ps.product_id = p.product_id
+    LEFT JOIN cost_map c ON c.factory_sku = p.factory_sku
+    WHERE p.user_id = ?
+'''
+
+BEFORE_REPORT_SQL = '''
+    WITH cost_map AS (
+        SELECT factory_sku, cost_per_item_satang, MAX(order_id)
+        FROM orders WHERE deleted_at IS NULL AND user_id = ?
+        GROUP BY factory_sku
+    ),
+    parts AS (
+        SELECT strftime('%Y-%m', day * 86400, 'unixepoch') AS bucket, product_id,
+               SUM(quantity) AS quantity, SUM(revenue_satang) AS revenue_satang
+        FROM sales_rollup_daily WHERE user_id = ? AND sales_count != 0
+        GROUP BY bucket, product_id
+    )
+    SELECT parts.bucket, SUM(parts.quantity), SUM(parts.revenue_satang),
+           SUM(parts.quantity * COALESCE(c.cost_per_item_satang, 0))
+    FROM parts
+    LEFT JOIN products p ON p.product_id = parts.product_id AND p.user_id = ?
+    LEFT JOIN cost_map c ON c.factory_sku = p.factory_sku
+    GROUP BY parts.bucket
+'''
+
+def _stamp(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+def populate(conn, sales, skus, orders_per_sku):
+    """Loads products, orders and sales for user 1 with the triggers dropped, like importer --defer-indexes."""
+    random.seed(42)
+    with conn:
+        for table in ('products', 'orders', 'sales'):
+            defer_indexes(conn, table)
+        conn.executemany(
+            'INSERT INTO products (product_id, user_id, name, sku, factory_sku, details, stock, created_at) VALUES (?, 1, ?, ?, ?, ?, ?, ?)',
+            [(i + 1, f'Product {i}', f'SKU{i}', f'F{i}', 'std', random.randint(0, 200), _stamp(START)) for i in range(skus)])
+        conn.executemany(
+            'INSERT INTO orders (user_id, product_details, factory_sku, quantity, cost_per_item, order_date) VALUES (1, ?, ?, ?, ?, ?)',
+            [('lot', f'F{i % skus}', random.randint(50, 500), round(random.uniform(5, 300), 2),
+              _stamp(START + random.randrange(SPAN))) for i in range(skus * orders_per_sku)])
+        batch = []
+        for _ in range(sales):
+            batch.append((random.randint(1, skus), random.randint(1, 5), round(random.uniform(10, 600), 2),
+                          _stamp(START + random.randrange(SPAN))))
+            if len(batch) == 100000:
+                conn.executemany('INSERT INTO sales (user_id, product_id, quantity, price_per_item, sale_date) VALUES (1, ?, ?, ?, ?)', batch)
+                batch = []
+        conn.executemany('INSERT INTO sales (user_id, product_id, quantity, price_per_item, sale_date) VALUES (1, ?, ?, ?, ?)', batch)
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+def best_of(repeat, func, *args):
+    return min(timed(func, *args)[0] for _ in range(repeat))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sales', type=int, default=1000000)
+    parser.add_argument('--skus', type=int, default=2000)
+    parser.add_argument('--orders-per-sku', type=int, default=20)
+    parser.add_argument('--new-sales', type=int, default=1000, help='sales added before each incremental refresh')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+
+    elapsed, _ = timed(populate, conn, args.sales, args.skus, args.orders_per_sku)
+    print(f'{args.sales:,} sales, {args.skus * args.orders_per_sku:,} orders over {args.skus:,} SKUs loaded in {elapsed:.1f}s ({path})')
+
+    # restore_indexes = สร้าง trigger กลับ + replay ทุก SKU + คำนวณตารางสรุปใหม่ (เหมือนหลัง import ก้อนใหญ่)
+    elapsed, _ = timed(restore_indexes, conn)
+    print(f'full replay + summary/rollup rebuild: {elapsed:.1f}s')
+    conn.execute('BEGIN IMMEDIATE')
+    elapsed, (skus, costed) = timed(cogs.rebuild, conn)
+    conn.commit()
+    print(f'full replay, nothing changed:         {elapsed:.1f}s ({skus:,} SKUs, {costed:,} costs rewritten)')
+
+    # ขายใหม่ที่ลงวันที่หลังเหตุการณ์ล่าสุด: ต่อท้าย lot เดิมได้โดยไม่ต้อง replay
+    now = START + SPAN + 86400
+    for round_number in range(3):
+        with conn:
+            conn.executemany('INSERT INTO sales (user_id, product_id, quantity, price_per_item, sale_date) VALUES (1, ?, ?, ?, ?)',
+                             [(random.randint(1, args.skus), random.randint(1, 5), 99.0, _stamp(now + round_number * 3600 + i))
+                              for i in range(args.new_sales)])
+        elapsed, counts = timed(cogs.refresh, conn, 1)
+        print(f'refresh after {args.new_sales:,} new sales:   {elapsed * 1000:8.1f} ms {counts}')
+
+    with conn:
+        conn.execute("UPDATE orders SET cost_per_item = cost_per_item + 1 WHERE order_id = 1")
+    elapsed, counts = timed(cogs.refresh, conn, 1)
+    print(f'refresh after a back-dated order edit: {elapsed * 1000:8.1f} ms {counts}')
+    elapsed, _ = timed(cogs.refresh, conn, 1)
+    print(f'refresh with nothing queued:           {elapsed * 1000:8.3f} ms')
+
+    print(f"{'read':<28} {'before':>12} {'after':>12} {'speedup':>8}")
+    reads = [
+        ('dashboard figures',
+         lambda: conn.execute(BEFORE_DASHBOARD_SQL, (1, 1)).fetchall(),
+         lambda: dashboard_figures(conn, 1)),
+        ('monthly report (all time)',
+         lambda: conn.execute(BEFORE_REPORT_SQL, (1, 1, 1)).fetchall(),
+         lambda: sales_report(conn, 1, 'month')),
+    ]
+    for name, before, after in reads:
+        before_time = best_of(args.repeat, before)
+        after_time = best_of(args.repeat, after)
+        print(f'{name:<28} {before_time * 1000:10.1f}ms {after_time * 1000:10.1f}ms {before_time / after_time:7.2f}x')
+
+    started = time.perf_counter()
+    mismatches = cogs.verify(conn)
+    print(f'verify: {len(mismatches)} mismatches ({time.perf_counter() - started:.1f}s)')
+    conn.close()
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Fills a database (schema from database.init_db()) with synthetic tenants for
+benchmarks: N users, each with products, purchase orders, sales and
+payments. Counts are per-tenant averages.
+
+- Tenant sizes are skewed: a few large tenants and many small ones.
+- Sales follow a Zipf-like product popularity, a weekly cycle and a growth
+  trend.
+- Prices are a markup over each SKU's purchase cost.
+- Orders are fully paid, partly paid or unpaid.
+- A small share of rows is soft-deleted, some of them recently, so the
+  trash page has content.
+
+    python benchmarks/datagen.py --database /tmp/bench.db --tenants 20 --products 400 --sales 20000
+    python benchmarks/datagen.py --database inventory.db --tenants 5 --append
+
+Every generated user has the password from --password (login still needs
+the OTP step). The benchmarks sign their own session cookie instead.
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db  # noqa: E402
+from importer import defer_indexes, restore_indexes  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+
+DAY = 86400
+COLOURS = ['ดำ', 'ขาว', 'แดง', 'น้ำเงิน', 'เขียว', 'ครีม', 'เทา', 'ชมพู']
+SIZES = ['S', 'M', 'L', 'XL', 'Free size']
+NOUNS = ['เสื้อยืด', 'กางเกง', 'กระเป๋า', 'หมวก', 'รองเท้า', 'ผ้าพันคอ', 'แก้วน้ำ', 'เคสมือถือ', 'สมุด', 'ปากกา']
+ADJECTIVES = ['Basic', 'Classic', 'Premium', 'Sport', 'Mini', 'Pro', 'Retro', 'Eco']
+
+def _stamp(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+def tenant_scales(rng, tenants, skew):
+    """Lognormal size multipliers normalised to an average of 1."""
+    raw = [rng.lognormvariate(0, skew) for _ in range(tenants)]
+    mean = sum(raw) / len(raw)
+    return [value / mean for value in raw]
+
+def day_weights(days, growth, weekend_boost):
+    """Relative sales volume per day (oldest first): steady growth plus a weekend bump."""
+    today = time.time() // DAY
+    weights = []
+    for i in range(days):
+        weekday = time.gmtime((today - days + 1 + i) * DAY).tm_wday
+        weights.append(math.exp(growth * i / days) * (weekend_boost if weekday >= 5 else 1.0))
+    return weights
+
+class TenantData:
+    """Rows for one tenant, generated in memory and then inserted in bulk."""
+
+    def __init__(self, rng, user_id, now, args, scale):
+        self.rng = rng
+        self.user_id = user_id
+        self.now = now
+        self.args = args
+        self.scale = scale
+        self.products = []  # (product_id, name, sku, factory_sku, details, stock, created_at, deleted_at)
+        self.orders = []    # (order_id, product_details, factory_sku, quantity, cost_per_item, order_date, deleted_at)
+        self.sales = []
+        self.payments = []
+
+    def _count(self, average):
+        return max(1, round(average * self.scale))
+
+    def _deleted_at(self):
+        if self.rng.random() >= self.args.deleted_ratio:
+            return None
+        # ครึ่งหนึ่งลบภายใน 3 วัน (แสดงในถังขยะ) ที่เหลือเก่ากว่านั้น (ให้ retention เก็บกวาด)
+        age = self.rng.uniform(0, 3 * DAY) if self.rng.random() < 0.5 else self.rng.uniform(3 * DAY, 90 * DAY)
+        return _stamp(self.now - age)
+
+    def _past(self, max_age_days):
+        return self.now - self.rng.uniform(0, max_age_days * DAY)
+
+    def build(self, first_product_id, first_order_id, weights):
+        rng, args = self.rng, self.args
+        history = args.days
+
+        # แคตตาล็อก: SKU หลักหนึ่งตัวมีหลายตัวเลือก (สี/ไซซ์) ใช้ factory_sku เดียวกัน
+        base_costs = {}
+        product_id = first_product_id
+        target = self._count(args.products)
+        group = 0
+        while len(self.products) < target:
+            factory_sku = f'F{self.user_id}-{group:05d}'
+            sku = f'SKU{self.user_id}-{group:05d}'
+            name = f'{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {group}'
+            base_costs[factory_sku] = round(rng.lognormvariate(math.log(80), 0.8), 2)
+            variants = rng.sample([f'{c} {s}' for c in COLOURS for s in SIZES], min(rng.choice([1, 1, 2, 3, 4, 6]), target - len(self.products)))
+            created = self._past(history)
+            for details in variants:
+                # ~10% ของสินค้าใกล้หมด เพื่อให้หน้า dashboard มีรายการ low stock
+                stock = rng.randint(0, 10) if rng.random() < 0.1 else rng.randint(11, 400)
+                self.products.append((product_id, name, sku, factory_sku, details, stock,
+                                      _stamp(created), self._deleted_at()))
+                product_id += 1
+            group += 1
+
+        factory_skus = list(base_costs)
+        order_id = first_order_id
+        for _ in range(self._count(args.orders)):
+            factory_sku = rng.choice(factory_skus)
+            cost = round(base_costs[factory_sku] * rng.uniform(0.9, 1.1), 2)
+            self.orders.append((order_id, f'ล็อตสั่งผลิต {factory_sku}', factory_sku, rng.randint(20, 500), cost,
+                                _stamp(self._past(history)), self._deleted_at()))
+            order_id += 1
+
+        # ความนิยมสินค้าแบบ Zipf: สินค้าไม่กี่ตัวขายได้ส่วนใหญ่
+        ranked = self.products[:]
+        rng.shuffle(ranked)
+        popularity = [1 / (rank + 1) ** args.zipf for rank in range(len(ranked))]
+        prices = {p[0]: round(base_costs[p[3]] * rng.uniform(1.3, 2.5)) for p in ranked}
+        sale_count = self._count(args.sales)
+        products = rng.choices(ranked, popularity, k=sale_count)
+        days = rng.choices(range(len(weights)), weights, k=sale_count)
+        for product, day in zip(products, days):
+            ts = self.now - (len(weights) - 1 - day) * DAY - rng.uniform(0, DAY)
+            quantity = rng.choices([1, 2, 3, 4, 5, 10], [60, 20, 8, 5, 4, 3])[0]
+            price = round(prices[product[0]] * rng.uniform(0.95, 1.05), 2)
+            self.sales.append((product[0], quantity, price, _stamp(ts), self._deleted_at()))
+
+        # การจ่ายเงิน: ~60% จ่ายครบ (1-3 งวด), ~25% จ่ายบางส่วน, ที่เหลือยังไม่จ่าย
+        budget = self._count(args.payments)
+        for order in self.orders:
+            if budget <= 0:
+                break
+            roll = rng.random()
+            if roll >= 0.85:
+                continue
+            total = order[3] * order[4]
+            paid_share = 1.0 if roll < 0.6 else rng.uniform(0.2, 0.8)
+            installments = min(rng.randint(1, 3), budget)
+            order_ts = time.mktime(time.strptime(order[5], '%Y-%m-%d %H:%M:%S'))
+            for _ in range(installments):
+                amount = round(total * paid_share / installments, 2)
+                paid_at = min(order_ts + rng.uniform(0, 45 * DAY), self.now)
+                self.payments.append((order[0], amount, _stamp(paid_at), self._deleted_at()))
+            budget -= installments
+        return product_id, order_id
+
+    def insert(self, conn):
+        uid = self.user_id
+        conn.executemany(
+            'INSERT INTO products (product_id, user_id, name, sku, factory_sku, details, stock, created_at, deleted_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [(p[0], uid) + p[1:] for p in self.products])
+        conn.executemany(
+            'INSERT INTO orders (order_id, user_id, product_details, factory_sku, quantity, cost_per_item, order_date, deleted_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(o[0], uid) + o[1:] for o in self.orders])
+        conn.executemany(
+            'INSERT INTO sales (user_id, product_id, quantity, price_per_item, sale_date, deleted_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(uid,) + s for s in self.sales])
+        conn.executemany(
+            'INSERT INTO payments (user_id, order_id, amount, payment_date, deleted_at) VALUES (?, ?, ?, ?, ?)',
+            [(uid,) + p for p in self.payments])
+
+def generate(database, tenants=10, products=200, orders=500, sales=5000, payments=400, days=730,
+             skew=0.75, zipf=1.1, deleted_ratio=0.01, growth=1.0, weekend_boost=1.4,
+             password='benchmark', append=False, seed=42, progress=None):
+    """
+    Creates `tenants` users with their data in `database`. Returns
+    {'user_ids': [...], 'products': n, 'orders': n, 'sales': n, 'payments': n, 'seconds': s}.
+    """
+    args = argparse.Namespace(products=products, orders=orders, sales=sales, payments=payments, days=days,
+                              deleted_ratio=deleted_ratio, zipf=zipf)
+    started = time.perf_counter()
+    init_db(database)
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    try:
+        if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() and not append:
+            raise SystemExit(f'{database} already has users; pass --append to add tenants to it')
+        rng = random.Random(seed)
+        # hash เดียวใช้ทุก tenant: bcrypt ทีละคนช้าเกินไปสำหรับข้อมูลทดสอบ
+        password_hash = PasswordHasher(workers=0).hash(password)
+        first_user = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        product_id = conn.execute('SELECT COALESCE(MAX(product_id), 0) + 1 FROM products').fetchone()[0]
+        order_id = conn.execute('SELECT COALESCE(MAX(order_id), 0) + 1 FROM orders').fetchone()[0]
+        weights = day_weights(days, growth, weekend_boost)
+        now = time.time()
+        totals = {'user_ids': [], 'products': 0, 'orders': 0, 'sales': 0, 'payments': 0}
+
+        with conn:
+            for table in ('products', 'orders', 'sales', 'payments'):
+                defer_indexes(conn, table)
+            for i, scale in enumerate(tenant_scales(rng, tenants, skew)):
+                user_id = first_user + i
+                conn.execute('INSERT INTO users (id, username, password, email, is_verified) VALUES (?, ?, ?, ?, 1)',
+                             (user_id, f'bench{user_id}', password_hash, f'bench{user_id}@example.com'))
+                data = TenantData(rng, user_id, now, args, scale)
+                product_id, order_id = data.build(product_id, order_id, weights)
+                data.insert(conn)
+                totals['user_ids'].append(user_id)
+                for key in ('products', 'orders', 'sales', 'payments'):
+                    totals[key] += len(getattr(data, key))
+                if progress:
+                    progress(i + 1, tenants, totals)
+        # สร้าง index/trigger กลับ แล้วคำนวณต้นทุน ตารางสรุป และ rollup ใหม่ทั้งหมด
+        restore_indexes(conn)
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    totals['seconds'] = round(time.perf_counter() - started, 2)
+    return totals
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Fill a database with synthetic multi-tenant data for benchmarks.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--products', type=int, default=200, help='products (variants) per tenant, on average')
+    parser.add_argument('--orders', type=int, default=500, help='purchase orders per tenant, on average')
+    parser.add_argument('--sales', type=int, default=5000, help='sales rows per tenant, on average')
+    parser.add_argument('--payments', type=int, default=400, help='payments per tenant, at most, on average')
+    parser.add_argument('--days', type=int, default=730, help='days of history')
+    parser.add_argument('--skew', type=float, default=0.75, help='spread of tenant sizes (lognormal sigma)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='product popularity exponent')
+    parser.add_argument('--deleted-ratio', type=float, default=0.01, help='share of soft-deleted rows')
+    parser.add_argument('--password', default='benchmark')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--append', action='store_true', help='add tenants to a database that already has users')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, totals):
+        print(f"\r{done}/{total} tenants, {totals['sales']:,} sales", end='', flush=True)
+
+    totals = generate(args.database, args.tenants, args.products, args.orders, args.sales, args.payments,
+                      args.days, args.skew, args.zipf, args.deleted_ratio,
+                      password=args.password, append=args.append, seed=args.seed, progress=progress)
+    print()
+    users = totals['user_ids']
+    print(f"{args.database}: users {users[0]}-{users[-1]}, {totals['products']:,} products, {totals['orders']:,} orders, "
+          f"{totals['sales']:,} sales, {totals['payments']:,} payments in {totals['seconds']}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,568 @@
+"""
+Load test over the routes of app.py against a database filled by
+benchmarks/datagen.py. For each route it reports p50/p95/p99 latency, SQL
+statements and SQL time per request (from the X-SQL-Statements and
+Server-Timing headers, see metrics.py), and the server RSS after the route.
+It can also save the results as a baseline and compare later runs with it.
+
+The Flask test client runs in this process by default. --gunicorn starts a
+local gunicorn, and --url drives a server that is already running (started
+with METRICS_RESPONSE_HEADERS=on and the same SECRET_KEY).
+
+    python benchmarks/datagen.py --database /tmp/bench.db --tenants 20
+    python benchmarks/load_test.py --database /tmp/bench.db --save-baseline /tmp/baseline.json
+    python benchmarks/load_test.py --database /tmp/bench.db --baseline /tmp/baseline.json   # exit 1 on regression
+    python benchmarks/load_test.py --database /tmp/bench.db --gunicorn --workers 2 --concurrency 8 --routes 'dashboard|reports'
+
+Write routes (stock-out, payments, edits, delete/restore, import) change the
+database. Use a copy when the numbers must be repeatable.
+"""
+import argparse
+import collections
+import io
+import json
+import math
+import os
+import random
+import re
+import resource
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# ปิดงานเบื้องหลังที่ไม่เกี่ยวกับการวัด และเปิด header จำนวน statement ต่อ request
+BENCH_ENV = {
+    'MAIL_DISPATCHER': 'off',
+    'PASSWORD_WORKERS': '0',
+    'METRICS_RESPONSE_HEADERS': 'on',
+    'SLOW_REQUEST_MS': '1e9',
+}
+# route ที่ต้องผ่าน reCAPTCHA/OTP หรือไม่ใช่หน้าของแอป ไม่ได้วัด
+SKIPPED_ENDPOINTS = {'static', 'register', 'verify_registration', 'login', 'verify_login', 'logout'}
+SAMPLE_ROWS = 200
+
+
+class Tenant:
+    """Ids and values sampled from one user's data, used to build requests."""
+
+    def __init__(self, conn, user_id):
+        self.user_id = user_id
+        self.products = conn.execute(
+            'SELECT product_id, name, sku, factory_sku, details, stock FROM products '
+            'WHERE user_id = ? AND deleted_at IS NULL ORDER BY random() LIMIT ?', (user_id, SAMPLE_ROWS)).fetchall()
+        self.orders = conn.execute(
+            'SELECT order_id, product_details, factory_sku, quantity, cost_per_item FROM orders '
+            'WHERE user_id = ? AND deleted_at IS NULL ORDER BY random() LIMIT ?', (user_id, SAMPLE_ROWS)).fetchall()
+        self.sales = conn.execute(
+            'SELECT sale_id, product_id, quantity, price_per_item FROM sales '
+            'WHERE user_id = ? AND deleted_at IS NULL ORDER BY random() LIMIT ?', (user_id, SAMPLE_ROWS)).fetchall()
+        self.deleted = collections.deque()  # sale_id ที่ route soft_delete ลบไว้ ให้ restore_item กู้คืน
+
+
+def _product(tenant, rng):
+    return rng.choice(tenant.products)
+
+def _date_range(rng, days):
+    end = time.time() - rng.uniform(0, 30) * 86400
+    return time.strftime('%Y-%m-%d', time.localtime(end - days * 86400)), time.strftime('%Y-%m-%d', time.localtime(end))
+
+def _performance(tenant, rng):
+    start, end = _date_range(rng, 90)
+    return {'path': f'/api/performance_data?granularity=day&from={start}&to={end}'}
+
+def _reports(tenant, rng):
+    return {'path': f"/api/reports?granularity=month&group={rng.choice(['total', 'product'])}"}
+
+def _search(tenant, rng):
+    product = _product(tenant, rng)
+    return {'path': f"/api/products/search?q={rng.choice([product[1].split()[0], product[2][:6]])}"}
+
+def _variants(tenant, rng):
+    return {'path': f'/api/products/search?sku={_product(tenant, rng)[2]}'}
+
+def _submit_order(tenant, rng):
+    rows = [_product(tenant, rng) for _ in range(rng.randint(1, 3))]
+    return {'path': '/submit_order', 'form': {
+        'product_details[]': [f'bench {p[4]}' for p in rows], 'factory_sku[]': [p[3] for p in rows],
+        'quantity[]': [str(rng.randint(10, 100)) for _ in rows], 'cost_per_item[]': [f'{rng.uniform(10, 200):.2f}' for _ in rows]}}
+
+def _variant_form(tenant, rng, quantity_range):
+    product = _product(tenant, rng)
+    return product, {'sku[]': [product[2]], 'details[]': [product[4]],
+                     'quantity[]': [str(rng.randint(*quantity_range))], 'group_index[]': ['0']}
+
+def _stock_in(tenant, rng):
+    product, form = _variant_form(tenant, rng, (5, 50))
+    form.update({'product_name[]': [product[1]], 'factory_sku[]': [product[3]]})
+    return {'path': '/submit_stock_in', 'form': form}
+
+def _stock_out(tenant, rng):
+    product, form = _variant_form(tenant, rng, (1, 3))
+    form['price[]'] = [f'{rng.uniform(50, 500):.2f}']
+    return {'path': '/submit_stock_out', 'form': form}
+
+def _payment(tenant, rng):
+    return {'path': '/submit_payment', 'form': {'order_id': str(rng.choice(tenant.orders)[0]),
+                                                 'amount': f'{rng.uniform(1, 50):.2f}', 'payment_date': ''}}
+
+def _soft_delete(tenant, rng):
+    sale_id = rng.choice(tenant.sales)[0]
+    tenant.deleted.append(sale_id)
+    return {'path': f'/delete/sale/{sale_id}'}
+
+def _restore(tenant, rng):
+    try:
+        sale_id = tenant.deleted.popleft()
+    except IndexError:
+        sale_id = rng.choice(tenant.sales)[0]
+    return {'path': f'/restore/sale/{sale_id}'}
+
+def _edit_order_post(tenant, rng):
+    order = rng.choice(tenant.orders)
+    return {'path': f'/edit/order/{order[0]}', 'form': {
+        'product_details': order[1], 'factory_sku': order[2], 'quantity': str(order[3]), 'cost_per_item': str(order[4])}}
+
+def _edit_product_post(tenant, rng):
+    product = _product(tenant, rng)
+    return {'path': f'/edit/product/{product[0]}', 'form': {
+        'name': product[1], 'sku': product[2], 'factory_sku': product[3], 'details': product[4], 'stock': str(product[5])}}
+
+def _edit_sale_post(tenant, rng):
+    sale = rng.choice(tenant.sales)
+    return {'path': f'/edit/sale/{sale[0]}', 'form': {
+        'product_id': str(sale[1]), 'quantity': str(sale[2]), 'price_per_item': str(sale[3])}}
+
+def _import(tenant, rng):
+    today = time.strftime('%Y-%m-%d %H:%M:%S')
+    lines = [json.dumps({'product_id': _product(tenant, rng)[0], 'quantity': 1,
+                         'price_per_item': round(rng.uniform(50, 500), 2), 'sale_date': today}) for _ in range(20)]
+    return {'path': '/api/import', 'form': {'kind': 'sales'}, 'upload': ('file', 'sales.ndjson', '\n'.join(lines).encode())}
+
+def _get(path):
+    return lambda tenant, rng: {'path': path}
+
+# (name, endpoint, method, request builder) ตามลำดับที่รัน
+ROUTES = [
+    ('dashboard', 'dashboard', 'GET', _get('/')),
+    ('forms_stock_in', 'forms_stock_in', 'GET', _get('/forms/stock-in')),
+    ('forms_stock_out', 'forms_stock_out', 'GET', _get('/forms/stock-out')),
+    ('performance_data', 'performance_data', 'GET', _performance),
+    ('performance_data_all', 'performance_data', 'GET', _get('/api/performance_data?granularity=month')),
+    ('api_reports', 'api_reports', 'GET', _reports),
+    ('accounting', 'accounting_page', 'GET', _get('/accounting')),
+    ('outstanding', 'outstanding_page', 'GET', _get('/outstanding')),
+    ('api_products_page', 'api_products', 'GET', _get('/api/products?limit=100')),
+    ('api_products_all', 'api_products', 'GET', _get('/api/products')),
+    ('api_orders_page', 'api_orders', 'GET', _get('/api/orders?limit=100')),
+    ('product_search', 'api_product_search', 'GET', _search),
+    ('product_variants', 'api_product_search', 'GET', _variants),
+    ('export_sales_csv', 'data_export', 'GET', _get('/data/export/sales?format=csv')),
+    ('data_management', 'data_management', 'GET', _get('/data')),
+    ('trash', 'trash_bin', 'GET', _get('/trash')),
+    ('edit_order_form', 'edit_order', 'GET', lambda t, rng: {'path': f'/edit/order/{rng.choice(t.orders)[0]}'}),
+    ('edit_product_form', 'edit_product', 'GET', lambda t, rng: {'path': f'/edit/product/{_product(t, rng)[0]}'}),
+    ('edit_sale_form', 'edit_sale', 'GET', lambda t, rng: {'path': f'/edit/sale/{rng.choice(t.sales)[0]}'}),
+    ('submit_order', 'submit_order', 'POST', _submit_order),
+    ('submit_stock_in', 'submit_stock_in', 'POST', _stock_in),
+    ('submit_stock_out', 'submit_stock_out', 'POST', _stock_out),
+    ('submit_payment', 'submit_payment', 'POST', _payment),
+    ('soft_delete', 'soft_delete', 'GET', _soft_delete),
+    ('restore_item', 'restore_item', 'GET', _restore),
+    ('edit_order', 'edit_order', 'POST', _edit_order_post),
+    ('edit_product', 'edit_product', 'POST', _edit_product_post),
+    ('edit_sale', 'edit_sale', 'POST', _edit_sale_post),
+    ('api_import', 'api_import', 'POST', _import),
+    ('metrics', 'metrics', 'GET', _get('/metrics')),
+]
+
+
+def _micro_functions():
+    """(name, func(conn, tenant)) for the functions behind the heaviest routes, timed without Flask."""
+    from cogs import refresh
+    from ledger import order_balances
+    from rollups import sales_report
+    from search import search_products
+    from summary import dashboard_figures
+
+    return [
+        ('fn:dashboard_figures', lambda conn, t: dashboard_figures(conn, t.user_id)),
+        ('fn:sales_report_month', lambda conn, t: sales_report(conn, t.user_id, 'month')),
+        ('fn:sales_report_day_by_product', lambda conn, t: sales_report(conn, t.user_id, 'day', by_product=True)),
+        ('fn:order_balances', lambda conn, t: order_balances(conn, t.user_id)),
+        ('fn:search_products', lambda conn, t: search_products(conn, t.user_id, t.products[0][1].split()[0], 20)),
+        ('fn:cogs_refresh', lambda conn, t: refresh(conn, t.user_id)),
+    ]
+
+
+def _rss_of(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+class InProcessTarget:
+    """Flask test client in this process."""
+
+    def __init__(self, database):
+        os.environ['DATABASE_PATH'] = database
+        for key, value in BENCH_ENV.items():
+            os.environ.setdefault(key, value)
+        import app as app_module
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def endpoints(self):
+        return {rule.endpoint for rule in self.app.url_map.iter_rules()}
+
+    def _client(self, user_id):
+        clients = self._local.__dict__.setdefault('clients', {})
+        if user_id not in clients:
+            client = self.app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            clients[user_id] = client
+        return clients[user_id]
+
+    def request(self, user_id, method, spec):
+        data = dict(spec.get('form') or {})
+        if 'upload' in spec:
+            field, filename, content = spec['upload']
+            data[field] = (io.BytesIO(content), filename)
+        response = self._client(user_id).open(spec['path'], method=method, data=data or None)
+        body = response.get_data()
+        return response.status_code, response.headers, len(body)
+
+    def rss(self):
+        return _rss_of(os.getpid())
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """A running server (or one gunicorn started here) driven over HTTP with a signed session cookie."""
+
+    def __init__(self, url, secret_key, server=None, timeout=None):
+        import requests
+        from flask import Flask
+
+        self.url = url.rstrip('/')
+        self.server = server
+        self.timeout = timeout
+        self._requests = requests
+        signer = Flask('load_test')
+        signer.secret_key = secret_key
+        self._serializer = signer.session_interface.get_signing_serializer(signer)
+        self._local = threading.local()
+
+    def endpoints(self):
+        return None
+
+    def session_cookie(self, user_id):
+        return self._serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+
+    def _session(self, user_id):
+        sessions = self._local.__dict__.setdefault('sessions', {})
+        if user_id not in sessions:
+            session = self._requests.Session()
+            session.cookies.set('session', self.session_cookie(user_id))
+            sessions[user_id] = session
+        return sessions[user_id]
+
+    def request(self, user_id, method, spec):
+        files = None
+        if 'upload' in spec:
+            field, filename, content = spec['upload']
+            files = {field: (filename, content)}
+        response = self._session(user_id).request(method, self.url + spec['path'], data=spec.get('form'),
+                                                  files=files, allow_redirects=False, timeout=self.timeout)
+        return response.status_code, response.headers, len(response.content)
+
+    def rss(self):
+        if self.server is None:
+            return 0
+        return sum(_rss_of(pid) for pid in [self.server.pid] + _children(self.server.pid))
+
+    def close(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait(10)
+
+
+def start_gunicorn(database, workers, threads, profile=None, extra_env=None):
+    """Starts gunicorn with a gunicorn.conf.py profile (default: gthread when threads > 1, else sync)."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, DATABASE_PATH=database, **BENCH_ENV)
+    env.update(GUNICORN_PROFILE=profile or ('gthread' if threads > 1 else 'sync'),
+               GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads), **(extra_env or {}))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'gunicorn exited with {server.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit('gunicorn did not start within 60s')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def summarize(samples, errors, rss):
+    """samples: [(seconds, statements, sql_ms)] -> one result row (times in ms)."""
+    times = sorted(s[0] * 1000 for s in samples)
+    statements = [s[1] for s in samples if s[1] is not None]
+    sql_ms = [s[2] for s in samples if s[2] is not None]
+    return {
+        'n': len(samples),
+        'errors': errors,
+        'p50': round(percentile(times, 0.50), 3),
+        'p95': round(percentile(times, 0.95), 3),
+        'p99': round(percentile(times, 0.99), 3),
+        'mean': round(sum(times) / len(times), 3) if times else 0.0,
+        'statements': round(sum(statements) / len(statements), 2) if statements else None,
+        'sql_ms': round(sum(sql_ms) / len(sql_ms), 3) if sql_ms else None,
+        'rss_mb': round(rss / 1048576, 1) if rss else None,
+    }
+
+def _server_timing(headers):
+    match = re.search(r'sql;dur=([\d.]+)', headers.get('Server-Timing', ''))
+    return float(match.group(1)) if match else None
+
+def run_routes(target, tenants, routes, iterations, warmup, concurrency, seed):
+    results = {}
+    for index, (name, endpoint, method, build) in enumerate(routes):
+        counter = iter(range(warmup + iterations))
+        lock = threading.Lock()
+        samples, failures = [], []
+
+        def one(_):
+            with lock:
+                number = next(counter)
+            rng = random.Random(f'{seed}:{name}:{number}')
+            tenant = rng.choice(tenants)
+            spec = build(tenant, rng)
+            started = time.perf_counter()
+            status, headers, _ = target.request(tenant.user_id, method, spec)
+            elapsed = time.perf_counter() - started
+            if number < warmup:
+                return
+            statements = headers.get('X-SQL-Statements')
+            with lock:
+                samples.append((elapsed, int(statements) if statements is not None else None, _server_timing(headers)))
+                if status >= 400:
+                    failures.append((status, spec['path']))
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(one, range(warmup + iterations)))
+        results[name] = summarize(samples, len(failures), target.rss())
+        if failures:
+            results[name]['first_error'] = f'{failures[0][0]} {failures[0][1]}'
+        row = results[name]
+        print(f"  [{index + 1}/{len(routes)}] {name:<28} p50 {row['p50']:8.2f} ms  p95 {row['p95']:8.2f} ms", flush=True)
+    return results
+
+def run_micro(database, tenants, iterations, warmup):
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA cache_size = -16384')
+    results = {}
+    for name, func in _micro_functions():
+        samples = []
+        for number in range(warmup + iterations):
+            tenant = tenants[number % len(tenants)]
+            started = time.perf_counter()
+            func(conn, tenant)
+            elapsed = time.perf_counter() - started
+            if number >= warmup:
+                samples.append((elapsed, None, None))
+        results[name] = summarize(samples, 0, 0)
+    conn.close()
+    return results
+
+
+def dataset_info(database):
+    conn = sqlite3.connect(database)
+    try:
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('users', 'products', 'orders', 'sales', 'payments')}
+    finally:
+        conn.close()
+    return counts
+
+def print_table(results, baseline=None):
+    header = f"{'route':<30} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'sql/req':>8} {'sql ms':>8} {'err':>4} {'rss MB':>7}"
+    if baseline:
+        header += f" {'p50 vs base':>12} {'p95 vs base':>12}"
+    print(header)
+    for name, row in results.items():
+        statements = '-' if row['statements'] is None else f"{row['statements']:.1f}"
+        sql_ms = '-' if row['sql_ms'] is None else f"{row['sql_ms']:.2f}"
+        rss = '-' if row['rss_mb'] is None else row['rss_mb']
+        line = (f"{name:<30} {row['n']:>5} {row['p50']:>9.2f} {row['p95']:>9.2f} {row['p99']:>9.2f} "
+                f"{statements:>8} {sql_ms:>8} {row['errors']:>4} {rss:>7}")
+        base = (baseline or {}).get(name)
+        if base:
+            for key in ('p50', 'p95'):
+                line += f" {row[key] / base[key] if base[key] else 0:>11.2f}x"
+        print(line)
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Returns [message] for every route that got slower or runs more statements than in the baseline."""
+    regressions = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ('p50', 'p95'):
+            if row[key] > base[key] * threshold and row[key] - base[key] > min_delta_ms:
+                regressions.append(f'{name}: {key} {base[key]:.2f} -> {row[key]:.2f} ms ({row[key] / base[key]:.2f}x)')
+        # จำนวน statement ไม่ขึ้นกับความเร็วเครื่อง เพิ่มขึ้นเมื่อไหร่ก็น่าสงสัย (เช่น N+1)
+        if row.get('statements') is not None and base.get('statements') is not None and row['statements'] > base['statements'] + 0.5:
+            regressions.append(f"{name}: statements per request {base['statements']} -> {row['statements']}")
+        if row['errors'] and not base.get('errors'):
+            regressions.append(f"{name}: {row['errors']} error responses ({row.get('first_error')})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-route load test with baseline comparison.')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH', 'inventory.db'))
+    parser.add_argument('--iterations', type=int, default=50, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per route first')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--tenants', type=int, default=0, help='use only the first N users (0 = all)')
+    parser.add_argument('--routes', help='regular expression: only routes whose name matches')
+    parser.add_argument('--read-only', action='store_true', help='skip the routes that write')
+    parser.add_argument('--no-micro', action='store_true', help='skip the function micro-benchmarks')
+    parser.add_argument('--url', help='drive an already running server instead of the in-process test client')
+    parser.add_argument('--gunicorn', action='store_true', help='start a local gunicorn for the run')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--profile', choices=('sync', 'gthread', 'gevent'),
+                        help='gunicorn.conf.py profile (default: gthread when --threads > 1, else sync)')
+    parser.add_argument('--secret-key', default=os.environ.get('SECRET_KEY', 'default-fallback-key'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--save-baseline', help='write the results as the new baseline JSON')
+    parser.add_argument('--baseline', help='compare with this baseline JSON and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='allowed slowdown factor against the baseline')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore slowdowns smaller than this')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f'{args.database} not found; create it with benchmarks/datagen.py')
+    dataset = dataset_info(args.database)
+    conn = sqlite3.connect(args.database)
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+    if args.tenants:
+        user_ids = user_ids[:args.tenants]
+    tenants = [tenant for tenant in (Tenant(conn, user_id) for user_id in user_ids)
+               if tenant.products and tenant.orders and tenant.sales]
+    conn.close()
+    if not tenants:
+        raise SystemExit('no user has products, orders and sales; run benchmarks/datagen.py first')
+
+    routes = [route for route in ROUTES
+              if (not args.routes or re.search(args.routes, route[0]))
+              and not (args.read_only and (route[2] == 'POST' or route[1] in ('soft_delete', 'restore_item')))]
+
+    if args.gunicorn:
+        server, url = start_gunicorn(args.database, args.workers, args.threads, args.profile)
+        target = HttpTarget(url, args.secret_key, server)
+        mode = f'gunicorn {args.workers}x{args.threads}' + (f' ({args.profile})' if args.profile else '')
+    elif args.url:
+        target = HttpTarget(args.url, args.secret_key)
+        mode = args.url
+    else:
+        target = InProcessTarget(args.database)
+        mode = 'in-process test client'
+
+    endpoints = target.endpoints()
+    if endpoints is not None:
+        missing = sorted(endpoints - SKIPPED_ENDPOINTS - {route[1] for route in ROUTES})
+        if missing:
+            print(f"WARNING: routes without a load-test entry: {', '.join(missing)}")
+
+    print(f"{mode}, {len(tenants)} tenants, {dataset['sales']:,} sales, {len(routes)} routes x {args.iterations} "
+          f"requests, concurrency {args.concurrency}")
+    started = time.perf_counter()
+    try:
+        rss_start = target.rss()
+        results = run_routes(target, tenants, routes, args.iterations, args.warmup, args.concurrency, args.seed)
+        rss_end = target.rss()
+    finally:
+        target.close()
+    if not args.no_micro:
+        results.update(run_micro(args.database, tenants, args.iterations, args.warmup))
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'mode': mode,
+        'concurrency': args.concurrency,
+        'iterations': args.iterations,
+        'dataset': dataset,
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'rss_mb': {'start': round(rss_start / 1048576, 1), 'end': round(rss_end / 1048576, 1),
+                   'peak_self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)},
+        'routes': results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != dataset:
+            print(f"WARNING: dataset differs from the baseline ({baseline.get('dataset')}); comparisons are rough")
+    print()
+    print_table(results, baseline and baseline['routes'])
+    print(f"RSS {report['rss_mb']['start']} -> {report['rss_mb']['end']} MB, {elapsed:.1f}s in total")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f'Results written to {path}')
+
+    if baseline:
+        regressions = compare(results, baseline['routes'], args.threshold, args.min_delta_ms)
+        for message in regressions:
+            print(f'REGRESSION: {message}')
+        print(f'{len(regressions)} regression(s) against {args.baseline} (threshold {args.threshold}x).')
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
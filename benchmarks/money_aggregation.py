@@ -0,0 +1,86 @@
+"""
+Compares the dashboard/report aggregations before and after migration 0006:
+REAL money with TEXT date parsing versus integer *_satang sums grouped on
+the integer *_ts columns (months still group on the TEXT prefix, which is
+cheaper than formatting an epoch).
+
+    python benchmarks/money_aggregation.py --sales 500000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db  # noqa: E402
+
+QUERIES = [
+    ('revenue total',
+     'SELECT SUM(quantity * price_per_item) FROM sales WHERE user_id = 1 AND deleted_at IS NULL',
+     'SELECT SUM(quantity * price_per_item_satang) FROM sales WHERE user_id = 1 AND deleted_at IS NULL'),
+    ('revenue per day',
+     'SELECT date(sale_date) AS d, SUM(quantity * price_per_item) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY d',
+     'SELECT sale_ts / 86400 AS d, SUM(quantity * price_per_item_satang) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY d'),
+    ('revenue per month',
+     "SELECT strftime('%Y-%m', sale_date) AS m, SUM(quantity * price_per_item) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY m",
+     'SELECT substr(sale_date, 1, 7) AS m, SUM(quantity * price_per_item_satang) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY m'),
+    ('revenue per week',
+     "SELECT date(sale_date, 'weekday 0', '-6 days') AS w, SUM(quantity * price_per_item) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY w",
+     'SELECT (sale_ts / 86400 + 3) / 7 AS w, SUM(quantity * price_per_item_satang) FROM sales WHERE user_id = 1 AND deleted_at IS NULL GROUP BY w'),
+]
+
+def populate(conn, count):
+    random.seed(42)
+    start = 1577836800  # 2020-01-01
+    rows = []
+    for i in range(count):
+        ts = start + random.randrange(5 * 365 * 86400)
+        rows.append((1, 1, random.randint(1, 5), round(random.uniform(1, 500), 2),
+                     time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))))
+    with conn:
+        conn.executemany('INSERT INTO sales (user_id, product_id, quantity, price_per_item, sale_date) VALUES (?, ?, ?, ?, ?)', rows)
+
+def best_of(conn, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = conn.execute(sql).fetchall()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sales', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    init_db(path)
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    populate(conn, args.sales)
+    print(f'{args.sales:,} sales loaded in {time.perf_counter() - started:.1f}s ({path})')
+
+    print(f"{'query':<20} {'before':>12} {'after':>12} {'speedup':>8}")
+    for name, real_sql, integer_sql in QUERIES:
+        real_time, _ = best_of(conn, real_sql, args.repeat)
+        integer_time, _ = best_of(conn, integer_sql, args.repeat)
+        print(f'{name:<20} {real_time * 1000:10.1f}ms {integer_time * 1000:10.1f}ms {real_time / integer_time:7.2f}x')
+
+    # ผลรวมแบบเพิ่มทีละแถว (แบบที่ trigger ของตารางสรุปทำ) เทียบกับค่าจริง
+    running_real = 0.0
+    running_satang = 0
+    for quantity, price, price_satang in conn.execute('SELECT quantity, price_per_item, price_per_item_satang FROM sales'):
+        running_real += quantity * price
+        running_satang += quantity * price_satang
+    print(f'running REAL total: {running_real:.6f}, integer total: {running_satang / 100:.2f}, '
+          f'drift: {abs(running_real - running_satang / 100):.2e} baht')
+    conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Multi-process stress test for stock-out: several worker processes submit
+stock-out forms for the same few variants at once. Checks that no variant
+goes below zero and that every sold unit has exactly one sales row, and
+reports sales rows per second.
+
+    python benchmarks/stock_contention.py --workers 8 --forms 300
+    python benchmarks/stock_contention.py --legacy    # the old unchecked SELECT/UPDATE loop, for comparison
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db  # noqa: E402
+from stock import stock_out  # noqa: E402
+
+def legacy_stock_out(conn, user_id, sku_list, details_list, quantity_list, price_list, group_index_list):
+    """The original per-row loop: look up, insert, decrement without any stock check."""
+    sale_date = time.strftime('%Y-%m-%d %H:%M:%S')
+    for group_index, details, quantity, price in zip(group_index_list, details_list, quantity_list, price_list):
+        sku = sku_list[int(group_index)]
+        product = conn.execute('SELECT product_id, stock FROM products WHERE sku = ? AND details = ? AND user_id = ?',
+                               (sku, details, user_id)).fetchone()
+        if product is None:
+            continue
+        conn.execute('INSERT INTO sales (product_id, quantity, price_per_item, sale_date, user_id) VALUES (?, ?, ?, ?, ?)',
+                     (product[0], int(quantity), float(price), sale_date, user_id))
+        conn.execute('UPDATE products SET stock = stock - ? WHERE product_id = ?', (int(quantity), product[0]))
+        conn.commit()
+
+def worker(path, seed, forms, variants, lines, legacy, start_at, out):
+    random.seed(seed)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    while time.time() < start_at:
+        time.sleep(0.001)
+    submit = legacy_stock_out if legacy else stock_out
+    sold = short = 0
+    started = time.perf_counter()
+    for _ in range(forms):
+        picks = [random.randrange(variants) for _ in range(lines)]
+        results = submit(conn, 1, ['HOT'], [f'v{p}' for p in picks], [str(random.randint(1, 3)) for _ in picks],
+                         ['100'] * lines, ['0'] * lines)
+        for result in results or []:
+            sold += result['status'] == 'sold'
+            short += result['status'] == 'insufficient_stock'
+    out.put((sold, short, time.perf_counter() - started))
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--forms', type=int, default=300, help='forms per worker')
+    parser.add_argument('--lines', type=int, default=5, help='rows per form')
+    parser.add_argument('--variants', type=int, default=4)
+    parser.add_argument('--stock', type=int, default=5000, help='starting stock per variant')
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    init_db(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany("INSERT INTO products (user_id, name, sku, factory_sku, details, stock, created_at) VALUES (1, 'Hot', 'HOT', 'F-HOT', ?, ?, '2025-01-01')",
+                         [(f'v{i}', args.stock) for i in range(args.variants)])
+
+    out = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [multiprocessing.Process(target=worker, args=(path, seed, args.forms, args.variants, args.lines, args.legacy, start_at, out))
+                 for seed in range(args.workers)]
+    for process in processes:
+        process.start()
+    reports = [out.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    elapsed = max(report[2] for report in reports)
+    stock = {row[0]: row[1] for row in conn.execute("SELECT details, stock FROM products WHERE sku = 'HOT'")}
+    sold_units = {row[0]: row[1] for row in conn.execute('''
+        SELECT p.details, SUM(s.quantity) FROM sales s JOIN products p ON p.product_id = s.product_id GROUP BY p.details
+    ''')}
+    sales_rows = conn.execute('SELECT COUNT(*) FROM sales').fetchone()[0]
+    conn.close()
+
+    mode = 'legacy loop' if args.legacy else 'conditional decrement'
+    print(f'{mode}: {args.workers} workers x {args.forms} forms x {args.lines} rows on {args.variants} variants '
+          f'of {args.stock} units')
+    print(f'{sales_rows:,} sales rows in {elapsed:.2f}s = {sales_rows / elapsed:,.0f} sales/s')
+    if not args.legacy:
+        print(f"rows sold {sum(r[0] for r in reports):,}, rows refused for stock {sum(r[1] for r in reports):,}")
+    problems = 0
+    for details in sorted(stock):
+        units = sold_units.get(details, 0)
+        ok = stock[details] >= 0 and stock[details] + units == args.stock
+        problems += not ok
+        print(f"  {details}: stock {stock[details]:>6}, sold {units:>6}{'' if ok else '  <-- OVERSOLD / LOST UPDATE'}")
+    print('no oversell' if not problems else f'{problems} variant(s) oversold or inconsistent')
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Small in-process caches.
+
+TTLCache is a bounded LRU whose entries also expire after `ttl` seconds.
+TieredCache puts a TTLCache in front of an optional shared backend (any
+object with get/set/delete, e.g. a Redis client wrapper) so several worker
+processes can share entries; DictBackend is a local stand-in for it.
+ResponseCache is a TTLCache for response bodies that refuses oversized ones.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+class ResponseCache(TTLCache):
+    """
+    TTLCache for rendered response bodies. Bodies over max_entry_bytes are
+    not stored, so memory stays under roughly maxsize * max_entry_bytes.
+    """
+
+    def __init__(self, maxsize=512, ttl=600, max_entry_bytes=128 * 1024):
+        super().__init__(maxsize, ttl)
+        self.max_entry_bytes = max_entry_bytes
+        self.too_large = 0
+        self.not_modified = 0
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def set(self, key, value, ttl=None):
+        """`value` is (body bytes, mimetype, headers); returns False when the body is too large to keep."""
+        if len(value[0]) > self.max_entry_bytes:
+            with self._lock:
+                self.too_large += 1
+            return False
+        super().set(key, value, ttl)
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['too_large'] = self.too_large
+            stats['not_modified'] = self.not_modified
+            stats['bytes'] = sum(len(entry[1][0]) for entry in self._data.values())
+        return stats
+
+class DictBackend:
+    """Process-local stand-in for a shared cache backend (same get/set/delete API)."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.time():
+                self._data.pop(key, None)
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+class TieredCache:
+    """
+    A local TTLCache backed by an optional shared backend.
+    Values stored in the shared backend must be plain data (dicts, strings, numbers).
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, shared=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.shared = shared
+        self.shared_hits = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.shared_hits += 1
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value, self.local.ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
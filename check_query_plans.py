@@ -0,0 +1,175 @@
+"""
+Runs EXPLAIN QUERY PLAN for every SQL statement in the app against a fresh
+schema from database.init_db() and fails if any of them scans a whole table.
+Modules in AUTH_MODULES are checked against the auth database schema
+(otp_store, mailer) instead. SQL that is put together at run time
+(export.select_rows, rollups.sales_report) is captured by running those
+functions once per variant with a trace callback.
+
+    python check_query_plans.py             # check the modules in QUERY_MODULES
+    python check_query_plans.py other.py    # check specific modules
+"""
+import ast
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import date
+
+from database import init_db
+
+# Modules whose request-path queries must be served by an index.
+QUERY_MODULES = ['app.py', 'ledger.py', 'stock.py', 'export.py', 'rollups.py', 'search.py',
+                 'summary.py', 'versions.py', 'otp_store.py', 'mailer.py']
+
+# Modules whose tables live in the auth database (AUTH_DATABASE_PATH).
+AUTH_MODULES = {'otp_store.py', 'mailer.py'}
+
+# Functions and constants that never run inside a request: CLIs, verification
+# and background sweepers. They are allowed to read whole tables.
+NOT_REQUEST_PATH = {
+    'rollups.py': {'rebuild', 'verify', 'compact', 'main'},
+    'summary.py': {'rebuild', 'verify', 'main', 'EXPECTED_USER_SUMMARY_SQL', 'EXPECTED_PRODUCT_SUMMARY_SQL'},
+    'versions.py': {'bump_all'},
+    'otp_store.py': {'sweep'},
+    'mailer.py': {'outbox_counts'},
+}
+
+
+def _skipped_lines(tree, names):
+    """Line ranges of the functions and assignments named in `names`."""
+    ranges = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name in names:
+            ranges.append((node.lineno, node.end_lineno))
+        elif (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id in names):
+            ranges.append((node.lineno, node.end_lineno))
+    return ranges
+
+
+def collect_queries(path):
+    """
+    Returns (line, sql) for every literal string passed to .execute()/.executemany()
+    and every module-level string constant whose name ends in _SQL, except
+    those inside the NOT_REQUEST_PATH entries for the module.
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    skipped = _skipped_lines(tree, NOT_REQUEST_PATH.get(os.path.basename(path), set()))
+
+    queries = []
+    for node in ast.walk(tree):
+        if any(start <= getattr(node, 'lineno', 0) <= end for start, end in skipped):
+            continue
+        if (isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ('execute', 'executemany')
+                and node.args
+                and isinstance(node.args[0], ast.Constant)
+                and isinstance(node.args[0].value, str)):
+            queries.append((node.lineno, node.args[0].value.strip()))
+        elif (isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id.endswith('_SQL')
+                and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)):
+            queries.append((node.lineno, node.value.value.strip()))
+    return sorted(queries)
+
+
+def find_table_scans(conn, sql):
+    """Returns the plan lines that scan a table instead of searching an index."""
+    if not sql.upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+        return []
+    params = [None] * sql.count('?')
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    # ผลของ CTE/subquery ถูกกรองมาแล้ว, sqlite_master เป็นตารางระบบเล็กๆ
+    # และ VIRTUAL TABLE INDEX คือการค้นผ่าน index ของ FTS5
+    derived = {'sqlite_master'} | {name.lower() for name in re.findall(r'(?:\bWITH|,)\s*(\w+)\s+AS\s*\(', sql, re.I)}
+    return [row[3] for row in plan
+            if row[3].startswith('SCAN ') and 'CONSTANT ROW' not in row[3]
+            and not row[3].startswith('SCAN (subquery-') and row[3].split()[1].lower() not in derived
+            and 'VIRTUAL TABLE INDEX' not in row[3]]
+
+
+def traced_queries(conn):
+    """Returns (label, sql) for the statements the run-time query builders produce."""
+    from export import EXPORTS, select_rows
+    from rollups import day_number, sales_report
+
+    # watermark กลางช่วง: รายงานต้องอ่านทั้ง daily, monthly และ sales ดิบ
+    conn.execute('UPDATE rollup_state SET compacted_before = ? WHERE id = 1', (day_number(date(2025, 6, 1)),))
+    calls = [(f'export.select_rows({kind!r})', lambda kind=kind: select_rows(conn, kind, 1, after=1, since='2025-01-01', limit=10))
+             for kind in EXPORTS]
+    calls += [(f'rollups.sales_report({granularity!r}, by_product={by_product})',
+               lambda granularity=granularity, by_product=by_product:
+                   sales_report(conn, 1, granularity, date(2025, 1, 15), date(2025, 9, 10), by_product))
+              for granularity in ('day', 'week', 'month') for by_product in (False, True)]
+
+    queries = []
+    for label, call in calls:
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+        queries += [(label, sql.strip()) for sql in statements]
+    conn.rollback()
+    return queries
+
+
+def create_auth_schema(database):
+    from mailer import OUTBOX_SCHEMA
+    from otp_store import SQLiteBackend
+
+    conn = sqlite3.connect(database)
+    for statement in SQLiteBackend.SCHEMA + OUTBOX_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def report(where, sql, scans):
+    print(f'{where}: {" ".join(sql.split())}')
+    for detail in scans:
+        print(f'    -> {detail}')
+
+
+def main(*paths):
+    tmpdir = tempfile.mkdtemp()
+    database = os.path.join(tmpdir, 'plan_check.db')
+    init_db(database)
+    conn = sqlite3.connect(database)
+    auth_conn = create_auth_schema(os.path.join(tmpdir, 'plan_check_auth.db'))
+
+    checked = 0
+    failures = 0
+    for path in paths or QUERY_MODULES:
+        module_conn = auth_conn if os.path.basename(path) in AUTH_MODULES else conn
+        for lineno, sql in collect_queries(path):
+            checked += 1
+            scans = find_table_scans(module_conn, sql)
+            if scans:
+                failures += 1
+                report(f'{path}:{lineno}', sql, scans)
+
+    if not paths:
+        for label, sql in traced_queries(conn):
+            checked += 1
+            scans = find_table_scans(conn, sql)
+            if scans:
+                failures += 1
+                report(label, sql, scans)
+
+    auth_conn.close()
+    conn.close()
+    print(f'Checked {checked} queries, {failures} with table scans.')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
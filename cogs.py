@@ -0,0 +1,393 @@
+"""
+Cost of goods sold per factory SKU, kept in its own tables.
+
+Every live order is a purchase lot: `quantity` units of its factory_sku at
+cost_per_item_satang. Sales of products with that factory_sku use the lots
+up in date order (orders before sales on the same timestamp). Two methods
+are tracked side by side:
+
+    fifo      the oldest remaining lot is used up first (cogs_layers)
+    average   perpetual moving average, recomputed on every purchase
+
+COGS_METHOD picks the one written to sales.cost_satang; the summary and
+rollup triggers add that column up like revenue, so profit queries never
+look at orders. Units sold beyond every purchase so far cost the latest
+order's unit price. Stock-ins carry no cost in this schema: they only move
+products.stock, which the dashboard values at cogs_state.unit_cost_satang.
+
+Triggers on orders, sales and products queue the affected SKU in
+cogs_pending. refresh() drains the queue: new rows dated after the SKU's
+last processed event are applied incrementally; anything else (back-dated
+rows, edits, deletes, restores, a product moved to another factory_sku)
+replays that one SKU from its history.
+
+    python cogs.py refresh    # apply queued changes
+    python cogs.py rebuild    # recompute every SKU from scratch
+    python cogs.py verify     # compare stored costs with a fresh replay
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from collections import deque
+
+import rollups
+import summary
+
+COGS_METHOD = os.environ.get('COGS_METHOD', 'fifo')
+# เขียนต้นทุนเกินจำนวนนี้ในครั้งเดียว: ปิด trigger ของตารางสรุปแล้วคำนวณใหม่ทั้งก้อน (เร็วกว่าทีละแถว)
+BULK_UPDATE_ROWS = int(os.environ.get('COGS_BULK_UPDATE_ROWS', 20000))
+# SQLite จำกัดจำนวน ? ต่อคำสั่ง
+LOOKUP_CHUNK = 400
+
+COGS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_state (
+        user_id INTEGER NOT NULL,
+        factory_sku TEXT NOT NULL,
+        on_hand INTEGER NOT NULL DEFAULT 0,
+        average_cost REAL NOT NULL DEFAULT 0,
+        last_cost_satang INTEGER NOT NULL DEFAULT 0,
+        unit_cost_satang INTEGER NOT NULL DEFAULT 0,
+        frontier_ts INTEGER NOT NULL DEFAULT 0,
+        frontier_rank INTEGER NOT NULL DEFAULT 0,
+        frontier_id INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, factory_sku)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_layers (
+        user_id INTEGER NOT NULL,
+        factory_sku TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        remaining INTEGER NOT NULL,
+        unit_cost_satang INTEGER NOT NULL,
+        PRIMARY KEY (user_id, factory_sku, ts, order_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_pending (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        factory_sku TEXT,
+        kind TEXT NOT NULL,
+        ref_id INTEGER,
+        ts INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_cogs_pending_user ON cogs_pending(user_id)',
+]
+
+# คอลัมน์ของ cogs_state ตามลำดับใน CREATE TABLE
+STATE_COLUMNS = ['user_id', 'factory_sku', 'on_hand', 'average_cost', 'last_cost_satang', 'unit_cost_satang',
+                 'frontier_ts', 'frontier_rank', 'frontier_id']
+
+PRODUCT_SKU = '(SELECT factory_sku FROM products WHERE product_id = {row}.product_id)'
+
+def _queue(kind, user, sku, ref_id='NULL', ts='NULL', where=None):
+    condition = f' WHERE {where}' if where else ''
+    return f'''
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT {user}, {sku}, '{kind}', {ref_id}, {ts}{condition};'''
+
+def cogs_triggers():
+    """
+    Triggers that queue every change affecting a SKU's cost history.
+    Deleting a row that was already soft-deleted (the retention purge)
+    changes nothing and queues nothing.
+    """
+    old_sale_sku = PRODUCT_SKU.format(row='OLD')
+    new_sale_sku = PRODUCT_SKU.format(row='NEW')
+    replay_old = _queue('replay', 'OLD.user_id', 'OLD.factory_sku')
+    replay_new = _queue('replay', 'NEW.user_id', 'NEW.factory_sku')
+    replay_old_sale = _queue('replay', 'OLD.user_id', old_sale_sku)
+    replay_new_sale = _queue('replay', 'NEW.user_id', new_sale_sku)
+    new_order = _queue('order', 'NEW.user_id', 'NEW.factory_sku', 'NEW.order_id', 'NEW.order_ts', 'NEW.deleted_at IS NULL')
+    new_sale = _queue('sale', 'NEW.user_id', new_sale_sku, 'NEW.sale_id', 'NEW.sale_ts', 'NEW.deleted_at IS NULL')
+    order_columns = 'user_id, factory_sku, quantity, cost_per_item, order_date, deleted_at'
+    sale_columns = 'user_id, product_id, quantity, sale_date, deleted_at'
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_insert AFTER INSERT ON orders BEGIN{new_order}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_update AFTER UPDATE OF {order_columns} ON orders BEGIN{replay_old}{replay_new}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_delete AFTER DELETE ON orders WHEN OLD.deleted_at IS NULL BEGIN{replay_old}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_insert AFTER INSERT ON sales BEGIN{new_sale}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_update AFTER UPDATE OF {sale_columns} ON sales BEGIN{replay_old_sale}{replay_new_sale}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_delete AFTER DELETE ON sales WHEN OLD.deleted_at IS NULL BEGIN{replay_old_sale}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_products_cogs_update AFTER UPDATE OF user_id, factory_sku ON products BEGIN{replay_old}{replay_new}\nEND',
+    ]
+
+def create_cogs_tables(c):
+    for statement in COGS_SCHEMA + cogs_triggers():
+        c.execute(statement)
+
+
+class SkuCost:
+    """Cost state of one (user, factory_sku) while its events are applied in date order."""
+
+    ORDER, SALE = 0, 1
+
+    def __init__(self, state=None, layers=()):
+        if state is None:
+            self.on_hand, self.average, self.last_cost = 0, 0.0, 0
+            self.frontier = (0, 0, 0)
+        else:
+            self.on_hand, self.average, self.last_cost = state['on_hand'], state['average_cost'], state['last_cost_satang']
+            self.frontier = (state['frontier_ts'], state['frontier_rank'], state['frontier_id'])
+        # [ts, order_id, quantity, remaining, unit_cost_satang] เฉพาะ lot ที่ยังเหลือของ
+        self.layers = deque([list(layer) for layer in layers])
+
+    def receive(self, ts, order_id, quantity, unit_cost):
+        self.frontier = (ts, self.ORDER, order_id)
+        if quantity <= 0:
+            return
+        self.layers.append([ts, order_id, quantity, quantity, unit_cost])
+        base = max(self.on_hand, 0)
+        self.average = (base * self.average + quantity * unit_cost) / (base + quantity)
+        self.on_hand += quantity
+        self.last_cost = unit_cost
+
+    def issue(self, ts, sale_id, quantity):
+        """Takes `quantity` units out; returns their cost as {'fifo': satang, 'average': satang}."""
+        self.frontier = (ts, self.SALE, sale_id)
+        average = round(quantity * self.average)
+        fifo = 0
+        left = quantity
+        while left > 0 and self.layers:
+            layer = self.layers[0]
+            taken = min(left, layer[3])
+            layer[3] -= taken
+            fifo += taken * layer[4]
+            left -= taken
+            if layer[3] == 0:
+                self.layers.popleft()
+        # ขายเกินกว่าที่สั่งเข้ามา (หรือคืนของ quantity ติดลบ): ใช้ราคาทุนล่าสุด
+        fifo += left * self.last_cost
+        self.on_hand -= quantity
+        return {'fifo': fifo, 'average': average}
+
+    def unit_cost(self, method=COGS_METHOD):
+        """Current cost of one unit in stock, used to value products.stock."""
+        if method == 'average':
+            return round(self.average) if self.average else self.last_cost
+        remaining = sum(layer[3] for layer in self.layers)
+        if remaining:
+            return round(sum(layer[3] * layer[4] for layer in self.layers) / remaining)
+        return self.last_cost
+
+def _fetch_in(c, sql, ids):
+    rows = []
+    ids = list(ids)
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        chunk = ids[start:start + LOOKUP_CHUNK]
+        rows += c.execute(sql.format(ids=', '.join('?' * len(chunk))), chunk).fetchall()
+    return rows
+
+ORDER_EVENTS_SQL = '''
+    SELECT order_id, COALESCE(order_ts, 0) AS ts, quantity, cost_per_item_satang
+    FROM orders
+    WHERE user_id = ? AND factory_sku = ? AND deleted_at IS NULL
+'''
+
+# CROSS JOIN บังคับลำดับ products -> sales (idx_sales_product) ไม่ให้ไล่ขายทั้งหมดของ user
+SALE_EVENTS_SQL = '''
+    SELECT s.sale_id, COALESCE(s.sale_ts, 0) AS ts, s.quantity, s.cost_satang
+    FROM products p
+    CROSS JOIN sales s ON s.product_id = p.product_id
+    WHERE p.user_id = ? AND p.factory_sku = ? AND s.user_id = ? AND s.deleted_at IS NULL
+'''
+
+def _events(orders, sales):
+    """Merges order and sale rows into one list sorted by (ts, kind, id)."""
+    events = [((row[1], SkuCost.ORDER, row[0]), row) for row in orders]
+    events += [((row[1], SkuCost.SALE, row[0]), row) for row in sales]
+    events.sort(key=lambda event: event[0])
+    return events
+
+def _apply(engine, events, method, changes):
+    """Runs events through engine; appends (cost, sale_id) for sales whose stored cost changes."""
+    for (ts, kind, ref_id), row in events:
+        if kind == SkuCost.ORDER:
+            engine.receive(ts, ref_id, row[2], row[3])
+        else:
+            cost = engine.issue(ts, ref_id, row[2])[method]
+            if cost != row[3]:
+                changes.append((cost, ref_id))
+
+def replay(c, user_id, factory_sku, method=COGS_METHOD):
+    """Recomputes one SKU from all its live orders and sales. Returns (engine, cost changes)."""
+    orders = c.execute(ORDER_EVENTS_SQL, (user_id, factory_sku)).fetchall()
+    sales = c.execute(SALE_EVENTS_SQL, (user_id, factory_sku, user_id)).fetchall()
+    engine = SkuCost()
+    changes = []
+    _apply(engine, _events(orders, sales), method, changes)
+    return engine, changes
+
+def _save(c, user_id, factory_sku, engine, method):
+    c.execute('''
+        INSERT OR REPLACE INTO cogs_state
+            (user_id, factory_sku, on_hand, average_cost, last_cost_satang, unit_cost_satang, frontier_ts, frontier_rank, frontier_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, factory_sku, engine.on_hand, engine.average, engine.last_cost, engine.unit_cost(method), *engine.frontier))
+    c.execute('DELETE FROM cogs_layers WHERE user_id = ? AND factory_sku = ?', (user_id, factory_sku))
+    c.executemany('''
+        INSERT INTO cogs_layers (user_id, factory_sku, ts, order_id, quantity, remaining, unit_cost_satang)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(user_id, factory_sku, *layer) for layer in engine.layers])
+
+def write_costs(c, changes):
+    """
+    Stores new sales.cost_satang values. Small batches go through the
+    summary/rollup triggers row by row; large ones disable the sales update
+    triggers and recompute those tables in one pass.
+    """
+    if len(changes) <= BULK_UPDATE_ROWS:
+        c.executemany('UPDATE sales SET cost_satang = ? WHERE sale_id = ?', changes)
+        return
+    c.execute('DROP TRIGGER IF EXISTS trg_sales_summary_update')
+    c.execute('DROP TRIGGER IF EXISTS trg_sales_rollup_update')
+    c.executemany('UPDATE sales SET cost_satang = ? WHERE sale_id = ?', changes)
+    summary.create_summary_tables(c)
+    summary.rebuild(c)
+    rollups.create_rollup_tables(c)
+    rollups.rebuild(c)
+
+def apply_pending(c, user_id=None, method=COGS_METHOD):
+    """
+    Applies the queued changes (all users, or one) inside the caller's
+    transaction. Returns {'incremental': n, 'replayed': n, 'sales': n} counts.
+    """
+    where, params = ('WHERE user_id = ?', [user_id]) if user_id is not None else ('', [])
+    pending = c.execute(f'SELECT id, user_id, factory_sku, kind, ref_id FROM cogs_pending {where} ORDER BY id', params).fetchall()
+    counts = {'incremental': 0, 'replayed': 0, 'sales': 0}
+    if not pending:
+        return counts
+
+    groups = {}
+    for row in pending:
+        if row[1] is not None and row[2] is not None:
+            groups.setdefault((row[1], row[2]), []).append(row)
+
+    changes = []
+    for (owner, sku), rows in groups.items():
+        engine = None
+        if not any(row[3] == 'replay' for row in rows):
+            orders = _fetch_in(c, 'SELECT order_id, COALESCE(order_ts, 0), quantity, cost_per_item_satang '
+                                  'FROM orders WHERE order_id IN ({ids}) AND deleted_at IS NULL',
+                               [row[4] for row in rows if row[3] == 'order'])
+            sales = _fetch_in(c, 'SELECT sale_id, COALESCE(sale_ts, 0), quantity, cost_satang '
+                                 'FROM sales WHERE sale_id IN ({ids}) AND deleted_at IS NULL',
+                              [row[4] for row in rows if row[3] == 'sale'])
+            events = _events(orders, sales)
+            state = c.execute('SELECT * FROM cogs_state WHERE user_id = ? AND factory_sku = ?', (owner, sku)).fetchone()
+            if state is not None and events and events[0][0] < (state[6], state[7], state[8]):
+                events = None  # ลงวันที่ย้อนหลังกว่าเหตุการณ์ล่าสุดที่คิดไปแล้ว ต้อง replay
+            if events is not None:
+                layers = c.execute('''
+                    SELECT ts, order_id, quantity, remaining, unit_cost_satang FROM cogs_layers
+                    WHERE user_id = ? AND factory_sku = ? ORDER BY ts, order_id
+                ''', (owner, sku)).fetchall()
+                engine = SkuCost(state and dict(zip(STATE_COLUMNS, state)), layers)
+                _apply(engine, events, method, changes)
+                counts['incremental'] += 1
+        if engine is None:
+            engine, replayed = replay(c, owner, sku, method)
+            changes += replayed
+            counts['replayed'] += 1
+        _save(c, owner, sku, engine, method)
+
+    write_costs(c, changes)
+    c.execute(f"DELETE FROM cogs_pending WHERE id <= ?{' AND user_id = ?' if user_id is not None else ''}",
+              [pending[-1][0]] + params)
+    counts['sales'] = len(changes)
+    return counts
+
+def refresh(conn, user_id=None):
+    """
+    Brings costs up to date before a report. Only reads one index entry when
+    nothing is queued; otherwise applies the queue in its own transaction
+    (or in the caller's, if one is open).
+    """
+    where, params = ('WHERE user_id = ?', [user_id]) if user_id is not None else ('', [])
+    if conn.execute(f'SELECT 1 FROM cogs_pending {where} LIMIT 1', params).fetchone() is None:
+        return None
+    if conn.in_transaction:
+        return apply_pending(conn, user_id)  # ผู้เรียก commit เอง
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        counts = apply_pending(conn, user_id)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return counts
+
+def pending_count(conn):
+    """Changes queued and not applied yet (all users), for /metrics."""
+    return conn.execute('SELECT COUNT(*) FROM cogs_pending').fetchone()[0]
+
+def all_skus(c):
+    return c.execute('''
+        SELECT user_id, factory_sku FROM orders WHERE deleted_at IS NULL AND user_id IS NOT NULL
+        UNION
+        SELECT user_id, factory_sku FROM products WHERE user_id IS NOT NULL
+    ''').fetchall()
+
+def rebuild(c, method=COGS_METHOD):
+    """Recomputes every SKU's cost state and every sale's cost inside the caller's transaction."""
+    c.execute('DELETE FROM cogs_pending')
+    c.execute('DELETE FROM cogs_state')
+    c.execute('DELETE FROM cogs_layers')
+    changes = []
+    skus = all_skus(c)
+    for user_id, factory_sku in skus:
+        engine, replayed = replay(c, user_id, factory_sku, method)
+        changes += replayed
+        _save(c, user_id, factory_sku, engine, method)
+    write_costs(c, changes)
+    return len(skus), len(changes)
+
+def verify(conn, method=COGS_METHOD):
+    """Replays every SKU without writing and returns a list of mismatches."""
+    mismatches = []
+    queued = conn.execute('SELECT COUNT(*) FROM cogs_pending').fetchone()[0]
+    if queued:
+        mismatches.append(f'{queued} queued changes not applied yet (run refresh)')
+    for user_id, factory_sku in all_skus(conn):
+        engine, changes = replay(conn, user_id, factory_sku, method)
+        for cost, sale_id in changes:
+            mismatches.append(f'sale {sale_id}: cost_satang expected {cost}')
+        state = conn.execute('SELECT unit_cost_satang, on_hand FROM cogs_state WHERE user_id = ? AND factory_sku = ?',
+                             (user_id, factory_sku)).fetchone()
+        expected = (engine.unit_cost(method), engine.on_hand)
+        if (tuple(state) if state else (0, 0)) != expected:
+            mismatches.append(f'user {user_id} sku {factory_sku}: state {tuple(state) if state else None}, expected {expected}')
+    return mismatches
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Maintain the cost-of-goods tables.')
+    parser.add_argument('command', choices=['refresh', 'rebuild', 'verify'])
+    parser.add_argument('--database', default=DATABASE)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, timeout=30)
+    if args.command == 'refresh':
+        print(f'Applied queued changes: {refresh(conn) or "nothing queued"}')
+    elif args.command == 'rebuild':
+        conn.execute('BEGIN IMMEDIATE')
+        skus, costed = rebuild(conn)
+        conn.commit()
+        print(f'{skus:,} SKUs replayed, {costed:,} sale costs changed ({COGS_METHOD}).')
+
+    mismatches = verify(conn)
+    conn.close()
+    for line in mismatches[:50]:
+        print(line)
+    print(f'{len(mismatches)} mismatches.')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
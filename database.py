@@ -1,121 +1,202 @@
+import os
 import sqlite3
+import sys
+import threading
+import time
 
-def init_db():
+from metrics import TracedConnection
+from migrate import migrate
+
+DATABASE = os.environ.get('DATABASE_PATH', 'inventory.db')
+
+# --- การตั้งค่า Connection Pool (ปรับได้ผ่าน Environment Variables) ---
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+def gevent_patched():
+    """True when gevent has monkey-patched this process (gunicorn -k gevent, see gunicorn.conf.py)."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+def _is_busy(error):
+    # BUSY_SNAPSHOT: snapshot ของ transaction นี้เก่าแล้ว รอไปก็ไม่หาย ต้อง rollback
+    code = getattr(error, 'sqlite_errorcode', None)
+    return code is not None and code & 0xff == sqlite3.SQLITE_BUSY and code != sqlite3.SQLITE_BUSY_SNAPSHOT
+
+def _retry_busy(method):
+    def wrapper(self, *args):
+        deadline = None
+        delay = 0.001
+        while True:
+            try:
+                return method(self, *args)
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e):
+                    raise
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + BUSY_TIMEOUT_MS / 1000
+                if now >= deadline:
+                    raise
+                self.busy_retries += 1
+                time.sleep(min(delay, deadline - now))
+                delay = min(delay * 2, 0.05)
+    return wrapper
+
+
+class CooperativeConnection(TracedConnection):
     """
-    Initializes the database. Creates tables if they don't exist
-    and adds the user_id column to existing tables if it's missing.
+    The connection class under gevent. SQLite's busy handler sleeps inside C
+    code, which would stall every greenlet of the worker, including the one
+    that holds the write lock. These connections use busy_timeout = 0 and
+    retry a locked statement after time.sleep(), which gevent makes yield.
+    The wait is still bounded by DB_BUSY_TIMEOUT_MS.
     """
-    conn = sqlite3.connect('inventory.db')
-    c = conn.cursor()
-
-    # สร้างตาราง users ใหม่ให้มีทุกคอลัมน์
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL,
-            email TEXT NOT NULL UNIQUE,
-            is_verified BOOLEAN DEFAULT FALSE,
-            otp TEXT,
-            otp_expiry TEXT
-        )
-    ''')
-
-    # 2. Create the 'products' table with all necessary columns including user_id
-    # This combines the original creation and the later alteration.
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            product_id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            name TEXT NOT NULL,
-            sku TEXT NOT NULL,
-            factory_sku TEXT NOT NULL,
-            details TEXT,
-            stock INTEGER NOT NULL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT,
-            deleted_at TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-
-    # 3. Create other tables if they don't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            order_id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            product_details TEXT NOT NULL,
-            factory_sku TEXT NOT NULL,
-            quantity INTEGER NOT NULL,
-            cost_per_item REAL NOT NULL,
-            order_date TEXT NOT NULL,
-            updated_at TEXT,
-            deleted_at TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sales (
-            sale_id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            product_id INTEGER,
-            quantity INTEGER NOT NULL,
-            price_per_item REAL NOT NULL,
-            sale_date TEXT NOT NULL,
-            updated_at TEXT,
-            deleted_at TEXT,
-            FOREIGN KEY(product_id) REFERENCES products(product_id),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            payment_id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            order_id INTEGER,
-            amount REAL NOT NULL,
-            payment_date TEXT NOT NULL,
-            updated_at TEXT,
-            deleted_at TEXT,
-            FOREIGN KEY(order_id) REFERENCES orders(order_id),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-    
-    # 4. Add 'user_id' column to tables that might be missing it (for backward compatibility)
-    tables_to_update = ['products', 'orders', 'sales', 'payments']
-    for table in tables_to_update:
-        try:
-            # This will fail if the column already exists, which is caught by the exception.
-            c.execute(f'ALTER TABLE {table} ADD COLUMN user_id INTEGER REFERENCES users(id)')
-            print(f"Added 'user_id' column to '{table}' table.")
-        except sqlite3.OperationalError as e:
-            # The most common error here is "duplicate column name". We can ignore it.
-            if "duplicate column name" in str(e):
-                pass # Column already exists, no action needed.
-            else:
-                raise # Re-raise other unexpected errors.
-        try:
-            c.execute('ALTER TABLE users ADD COLUMN email TEXT UNIQUE')
-        except sqlite3.OperationalError:
-            pass # คอลัมน์มีอยู่แล้ว
-        try:
-            c.execute('ALTER TABLE users ADD COLUMN is_verified BOOLEAN DEFAULT FALSE')
-        except sqlite3.OperationalError:
-            pass # คอลัมน์มีอยู่แล้ว
-        try:
-            c.execute('ALTER TABLE users ADD COLUMN otp TEXT')
-        except sqlite3.OperationalError:
-            pass # คอลัมน์มีอยู่แล้ว
-        try:
-            c.execute('ALTER TABLE users ADD COLUMN otp_expiry TEXT')
-        except sqlite3.OperationalError:
-            pass # คอลัมน์มีอยู่แล้ว
+    busy_retries = 0
+
+    execute = _retry_busy(TracedConnection.execute)
+    executemany = _retry_busy(TracedConnection.executemany)
+    commit = _retry_busy(TracedConnection.commit)
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections for one worker process.
+    Connections are opened lazily, tuned once (WAL, synchronous=NORMAL,
+    page cache, mmap, busy_timeout) and then reused across requests. They are
+    metrics.TracedConnection objects, so a request can time its statements
+    (CooperativeConnection when the process runs under gevent).
+    """
+
+    def __init__(self, database=DATABASE, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.cooperative = gevent_patched()
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+        # Counters exposed through stats()
+        self.checkouts = 0
+        self.connections_opened = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.busy_retries = 0
+
+    def _connect(self):
+        busy_timeout_ms = 0 if self.cooperative else BUSY_TIMEOUT_MS
+        conn = sqlite3.connect(self.database, timeout=busy_timeout_ms / 1000, check_same_thread=False,
+                               factory=CooperativeConnection if self.cooperative else TracedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute(f'PRAGMA busy_timeout = {busy_timeout_ms}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def acquire(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f'No database connection free after {self.timeout}s')
+        waited = time.perf_counter() - started
+
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            conn = self._idle.pop() if self._idle else None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self.connections_opened += 1
+        return conn
+
+    def release(self, conn):
+        if self.cooperative:
+            with self._lock:
+                self.busy_retries += conn.busy_retries
+            conn.busy_retries = 0
+        # ทิ้ง transaction ที่ยังไม่ได้ commit (เช่นเกิด error กลาง request)
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._idle.append(conn)
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'connections_opened': self.connections_opened,
+                'timeouts': self.timeouts,
+                'wait_time_total': self.wait_time_total,
+                'wait_time_max': self.wait_time_max,
+                'wait_time_avg': self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                'cooperative': self.cooperative,
+                'busy_retries': self.busy_retries,
+            }
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
 
-    conn.commit()
-    conn.close()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns this process's connection pool. A new pool is created after a
+    fork (e.g. gunicorn with preload) so workers never share connections.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool()
+        return _pool
+
+def init_db(database=DATABASE):
+    """
+    Brings the database schema up to date by applying any pending
+    migrations from migrations/ (see migrate.py). When the schema is
+    already current this only reads PRAGMA user_version. After a
+    migration, changes the migrations queued for the cost-of-goods engine
+    (e.g. 0008's replay of every SKU) are applied as well.
+    """
+    applied = migrate(database)
+    if applied:
+        from cogs import refresh as refresh_costs
+
+        conn = sqlite3.connect(database, timeout=30)
+        try:
+            refresh_costs(conn)
+        finally:
+            conn.close()
+    return applied
 
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,94 @@
+"""
+Keyset-paginated reads and streamed exports of a user's products, orders and sales.
+
+Rows are pulled from the cursor with fetchmany(), so a full export keeps a
+constant amount of data in memory no matter how many rows a user has.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+MAX_PAGE_SIZE = 1000
+FETCH_SIZE = 500
+
+# kind -> (SELECT ... FROM ... WHERE <live rows of one user>, key column, "changed at" expression)
+# คอลัมน์ระบุชื่อตรงๆ: คอลัมน์ที่ระบบสร้างเอง (*_satang, *_ts, cost_satang) ไม่ใช่ส่วนของ API
+EXPORTS = {
+    'products': ('''SELECT product_id, user_id, name, sku, factory_sku, details, stock, created_at, updated_at, deleted_at
+                    FROM products WHERE deleted_at IS NULL AND user_id = ?''',
+                 'product_id', 'COALESCE(updated_at, created_at)'),
+    'orders': ('''SELECT order_id, user_id, product_details, factory_sku, quantity, cost_per_item, order_date, updated_at, deleted_at
+                  FROM orders WHERE deleted_at IS NULL AND user_id = ?''',
+               'order_id', 'COALESCE(updated_at, order_date)'),
+    'sales': ('''SELECT s.sale_id, s.user_id, s.product_id, s.quantity, s.price_per_item, s.sale_date, s.updated_at, s.deleted_at,
+                        p.sku, p.details
+                 FROM sales s LEFT JOIN products p ON p.product_id = s.product_id
+                 WHERE s.deleted_at IS NULL AND s.user_id = ?''',
+              's.sale_id', 'COALESCE(s.updated_at, s.sale_date)'),
+}
+
+def parse_since(value):
+    """Normalizes 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' to the stored timestamp format."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+
+def select_rows(conn, kind, user_id, after=None, since=None, limit=None):
+    """Returns a cursor over live rows in key order, starting after the `after` key."""
+    sql, key, changed_at = EXPORTS[kind]
+    params = [user_id]
+    if after is not None:
+        sql += f' AND {key} > ?'
+        params.append(after)
+    if since:
+        sql += f' AND {changed_at} >= ?'
+        params.append(since)
+    sql += f' ORDER BY {key}'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(sql, params)
+
+def fetch_page(conn, kind, user_id, limit, after=None, since=None):
+    """Returns {'items': [...], 'next_after': key or None} for one page."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    items = [dict(row) for row in select_rows(conn, kind, user_id, after, since, limit)]
+    key = EXPORTS[kind][1].split('.')[-1]
+    next_after = items[-1][key] if len(items) == limit else None
+    return {'items': items, 'next_after': next_after}
+
+def iter_cursor(cursor, size=FETCH_SIZE):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+def stream_json_array(cursor):
+    """Yields a JSON array one row at a time (same shape as jsonify([dict(row), ...]))."""
+    yield '['
+    separator = ''
+    for row in iter_cursor(cursor):
+        yield separator + json.dumps(dict(row), ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+def stream_ndjson(cursor):
+    for row in iter_cursor(cursor):
+        yield json.dumps(dict(row), ensure_ascii=False) + '\n'
+
+def stream_csv(cursor):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column[0] for column in cursor.description])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in iter_cursor(cursor):
+        writer.writerow(tuple(row))
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,58 @@
+"""
+Gunicorn settings. Gunicorn loads this file from the working directory on its own:
+
+    gunicorn app:app                                  # GUNICORN_PROFILE=sync (default)
+    GUNICORN_PROFILE=gthread gunicorn app:app
+    GUNICORN_PROFILE=gevent gunicorn app:app          # needs: pip install gevent
+
+Profiles:
+- sync: one request per worker at a time. A request that waits on a SQLite
+  write lock, on the password hashing pool or on a slow client reading an
+  export keeps its worker busy the whole time. Workers = 2 x CPUs + 1.
+- gthread: GUNICORN_THREADS threads per worker. sqlite3 releases the GIL
+  while a statement runs and while it waits on a lock, so the other threads
+  keep serving. DB_POOL_SIZE defaults to the thread count, so a thread never
+  waits for a pooled connection.
+- gevent: up to GUNICORN_WORKER_CONNECTIONS requests per worker as
+  greenlets. Sockets, locks and sleeps yield. database.py switches to
+  CooperativeConnection, so SQLite lock waits yield too. A statement that is
+  running still blocks its whole worker, which is why there is one worker
+  per CPU. Keep PASSWORD_WORKERS > 0 so bcrypt runs in the process pool and
+  not on the worker's event loop.
+
+benchmarks/capacity.py compares the profiles on the same dataset.
+Command-line flags override the values here.
+"""
+import importlib.util
+import multiprocessing
+import os
+
+PROFILE = os.environ.get('GUNICORN_PROFILE', 'sync')
+CPUS = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+if PROFILE == 'sync':
+    worker_class = 'sync'
+    workers = int(os.environ.get('GUNICORN_WORKERS', 2 * CPUS + 1))
+elif PROFILE == 'gthread':
+    worker_class = 'gthread'
+    workers = int(os.environ.get('GUNICORN_WORKERS', CPUS))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    # workers จะ import database.py หลัง fork และอ่านค่านี้จาก environment ที่สืบทอดมา
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+elif PROFILE == 'gevent':
+    if importlib.util.find_spec('gevent') is None:
+        raise SystemExit('GUNICORN_PROFILE=gevent needs gevent (pip install gevent)')
+    worker_class = 'gevent'
+    workers = int(os.environ.get('GUNICORN_WORKERS', CPUS))
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+    # request ถือ connection ไว้ทั้ง request; greenlet ที่เกินจำนวนนี้รอ pool แบบ yield
+    os.environ.setdefault('DB_POOL_SIZE', '16')
+    # app ต้องถูก import หลัง gevent patch แล้ว (ใน worker) ไม่อย่างนั้น lock ของ pool จะ block ทั้ง worker
+    preload_app = False
+else:
+    raise SystemExit(f'Unknown GUNICORN_PROFILE {PROFILE!r} (use sync, gthread or gevent)')
@@ -0,0 +1,371 @@
+"""
+Streaming bulk importer for products, orders, sales and payments.
+
+Files are read incrementally (CSV, JSON array or NDJSON), validated one chunk
+at a time and loaded with executemany() in one transaction per chunk. After
+every committed chunk a checkpoint is written, so an interrupted import can
+be resumed without loading rows twice.
+
+    python importer.py products.csv --kind products --user-id 1
+    python importer.py sales.ndjson --kind sales --user-id 1 --resume
+    python importer.py orders.json --kind orders --user-id 1 --defer-indexes
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from database import DATABASE
+from stock import find_products
+from cogs import create_cogs_tables, rebuild as rebuild_cogs
+from rollups import create_rollup_tables, rebuild as rebuild_rollups
+from summary import USER_SUMMARY_SOURCES, create_summary_tables, rebuild
+from versions import VERSIONED_TABLES, bump_all as bump_versions, create_version_tables
+
+CHUNK_SIZE = 5000
+
+def _text(value):
+    value = '' if value is None else str(value).strip()
+    return value
+
+def _required_text(value):
+    value = _text(value)
+    if not value:
+        raise ValueError('is required')
+    return value
+
+def _optional_text(value):
+    return _text(value) or None
+
+def _integer(value):
+    return int(_required_text(value))
+
+def _number(value):
+    return float(_required_text(value))
+
+def _timestamp(value):
+    """Accepts 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'; empty means now."""
+    value = _text(value)
+    if not value:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # fromisoformat ทำงานในระดับ C เร็วกว่า strptime มากเมื่อ import หลายแสนแถว
+    if len(value) not in (10, 19):
+        raise ValueError('must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+    if len(value) == 19 and value[10] == ' ':
+        return value
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+def _optional_timestamp(value):
+    return _timestamp(value) if _text(value) else None
+
+# kind -> (table, [(field, converter)]). Field order matches the INSERT column order.
+KINDS = {
+    'products': ('products', [
+        ('name', _required_text), ('sku', _required_text), ('factory_sku', _required_text),
+        ('details', _optional_text), ('stock', _integer),
+        ('created_at', _timestamp), ('deleted_at', _optional_timestamp),
+    ]),
+    'orders': ('orders', [
+        ('product_details', _required_text), ('factory_sku', _required_text),
+        ('quantity', _integer), ('cost_per_item', _number),
+        ('order_date', _timestamp), ('deleted_at', _optional_timestamp),
+    ]),
+    'sales': ('sales', [
+        ('product_id', lambda v: int(v) if _text(v) else None),
+        ('quantity', _integer), ('price_per_item', _number),
+        ('sale_date', _timestamp), ('deleted_at', _optional_timestamp),
+    ]),
+    'payments': ('payments', [
+        ('order_id', _integer), ('amount', _number),
+        ('payment_date', _timestamp), ('deleted_at', _optional_timestamp),
+    ]),
+}
+
+def iter_csv(stream):
+    for row in csv.DictReader(stream):
+        yield row
+
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def iter_json_array(stream, read_size=1 << 16):
+    """Yields the objects of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if not buffer and not eof:
+                chunk = stream.read(read_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            if not buffer.startswith('['):
+                raise ValueError('JSON import must be an array of objects')
+            buffer = buffer[1:]
+            started = True
+            continue
+        buffer = buffer.lstrip(', \n\r\t')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item
+
+def iter_records(stream, fmt):
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    if fmt == 'json':
+        return iter_json_array(stream)
+    raise ValueError(f'Unknown format: {fmt}')
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    return {'.csv': 'csv', '.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension, 'csv')
+
+class Importer:
+    """
+    Loads records of one kind for one user. Call run() with an iterable of
+    dict records; progress(done, skipped, rate) is called after each chunk.
+    """
+
+    def __init__(self, conn, user_id, kind, chunk_size=CHUNK_SIZE, progress=None, checkpoint=None):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind: {kind}')
+        self.conn = conn
+        self.user_id = user_id
+        self.kind = kind
+        self.table, self.fields = KINDS[kind]
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        columns = [name for name, _ in self.fields] + ['user_id']
+        verb = 'INSERT OR IGNORE' if kind == 'products' else 'INSERT'
+        self.insert_sql = f'{verb} INTO {self.table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+
+    def _error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < 100:
+            self.errors.append({'row': line, 'error': message})
+
+    def _convert(self, line, record):
+        values = []
+        for name, convert in self.fields:
+            try:
+                values.append(convert(record.get(name)))
+            except (TypeError, ValueError) as e:
+                self._error(line, f'{name} {e}')
+                return None
+        return values
+
+    def _resolve_references(self, chunk):
+        """Drops rows whose product/order does not belong to this user."""
+        if self.kind == 'sales':
+            # แถวที่ไม่มี product_id ให้หาจาก sku + details แทน
+            keys = [(_text(r.get('sku')), _text(r.get('details'))) for _, values, r in chunk if values[0] is None]
+            by_key = find_products(self.conn, self.user_id, keys) if keys else {}
+            owned = self._owned_ids('products', 'product_id', {values[0] for _, values, _ in chunk if values[0] is not None})
+            owned.update(by_key.values())
+            kept = []
+            for line, values, record in chunk:
+                if values[0] is None:
+                    values[0] = by_key.get((_text(record.get('sku')), _text(record.get('details'))))
+                if values[0] not in owned:
+                    self._error(line, 'product not found')
+                    continue
+                kept.append((line, values, record))
+            return kept
+        if self.kind == 'payments':
+            owned = self._owned_ids('orders', 'order_id', {values[0] for _, values, _ in chunk})
+            kept = []
+            for line, values, record in chunk:
+                if values[0] not in owned:
+                    self._error(line, 'order not found')
+                    continue
+                kept.append((line, values, record))
+            return kept
+        return chunk
+
+    def _owned_ids(self, table, key, ids):
+        ids = list(ids)
+        owned = set()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows = self.conn.execute(
+                f'SELECT {key} FROM {table} WHERE user_id = ? AND {key} IN ({", ".join("?" * len(part))})',
+                [self.user_id] + part
+            ).fetchall()
+            owned.update(row[0] for row in rows)
+        return owned
+
+    def _load(self, chunk, position):
+        with self.conn:
+            chunk = self._resolve_references(chunk)
+            cursor = self.conn.executemany(self.insert_sql, [values + [self.user_id] for _, values, _ in chunk])
+            inserted = cursor.rowcount if cursor.rowcount >= 0 else len(chunk)
+        self.imported += inserted
+        self.skipped += len(chunk) - inserted
+        if self.checkpoint:
+            self.checkpoint(position, self.imported, self.skipped)
+
+    def run(self, records, skip=0):
+        """Imports records, ignoring the first `skip` (already committed) records."""
+        started = time.perf_counter()
+        chunk = []
+        position = 0
+        for position, record in enumerate(records, start=1):
+            if position <= skip:
+                continue
+            if not isinstance(record, dict):
+                self._error(position, 'record is not an object')
+                continue
+            values = self._convert(position, record)
+            if values is not None:
+                chunk.append((position, values, record))
+            if len(chunk) >= self.chunk_size:
+                self._load(chunk, position)
+                chunk = []
+                self._report(started)
+        if chunk or position > skip:
+            self._load(chunk, position)
+            self._report(started)
+        return {
+            'kind': self.kind,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'rows_read': position,
+            'errors': self.errors,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+
+    def _report(self, started):
+        if self.progress:
+            elapsed = time.perf_counter() - started
+            self.progress(self.imported, self.skipped, self.imported / elapsed if elapsed else 0)
+
+def defer_indexes(conn, table):
+    """
+    Drops the secondary indexes, summary and cost triggers of a table before
+    a large load. Returns the dropped indexes' CREATE statements, as stored
+    in sqlite_master, for restore_indexes().
+    """
+    # unique index ยังต้องกันข้อมูลซ้ำระหว่าง import จึงไม่ลบ
+    indexes = conn.execute('''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE %'
+    ''', (table,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+    if table in USER_SUMMARY_SOURCES:
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_summary_{event}')
+    if table == 'sales':
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_sales_rollup_{event}')
+    if table in ('sales', 'orders'):
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_cogs_{event}')
+    if table in VERSIONED_TABLES:
+        for event in ('insert', 'update', 'delete'):
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_version_{event}')
+    return [sql for _, sql in indexes]
+
+def restore_indexes(conn, indexes):
+    """Recreates the dropped indexes/triggers, recomputes costs, summary and rollup tables and bumps every data version."""
+    with conn:
+        for statement in indexes:
+            conn.execute(statement)
+        create_cogs_tables(conn)
+        rebuild_cogs(conn)
+        create_summary_tables(conn)
+        rebuild(conn)
+        create_rollup_tables(conn)
+        rebuild_rollups(conn)
+        create_version_tables(conn)
+        bump_versions(conn)
+
+def _checkpoint_path(path, kind, user_id):
+    return f'{path}.{kind}.{user_id}.import-state.json'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import CSV/JSON/NDJSON into the inventory database.')
+    parser.add_argument('path')
+    parser.add_argument('--kind', required=True, choices=sorted(KINDS))
+    parser.add_argument('--user-id', required=True, type=int)
+    parser.add_argument('--format', choices=['csv', 'json', 'ndjson'])
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--resume', action='store_true', help='continue after the last committed chunk')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop secondary indexes and summary triggers during the load (offline use only)')
+    args = parser.parse_args(argv)
+
+    state_path = _checkpoint_path(args.path, args.kind, args.user_id)
+    skip = 0
+    if args.resume and os.path.exists(state_path):
+        with open(state_path) as f:
+            skip = json.load(f)['position']
+        print(f'Resuming after record {skip}.')
+
+    def checkpoint(position, imported, skipped):
+        with open(state_path, 'w') as f:
+            json.dump({'position': position, 'imported': imported, 'skipped': skipped}, f)
+
+    def progress(imported, skipped, rate):
+        print(f'\r{imported:,} imported, {skipped:,} skipped, {rate:,.0f} rows/s', end='', flush=True)
+
+    conn = sqlite3.connect(args.database)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -65536')
+
+    table = KINDS[args.kind][0]
+    if args.defer_indexes:
+        with conn:
+            deferred = defer_indexes(conn, table)
+    try:
+        importer = Importer(conn, args.user_id, args.kind, args.chunk_size, progress, checkpoint)
+        with open(args.path, newline='', encoding='utf-8-sig') as stream:
+            result = importer.run(iter_records(stream, args.format or detect_format(args.path)), skip)
+    finally:
+        if args.defer_indexes:
+            restore_indexes(conn, deferred)
+        conn.close()
+
+    print()
+    for error in result['errors']:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"Imported {result['imported']:,} {args.kind} ({result['skipped']:,} skipped) in {result['seconds']}s.")
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
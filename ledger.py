@@ -0,0 +1,37 @@
+"""
+Purchase-order ledger queries shared by the accounting and outstanding pages.
+
+Balances are summed over the integer *_satang columns and converted to baht
+only in the result, so a fully paid order is exactly zero outstanding.
+"""
+
+ORDER_BALANCES_SQL = '''
+    SELECT o.order_id, o.product_details, o.factory_sku, o.order_date,
+           o.quantity * o.cost_per_item_satang / 100.0 AS total_cost,
+           COALESCE(SUM(p.amount_satang), 0) / 100.0 AS paid_amount,
+           (o.quantity * o.cost_per_item_satang - COALESCE(SUM(p.amount_satang), 0)) / 100.0 AS outstanding,
+           o.quantity * o.cost_per_item_satang AS total_cost_satang,
+           COALESCE(SUM(p.amount_satang), 0) AS paid_satang
+    FROM orders o
+    LEFT JOIN payments p ON p.order_id = o.order_id AND p.user_id = o.user_id AND p.deleted_at IS NULL
+    WHERE o.deleted_at IS NULL AND o.user_id = ?
+    GROUP BY o.order_id
+'''
+
+def order_balances(conn, user_id, outstanding_only=False):
+    """
+    Returns one row per live order with total_cost, paid_amount and
+    outstanding, computed in a single LEFT JOIN ... GROUP BY pass.
+    Pass outstanding_only=True to keep only orders that still owe money.
+    """
+    sql = ORDER_BALANCES_SQL
+    if outstanding_only:
+        sql += ' HAVING total_cost_satang > paid_satang'
+    sql += ' ORDER BY o.order_date DESC, o.order_id DESC'
+    return conn.execute(sql, (user_id,)).fetchall()
+
+def ledger_totals(balances):
+    """Sums (total_cost, paid_amount, outstanding) over rows from order_balances()."""
+    total_cost = sum(row['total_cost_satang'] for row in balances)
+    paid_amount = sum(row['paid_satang'] for row in balances)
+    return total_cost / 100, paid_amount / 100, (total_cost - paid_amount) / 100
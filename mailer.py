@@ -0,0 +1,318 @@
+"""
+Durable outbox for outgoing email (OTP codes).
+
+Request handlers only INSERT a row into email_outbox and return. A
+MailDispatcher thread claims due rows in batches, sends them over one
+reused SMTP connection and retries failures with exponential backoff.
+
+The outbox lives in the auth database (AUTH_DATABASE_PATH) next to the OTP
+challenges, so queueing a code never writes to the inventory database and
+the codes are not copied into its replica or backups. A message body is
+cleared once the row is sent or has finally failed, and finished rows are
+deleted after MAIL_OUTBOX_RETENTION_SECONDS.
+
+The dispatcher can also run as its own process:
+
+    python mailer.py            # runs until interrupted
+    python mailer.py --once     # sends whatever is due and exits
+
+For local testing point MAIL_SERVER/MAIL_PORT at an SMTP stand-in, e.g.
+    python -m aiosmtpd -n -l localhost:8025
+    MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=false
+"""
+import multiprocessing
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+
+from otp_store import AUTH_DATABASE
+
+BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 20))
+MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 6))
+RETRY_BASE_SECONDS = float(os.environ.get('MAIL_RETRY_BASE_SECONDS', 5))
+RETRY_MAX_SECONDS = float(os.environ.get('MAIL_RETRY_MAX_SECONDS', 900))
+POLL_SECONDS = float(os.environ.get('MAIL_POLL_SECONDS', 5))
+# ปิด SMTP connection ที่ไม่ได้ใช้นานเกินไป (server ส่วนใหญ่ตัดเองหลังประมาณ 1-5 นาที)
+SMTP_IDLE_SECONDS = float(os.environ.get('MAIL_SMTP_IDLE_SECONDS', 30))
+# แถว 'sending' ที่ค้างนานกว่านี้ถือว่า worker ที่ claim ไว้ตายไปแล้ว
+CLAIM_TIMEOUT_SECONDS = 300
+# แถวที่ส่งแล้ว/ล้มเหลวถาวรเก็บไว้ดูสถานะได้นานเท่านี้ (ไม่มีเนื้อหาอีเมลแล้ว)
+OUTBOX_RETENTION_SECONDS = float(os.environ.get('MAIL_OUTBOX_RETENTION_SECONDS', 86400))
+OUTBOX_PURGE_SECONDS = 60
+
+OUTBOX_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        claimed_at REAL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        sent_at REAL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at)",
+]
+
+def create_outbox_table(c):
+    for statement in OUTBOX_SCHEMA:
+        c.execute(statement)
+
+_local = threading.local()
+
+def outbox_connection(database=AUTH_DATABASE):
+    """This thread's autocommit connection to the outbox database (one per thread, like otp_store)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.database != database:
+        conn = sqlite3.connect(database, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        create_outbox_table(conn)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.database = database
+    return conn
+
+def enqueue_email(recipient, subject, body):
+    """Stores one message in the outbox (committed) and wakes the dispatcher."""
+    now = time.time()
+    cursor = outbox_connection().execute(
+        'INSERT INTO email_outbox (recipient, subject, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+        (recipient, subject, body, now, now)
+    )
+    if _dispatcher is not None:
+        _dispatcher.wake()
+    return cursor.lastrowid
+
+def purge_outbox(conn, now=None):
+    """Deletes sent and finally failed rows older than OUTBOX_RETENTION_SECONDS. Returns the row count."""
+    cutoff = (now or time.time()) - OUTBOX_RETENTION_SECONDS
+    with conn:
+        return conn.execute("DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+                            (cutoff,)).rowcount
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+class MailDispatcher:
+    """
+    Sends outbox rows in the background for one process. `mail` is the
+    Flask-Mail extension; messages are built and sent inside `app`'s context.
+    """
+
+    def __init__(self, app, mail, database=AUTH_DATABASE, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+        self.app = app
+        self.mail = mail
+        self.database = database
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.pid = os.getpid()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        self._purged_at = 0.0
+
+        # Counters exposed through stats()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.smtp_connects = 0
+        self.purged = 0
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database, timeout=30)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA synchronous = NORMAL')
+            create_outbox_table(self._conn)
+        return self._conn
+
+    def claim(self):
+        """Atomically marks up to batch_size due rows as 'sending' and returns them."""
+        now = time.time()
+        conn = self._db()
+        with conn:
+            return conn.execute('''
+                UPDATE email_outbox SET status = 'sending', claimed_at = ?
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= ?)
+                       OR (status = 'sending' AND claimed_at < ?)
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING id, recipient, subject, body, attempts
+            ''', (now, now, now - CLAIM_TIMEOUT_SECONDS, self.batch_size)).fetchall()
+
+    def _connection(self):
+        if self._smtp is not None and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+            self._close_smtp()
+        if self._smtp is None:
+            self._smtp = self.mail.connect()
+            self._smtp.__enter__()
+            self.smtp_connects += 1
+        return self._smtp
+
+    def _close_smtp(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def run_once(self):
+        """Sends one batch of due messages. Returns the number of rows claimed."""
+        from flask_mail import Message
+
+        rows = self.claim()
+        if not rows:
+            return 0
+        self.batches += 1
+        done = []
+        retry = []
+        with self.app.app_context():
+            for row in rows:
+                try:
+                    smtp = self._connection()
+                    msg = Message(row['subject'], recipients=[row['recipient']], body=row['body'])
+                    smtp.send(msg)
+                    self._smtp_used_at = time.monotonic()
+                    done.append(row['id'])
+                except Exception as e:
+                    # connection อาจเสียไปแล้ว เปิดใหม่ในข้อความถัดไป
+                    print(f"ERROR: [mailer] - message {row['id']} to {row['recipient']}: {e}")
+                    self._close_smtp()
+                    retry.append((row, str(e)))
+
+        now = time.time()
+        conn = self._db()
+        with conn:
+            # เนื้อหามีรหัส OTP ไม่ต้องเก็บไว้หลังส่งแล้วหรือเลิกส่งแล้ว
+            conn.executemany("UPDATE email_outbox SET status = 'sent', body = '', sent_at = ?, claimed_at = NULL WHERE id = ?",
+                             [(now, message_id) for message_id in done])
+            for row, error in retry:
+                attempts = row['attempts'] + 1
+                status = 'failed' if attempts >= self.max_attempts else 'pending'
+                conn.execute('''
+                    UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_at = NULL,
+                        body = CASE WHEN ? = 'failed' THEN '' ELSE body END
+                    WHERE id = ?
+                ''', (status, attempts, now + retry_delay(attempts), error, status, row['id']))
+                if status == 'failed':
+                    self.failed += 1
+                else:
+                    self.retried += 1
+        self.sent += len(done)
+        return len(rows)
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self.run_once()
+            except sqlite3.Error as e:
+                print(f"ERROR: [mailer] - outbox: {e}")
+                claimed = 0
+            if claimed:
+                continue
+            if time.monotonic() - self._purged_at > OUTBOX_PURGE_SECONDS:
+                try:
+                    self.purged += purge_outbox(self._db())
+                except sqlite3.Error as e:
+                    print(f"ERROR: [mailer] - outbox purge: {e}")
+                self._purged_at = time.monotonic()
+            if self._smtp is not None and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+                self._close_smtp()
+            self._wakeup.wait(POLL_SECONDS)
+            self._wakeup.clear()
+        self._close_smtp()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='mail-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'batches': self.batches,
+            'smtp_connects': self.smtp_connects,
+            'purged': self.purged,
+        }
+
+def outbox_counts(conn):
+    return {row[0]: row[1] for row in conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status')}
+
+def pending_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM email_outbox WHERE status = 'pending'").fetchone()[0]
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def start_dispatcher(app, mail):
+    """
+    Starts this process's dispatcher thread (once per process, so it also
+    works after a gunicorn fork). Set MAIL_DISPATCHER=off when the
+    dispatcher runs as a separate `python mailer.py` process instead.
+    """
+    global _dispatcher
+    if os.environ.get('MAIL_DISPATCHER', 'thread') == 'off':
+        return None
+    if multiprocessing.parent_process() is not None:
+        return None  # process ลูกของ multiprocessing (เช่น password hashing pool) ไม่ต้องส่งเมล
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher.pid != os.getpid():
+            _dispatcher = MailDispatcher(app, mail).start()
+        return _dispatcher
+
+def get_dispatcher():
+    return _dispatcher
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Send queued emails from the outbox.')
+    parser.add_argument('--once', action='store_true', help='send everything that is due, then exit')
+    args = parser.parse_args()
+
+    os.environ['MAIL_DISPATCHER'] = 'off'
+    from app import app, mail
+
+    dispatcher = MailDispatcher(app, mail)
+    if args.once:
+        while dispatcher.run_once():
+            pass
+        dispatcher._close_smtp()
+        dispatcher.purged += purge_outbox(dispatcher._db())
+    else:
+        try:
+            dispatcher.run()
+        except KeyboardInterrupt:
+            dispatcher._close_smtp()
+    print(f"Outbox: {outbox_counts(dispatcher._db())}, this run: {dispatcher.stats()}")
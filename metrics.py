@@ -0,0 +1,293 @@
+"""
+Per-request timing, SQL statement counts and a Prometheus /metrics endpoint.
+
+Pooled connections are TracedConnection objects. While a request holds one,
+execute(), executemany(), executescript() and commit() are timed into that
+request's QueryStats. Outside a request (CLIs, background threads) the only
+cost is one attribute check. At the end of each request, the duration,
+statement count and SQL time go into per-endpoint histograms. Requests slower
+than SLOW_REQUEST_MS are printed with their statements grouped by SQL text,
+so an N+1 loop shows up as one statement run many times.
+
+cProfile is opt-in per request. Set PROFILE_TOKEN and send the same value in
+the X-Profile header. The profile is written to PROFILE_DIR, and its file
+name comes back in the X-Profile-Dump response header:
+
+    curl -H 'X-Profile: <token>' ... /accounting
+    python -m pstats profiles/<file>.prof
+
+With METRICS_RESPONSE_HEADERS=on, every response carries X-SQL-Statements
+and Server-Timing: sql;dur=<ms> (used by benchmarks/load_test.py).
+
+The figures are per worker process: each gunicorn worker answers /metrics
+with its own counters.
+"""
+import cProfile
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, g, request
+
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_LOG_STATEMENTS = int(os.environ.get('SLOW_LOG_STATEMENTS', 10))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# ถ้าตั้งไว้ /metrics ต้องส่ง Authorization: Bearer <token>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# ใส่จำนวน statement และเวลา SQL ของ request ลงใน response header (ใช้กับ benchmarks/load_test.py)
+RESPONSE_HEADERS = os.environ.get('METRICS_RESPONSE_HEADERS', 'off') == 'on'
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class QueryStats:
+    """Statements run by one request: SQL text -> [calls, seconds]."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def add(self, sql, seconds):
+        self.count += 1
+        self.seconds += seconds
+        entry = self.statements.get(sql)
+        if entry is None:
+            self.statements[sql] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def top(self, limit=SLOW_LOG_STATEMENTS):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [(' '.join(sql.split()), calls, seconds) for sql, (calls, seconds) in ranked[:limit]]
+
+
+def _timed(method):
+    def wrapper(self, sql, *args):
+        stats = self.query_stats
+        if stats is None:
+            return method(self, sql, *args)
+        started = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            stats.add(sql, time.perf_counter() - started)
+    return wrapper
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection that reports statement timings to `query_stats` when set.
+    The time is measured inside execute(), which covers the whole statement
+    for writes and aggregates. Rows fetched later count toward the request time.
+    """
+    query_stats = None
+
+    execute = _timed(sqlite3.Connection.execute)
+    executemany = _timed(sqlite3.Connection.executemany)
+    executescript = _timed(sqlite3.Connection.executescript)
+
+    def commit(self):
+        stats = self.query_stats
+        if stats is None or not self.in_transaction:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            stats.add('COMMIT', time.perf_counter() - started)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _same_secret(given, expected):
+    return hmac.compare_digest(given.encode(), expected.encode())
+
+
+class Histogram:
+    """Prometheus-style histogram keyed by a tuple of (label, value) pairs."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [count per bucket..., overflow, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self.series.get(labels)
+            if counts is None:
+                counts = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def lines(self):
+        with self._lock:
+            series = {labels: list(counts) for labels, counts in self.series.items()}
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts in sorted(series.items()):
+            yield from histogram_lines(self.name, labels, self.buckets, counts[:-1], counts[-1])
+
+
+def histogram_lines(name, labels, buckets, counts, total):
+    """Cumulative bucket/sum/count lines from per-bucket counts (last entry = above the largest bucket)."""
+    running = 0
+    for bound, count in zip(buckets, counts):
+        running += count
+        yield f'{name}_bucket{_label_text(labels + (("le", f"{bound:g}"),))} {running}'
+    running += counts[len(buckets)]
+    yield f'{name}_bucket{_label_text(labels + (("le", "+Inf"),))} {running}'
+    yield f'{name}_sum{_label_text(labels)} {total:.6f}'
+    yield f'{name}_count{_label_text(labels)} {running}'
+
+
+def stats_lines(prefix, stats):
+    """
+    Gauges for the numeric values of a stats() dict; nested dicts extend the
+    name. A dict with 'buckets_ms' (passwords.PasswordHasher.stats()) also
+    gets its per-operation latency histograms.
+    """
+    buckets_ms = stats.get('buckets_ms')
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            yield f'# TYPE {name} gauge'
+            yield f'{name} {value}'
+        elif isinstance(value, dict):
+            if buckets_ms and 'histogram' in value:
+                seconds_name = f'{name}_duration_seconds'
+                yield f'# TYPE {seconds_name} histogram'
+                total = value.get('avg_ms', 0.0) * value.get('count', 0) / 1000
+                yield from histogram_lines(seconds_name, (), [bound / 1000 for bound in buckets_ms],
+                                           value['histogram'], total)
+            else:
+                yield from stats_lines(name, value)
+
+
+class RequestMetrics:
+    """Request timing hooks for a Flask app plus the text for /metrics."""
+
+    def __init__(self, slow_ms=SLOW_REQUEST_MS):
+        self.slow_ms = slow_ms
+        self.duration = Histogram('http_request_duration_seconds', 'Time from before_request to teardown.', SECONDS_BUCKETS)
+        self.sql_time = Histogram('http_request_sql_seconds', 'Time spent in SQLite per request.', SECONDS_BUCKETS)
+        self.statements = Histogram('http_request_sql_statements', 'SQL statements run per request.', STATEMENT_BUCKETS)
+        self.responses = {}  # (endpoint, method, status) -> count
+        self.slow_requests = 0
+        self.profiles = 0
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._after)
+        app.teardown_request(self._finish)
+
+    def collect(self, prefix, func):
+        """Adds func() (a stats dict, or None to skip) to every /metrics response as `prefix_*` gauges."""
+        self.collectors.append((prefix, func))
+
+    def attach(self, conn):
+        """Times `conn`'s statements into the current request (call when a request takes a connection)."""
+        conn.query_stats = g.get('query_stats')
+
+    def detach(self, conn):
+        conn.query_stats = None
+
+    def _start(self):
+        g.query_stats = QueryStats()
+        g.request_started = time.perf_counter()
+        token = request.headers.get('X-Profile')
+        if PROFILE_TOKEN and token and _same_secret(token, PROFILE_TOKEN):
+            g.profile_file = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.endpoint or "unmatched"}-{os.getpid()}.prof'
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after(self, response):
+        g.response_status = response.status_code
+        stats = g.get('query_stats')
+        if RESPONSE_HEADERS and stats is not None:
+            response.headers['X-SQL-Statements'] = str(stats.count)
+            response.headers['Server-Timing'] = f'sql;dur={stats.seconds * 1000:.3f}'
+        if 'profile_file' in g:
+            response.headers['X-Profile-Dump'] = g.profile_file
+        return response
+
+    def _finish(self, exception):
+        started = g.pop('request_started', None)
+        stats = g.pop('query_stats', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, g.profile_file))
+
+        endpoint = request.endpoint or 'unmatched'
+        status = 500 if exception is not None else g.get('response_status', 500)
+        labels = (('endpoint', endpoint), ('method', request.method))
+        self.duration.observe(labels, elapsed)
+        self.sql_time.observe(labels, stats.seconds)
+        self.statements.observe(labels, stats.count)
+        key = (endpoint, request.method, status)
+        with self._lock:
+            self.responses[key] = self.responses.get(key, 0) + 1
+            if profiler is not None:
+                self.profiles += 1
+            slow = elapsed * 1000 >= self.slow_ms
+            if slow:
+                self.slow_requests += 1
+        if slow:
+            print(f'SLOW: [metrics] - {request.method} {request.path} ({endpoint}) {status} {elapsed * 1000:.1f} ms, '
+                  f'{stats.count} statements {stats.seconds * 1000:.1f} ms')
+            for sql, calls, seconds in stats.top():
+                print(f'    {calls:>5} x {seconds * 1000:9.1f} ms  {sql[:160]}')
+
+    def render(self):
+        lines = []
+        for histogram in (self.duration, self.sql_time, self.statements):
+            lines.extend(histogram.lines())
+        with self._lock:
+            responses = dict(self.responses)
+            slow_requests, profiles = self.slow_requests, self.profiles
+        lines.append('# HELP http_requests_total Finished requests by endpoint, method and status.')
+        lines.append('# TYPE http_requests_total counter')
+        for (endpoint, method, status), count in sorted(responses.items()):
+            lines.append(f'http_requests_total{_label_text((("endpoint", endpoint), ("method", method), ("status", status)))} {count}')
+        lines.append('# TYPE http_slow_requests_total counter')
+        lines.append(f'http_slow_requests_total {slow_requests}')
+        lines.append('# TYPE http_profiled_requests_total counter')
+        lines.append(f'http_profiled_requests_total {profiles}')
+        for prefix, func in self.collectors:
+            stats = func()
+            if stats:
+                lines.extend(stats_lines(prefix, stats))
+        return '\n'.join(lines) + '\n'
+
+    def response(self):
+        """The /metrics response (401 when METRICS_TOKEN is set and not presented)."""
+        if METRICS_TOKEN and not _same_secret(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,180 @@
+"""
+Versioned schema migrations tracked with PRAGMA user_version.
+
+Each file in migrations/ is named NNNN_description.py and defines
+upgrade(c), which receives a connection with a transaction already open.
+A migration and the user_version bump commit together, so a failed
+migration leaves the database at the previous version. When the schema is
+current, migrate() only reads the version number and takes no write lock.
+
+A migration carries the SQL it needs and never calls the create_* helpers
+of the app modules: those describe the current schema and change with it,
+while a released migration must keep doing exactly what it did. Schema
+changes ship as a new numbered file.
+
+    python migrate.py                 # apply pending migrations with timings
+    python migrate.py --status        # show current version and pending files
+    python migrate.py --dry-run       # run pending migrations, report timings, roll back
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sqlite3
+import sys
+import time
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+def discover(directory=MIGRATIONS_DIR):
+    """Returns [(version, name, path)] sorted by version."""
+    found = []
+    for filename in os.listdir(directory):
+        match = re.match(r'^(\d{4})_(\w+)\.py$', filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    found.sort()
+    versions = [version for version, _, _ in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f'Duplicate migration numbers in {directory}')
+    return found
+
+def _load(version, name, path):
+    spec = importlib.util.spec_from_file_location(f'migration_{version:04d}_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def pending(conn, migrations=None):
+    migrations = discover() if migrations is None else migrations
+    version = current_version(conn)
+    return [m for m in migrations if m[0] > version]
+
+def apply(conn, dry_run=False, report=None):
+    """
+    Applies every pending migration, one transaction each. Returns
+    [(version, name, seconds)]. With dry_run all of them run in a single
+    transaction that is rolled back at the end.
+    """
+    applied = []
+    if not dry_run and conn.execute('SELECT 1 FROM sqlite_master').fetchone() is None:
+        # ฐานข้อมูลใหม่: ต้องตั้งก่อนสร้างตารางแรกและนอก transaction
+        # (ฐานเดิมเปลี่ยนได้ด้วย python retention.py --enable-incremental-vacuum)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    if dry_run:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        for version, name, path in discover():
+            # BEGIN IMMEDIATE ก่อนอ่าน version: worker หลายตัวเริ่มพร้อมกันจะ migrate แค่ตัวเดียว
+            if not dry_run:
+                conn.execute('BEGIN IMMEDIATE')
+            if current_version(conn) >= version:
+                if not dry_run:
+                    conn.rollback()
+                continue
+            started = time.perf_counter()
+            _load(version, name, path).upgrade(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            elapsed = time.perf_counter() - started
+            if not dry_run:
+                conn.commit()
+            applied.append((version, name, elapsed))
+            if report:
+                report(version, name, elapsed)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+    return applied
+
+def migrate(database):
+    """Brings `database` up to the latest version. Cheap when nothing is pending."""
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        if pending(conn):
+            return apply(conn)
+        return []
+    finally:
+        conn.close()
+
+def rebuild_table(c, table, create_sql, select_columns=None):
+    """
+    Rebuilds `table` with a new definition (e.g. to change a column type),
+    following SQLite's create-copy-drop-rename procedure inside the caller's
+    transaction. `create_sql` is the new CREATE TABLE statement with {table}
+    where the table name goes; `select_columns` maps new column -> SQL
+    expression over the old table (default: same-named columns). Indexes and
+    triggers of the table are recreated afterwards. Readers keep seeing the
+    old table (WAL) until the migration commits.
+    """
+    new_table = f'{table}__rebuild'
+    dependents = c.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+    c.execute(f'DROP TABLE IF EXISTS {new_table}')
+    c.execute(create_sql.format(table=new_table))
+    new_columns = [row[1] for row in c.execute(f'PRAGMA table_info({new_table})')]
+    old_columns = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+    if select_columns is None:
+        select_columns = {column: column for column in new_columns if column in old_columns}
+    targets = ', '.join(select_columns)
+    sources = ', '.join(select_columns.values())
+    c.execute(f'INSERT INTO {new_table} ({targets}) SELECT {sources} FROM {table}')
+    c.execute(f'DROP TABLE {table}')
+    # legacy_alter_table: ไม่ต้องให้ SQLite ตรวจ trigger ของตารางอื่นที่อ้างถึงชื่อตารางนี้ตอน rename
+    c.execute('PRAGMA legacy_alter_table = ON')
+    try:
+        c.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+    finally:
+        c.execute('PRAGMA legacy_alter_table = OFF')
+    for (sql,) in dependents:
+        c.execute(sql)
+
+def delta_triggers(name, table, columns, delta):
+    """
+    CREATE TRIGGER statements for a table kept in sync by `delta`: SQL with
+    {row} (NEW/OLD) and {minus} ('' to add a row, '-' to take it away).
+    Inserts add NEW, deletes take away OLD, and updates of `columns` do both.
+    """
+    added = delta.format(row='NEW', minus='')
+    removed = delta.format(row='OLD', minus='-')
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_insert AFTER INSERT ON {table} BEGIN{added}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_update AFTER UPDATE OF {columns} ON {table} BEGIN{removed}{added}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_delete AFTER DELETE ON {table} BEGIN{removed}\nEND',
+    ]
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Apply schema migrations.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--status', action='store_true', help='show the current version and pending migrations')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='run the pending migrations, report their timings and roll everything back')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, timeout=30)
+    try:
+        waiting = pending(conn)
+        print(f'{args.database}: version {current_version(conn)}, {len(waiting)} pending')
+        if args.status:
+            for version, name, _ in waiting:
+                print(f'  {version:04d} {name}')
+            return 0
+
+        def report(version, name, elapsed):
+            print(f"  {version:04d} {name:<40} {elapsed * 1000:10.1f} ms{' (rolled back)' if args.dry_run else ''}")
+
+        started = time.perf_counter()
+        applied = apply(conn, dry_run=args.dry_run, report=report)
+        print(f'{len(applied)} migration(s) in {time.perf_counter() - started:.3f}s, now at version {current_version(conn)}.')
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
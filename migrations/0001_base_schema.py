@@ -0,0 +1,97 @@
+"""
+Base tables: users, products, orders, sales, payments.
+
+Safe on databases created before migrations existed: tables are created
+only if missing and older tables get the columns added later on
+(user_id on the inventory tables; email, is_verified, otp, otp_expiry on users).
+"""
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        is_verified BOOLEAN DEFAULT FALSE,
+        otp TEXT,
+        otp_expiry TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS products (
+        product_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        name TEXT NOT NULL,
+        sku TEXT NOT NULL,
+        factory_sku TEXT NOT NULL,
+        details TEXT,
+        stock INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT,
+        deleted_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        product_details TEXT NOT NULL,
+        factory_sku TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        cost_per_item REAL NOT NULL,
+        order_date TEXT NOT NULL,
+        updated_at TEXT,
+        deleted_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales (
+        sale_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER NOT NULL,
+        price_per_item REAL NOT NULL,
+        sale_date TEXT NOT NULL,
+        updated_at TEXT,
+        deleted_at TEXT,
+        FOREIGN KEY(product_id) REFERENCES products(product_id),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS payments (
+        payment_id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        order_id INTEGER,
+        amount REAL NOT NULL,
+        payment_date TEXT NOT NULL,
+        updated_at TEXT,
+        deleted_at TEXT,
+        FOREIGN KEY(order_id) REFERENCES orders(order_id),
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    ''',
+]
+
+# table -> [(column, definition)] ที่ฐานข้อมูลรุ่นเก่าอาจยังไม่มี
+# (SQLite เพิ่มคอลัมน์ UNIQUE ด้วย ALTER ไม่ได้ email จึงเพิ่มเป็น TEXT ธรรมดา)
+LATER_COLUMNS = {
+    'products': [('user_id', 'INTEGER REFERENCES users(id)')],
+    'orders': [('user_id', 'INTEGER REFERENCES users(id)')],
+    'sales': [('user_id', 'INTEGER REFERENCES users(id)')],
+    'payments': [('user_id', 'INTEGER REFERENCES users(id)')],
+    'users': [('email', 'TEXT'), ('is_verified', 'BOOLEAN DEFAULT FALSE'), ('otp', 'TEXT'), ('otp_expiry', 'TEXT')],
+}
+
+def upgrade(c):
+    for statement in TABLES:
+        c.execute(statement)
+    for table, columns in LATER_COLUMNS.items():
+        existing = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+        for column, definition in columns:
+            if column not in existing:
+                c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                print(f"Added '{column}' column to '{table}' table.")
@@ -0,0 +1,27 @@
+"""Composite/partial indexes for the per-user, not-deleted access pattern."""
+import sqlite3
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_products_user_deleted ON products(user_id, deleted_at)',
+    'CREATE INDEX IF NOT EXISTS idx_products_user_stock ON products(user_id, stock) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user_deleted ON orders(user_id, deleted_at)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders(user_id, order_date) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user_factory_sku ON orders(user_id, factory_sku) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_sales_user_deleted ON sales(user_id, deleted_at)',
+    'CREATE INDEX IF NOT EXISTS idx_sales_user_date ON sales(user_id, sale_date) WHERE deleted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS idx_sales_product ON sales(product_id)',
+    'CREATE INDEX IF NOT EXISTS idx_payments_user_deleted ON payments(user_id, deleted_at)',
+    'CREATE INDEX IF NOT EXISTS idx_payments_order ON payments(order_id)',
+]
+
+def upgrade(c):
+    for statement in INDEXES:
+        c.execute(statement)
+
+    # One product row per (user, sku, details) is what stock-in relies on.
+    try:
+        c.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_products_user_sku_details ON products(user_id, sku, details)')
+    except sqlite3.IntegrityError:
+        # ข้อมูลเก่ามี SKU/details ซ้ำกัน ใช้ index ธรรมดาแทนไปก่อน
+        print("WARNING: duplicate (user_id, sku, details) rows in 'products'; created a non-unique index instead.")
+        c.execute('CREATE INDEX IF NOT EXISTS idx_products_user_sku_details ON products(user_id, sku, details)')
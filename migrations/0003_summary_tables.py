@@ -0,0 +1,92 @@
+"""
+Materialized dashboard totals (REAL baht) and the triggers that maintain
+them. Filled from the base tables when the tables are first created.
+"""
+from migrate import delta_triggers
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        total_revenue REAL NOT NULL DEFAULT 0,
+        total_items_sold INTEGER NOT NULL DEFAULT 0,
+        total_order_costs REAL NOT NULL DEFAULT 0,
+        total_payments REAL NOT NULL DEFAULT 0,
+        total_stock INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS product_profit_summary (
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity_sold INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, product_id)
+    )
+    ''',
+]
+
+# table -> (columns that affect the totals, what one row adds or takes away)
+DELTAS = {
+    'sales': ('user_id, product_id, quantity, price_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_revenue, total_items_sold)
+        SELECT {row}.user_id, {minus}({row}.quantity * {row}.price_per_item), {minus}({row}.quantity) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_revenue = total_revenue + excluded.total_revenue, total_items_sold = total_items_sold + excluded.total_items_sold;
+        INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue)
+        SELECT {row}.user_id, {row}.product_id, {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item)
+        WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id, product_id) DO UPDATE SET
+            quantity_sold = quantity_sold + excluded.quantity_sold,
+            revenue = revenue + excluded.revenue;'''),
+    'orders': ('user_id, quantity, cost_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_order_costs)
+        SELECT {row}.user_id, {minus}({row}.quantity * {row}.cost_per_item) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_order_costs = total_order_costs + excluded.total_order_costs;'''),
+    'payments': ('user_id, amount, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_payments)
+        SELECT {row}.user_id, {minus}({row}.amount) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_payments = total_payments + excluded.total_payments;'''),
+    'products': ('user_id, stock, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_stock)
+        SELECT {row}.user_id, {minus}({row}.stock) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_stock = total_stock + excluded.total_stock;'''),
+}
+
+FILL = [
+    '''
+    INSERT INTO user_summary (user_id, total_revenue, total_items_sold, total_order_costs, total_payments, total_stock)
+    SELECT user_id, SUM(total_revenue), SUM(total_items_sold), SUM(total_order_costs), SUM(total_payments), SUM(total_stock)
+    FROM (
+        SELECT user_id, quantity * price_per_item AS total_revenue, quantity AS total_items_sold,
+               0 AS total_order_costs, 0 AS total_payments, 0 AS total_stock
+        FROM sales WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, quantity * cost_per_item, 0, 0 FROM orders WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, amount, 0 FROM payments WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, 0, stock FROM products WHERE deleted_at IS NULL
+    )
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue)
+    SELECT user_id, product_id, SUM(quantity), SUM(quantity * price_per_item)
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL
+    GROUP BY user_id, product_id
+    ''',
+]
+
+def upgrade(c):
+    # ฐานข้อมูลก่อนมี migration อาจมีตารางสรุปอยู่แล้ว (init_db เดิม) ให้คงค่าไว้
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_summary'").fetchone()
+    for statement in TABLES:
+        c.execute(statement)
+    for table, (columns, delta) in DELTAS.items():
+        for statement in delta_triggers('summary', table, columns, delta):
+            c.execute(statement)
+    if not exists:
+        for statement in FILL:
+            c.execute(statement)
@@ -0,0 +1,51 @@
+"""FTS5 index over products for the form pickers, filled from the live products."""
+import sqlite3
+
+SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        owner, name, sku, factory_sku, details,
+        tokenize = "unicode61 tokenchars '-_'"
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+    WHEN NEW.deleted_at IS NULL
+    BEGIN
+        INSERT INTO products_fts (rowid, owner, name, sku, factory_sku, details)
+        VALUES (NEW.product_id, 'u' || NEW.user_id, NEW.name, NEW.sku, NEW.factory_sku, NEW.details);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF user_id, name, sku, factory_sku, details, deleted_at ON products
+    BEGIN
+        DELETE FROM products_fts WHERE rowid = OLD.product_id;
+        INSERT INTO products_fts (rowid, owner, name, sku, factory_sku, details)
+        SELECT NEW.product_id, 'u' || NEW.user_id, NEW.name, NEW.sku, NEW.factory_sku, NEW.details
+        WHERE NEW.deleted_at IS NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+    BEGIN
+        DELETE FROM products_fts WHERE rowid = OLD.product_id;
+    END
+    ''',
+]
+
+def upgrade(c):
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+    try:
+        for statement in SCHEMA:
+            c.execute(statement)
+    except sqlite3.OperationalError as e:
+        if 'fts5' not in str(e):
+            raise
+        print('WARNING: SQLite has no FTS5 support; product search will use LIKE prefix matching.')
+        return
+    if not exists:
+        c.execute('''
+            INSERT INTO products_fts (rowid, owner, name, sku, factory_sku, details)
+            SELECT product_id, 'u' || user_id, name, sku, factory_sku, details
+            FROM products WHERE deleted_at IS NULL
+        ''')
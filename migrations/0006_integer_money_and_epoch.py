@@ -0,0 +1,164 @@
+"""
+Integer money and epoch timestamps on orders, sales and payments.
+
+Adds STORED generated columns next to the existing REAL/TEXT ones:
+    orders.cost_per_item_satang, orders.order_ts
+    sales.price_per_item_satang, sales.sale_ts
+    payments.amount_satang, payments.payment_ts
+SQLite can only add STORED columns by rebuilding the table. The REAL and
+TEXT columns stay the ones the app writes and the templates show; they
+feed the integer columns automatically. *_ts columns treat the stored
+wall-clock time as UTC, so date(ts, 'unixepoch') is the same calendar day.
+The summary tables switch to integer satang totals and are recomputed.
+"""
+from migrate import delta_triggers, rebuild_table
+
+def _satang(column):
+    return f'{column}_satang INTEGER GENERATED ALWAYS AS (CAST(round({column} * 100) AS INTEGER)) STORED'
+
+def _epoch(column, name):
+    return f"{name} INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', {column}) AS INTEGER)) STORED"
+
+TABLES = {
+    'orders': f'''
+        CREATE TABLE {{table}} (
+            order_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            product_details TEXT NOT NULL,
+            factory_sku TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            cost_per_item REAL NOT NULL,
+            order_date TEXT NOT NULL,
+            updated_at TEXT,
+            deleted_at TEXT,
+            {_satang('cost_per_item')},
+            {_epoch('order_date', 'order_ts')},
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''',
+    'sales': f'''
+        CREATE TABLE {{table}} (
+            sale_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER NOT NULL,
+            price_per_item REAL NOT NULL,
+            sale_date TEXT NOT NULL,
+            updated_at TEXT,
+            deleted_at TEXT,
+            {_satang('price_per_item')},
+            {_epoch('sale_date', 'sale_ts')},
+            FOREIGN KEY(product_id) REFERENCES products(product_id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''',
+    'payments': f'''
+        CREATE TABLE {{table}} (
+            payment_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            order_id INTEGER,
+            amount REAL NOT NULL,
+            payment_date TEXT NOT NULL,
+            updated_at TEXT,
+            deleted_at TEXT,
+            {_satang('amount')},
+            {_epoch('payment_date', 'payment_ts')},
+            FOREIGN KEY(order_id) REFERENCES orders(order_id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''',
+}
+
+SUMMARY_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        total_revenue_satang INTEGER NOT NULL DEFAULT 0,
+        total_items_sold INTEGER NOT NULL DEFAULT 0,
+        total_order_costs_satang INTEGER NOT NULL DEFAULT 0,
+        total_payments_satang INTEGER NOT NULL DEFAULT 0,
+        total_stock INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS product_profit_summary (
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity_sold INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, product_id)
+    )
+    ''',
+]
+
+# table -> (columns that affect the totals, what one row adds or takes away)
+SUMMARY_DELTAS = {
+    'sales': ('user_id, product_id, quantity, price_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_revenue_satang, total_items_sold)
+        SELECT {row}.user_id, {minus}({row}.quantity * CAST(round({row}.price_per_item * 100) AS INTEGER)), {minus}({row}.quantity) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_revenue_satang = total_revenue_satang + excluded.total_revenue_satang, total_items_sold = total_items_sold + excluded.total_items_sold;
+        INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang)
+        SELECT {row}.user_id, {row}.product_id, {minus}{row}.quantity, {minus}({row}.quantity * CAST(round({row}.price_per_item * 100) AS INTEGER))
+        WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id, product_id) DO UPDATE SET
+            quantity_sold = quantity_sold + excluded.quantity_sold,
+            revenue_satang = revenue_satang + excluded.revenue_satang;'''),
+    'orders': ('user_id, quantity, cost_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_order_costs_satang)
+        SELECT {row}.user_id, {minus}({row}.quantity * CAST(round({row}.cost_per_item * 100) AS INTEGER)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_order_costs_satang = total_order_costs_satang + excluded.total_order_costs_satang;'''),
+    'payments': ('user_id, amount, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_payments_satang)
+        SELECT {row}.user_id, {minus}(CAST(round({row}.amount * 100) AS INTEGER)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_payments_satang = total_payments_satang + excluded.total_payments_satang;'''),
+    'products': ('user_id, stock, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_stock)
+        SELECT {row}.user_id, {minus}({row}.stock) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_stock = total_stock + excluded.total_stock;'''),
+}
+
+SUMMARY_FILL = [
+    '''
+    INSERT INTO user_summary (user_id, total_revenue_satang, total_items_sold, total_order_costs_satang, total_payments_satang, total_stock)
+    SELECT user_id, SUM(total_revenue_satang), SUM(total_items_sold), SUM(total_order_costs_satang), SUM(total_payments_satang),
+           SUM(total_stock)
+    FROM (
+        SELECT user_id, quantity * CAST(round(price_per_item * 100) AS INTEGER) AS total_revenue_satang, quantity AS total_items_sold,
+               0 AS total_order_costs_satang, 0 AS total_payments_satang, 0 AS total_stock
+        FROM sales WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, quantity * CAST(round(cost_per_item * 100) AS INTEGER), 0, 0 FROM orders WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, CAST(round(amount * 100) AS INTEGER), 0 FROM payments WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, 0, stock FROM products WHERE deleted_at IS NULL
+    )
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang)
+    SELECT user_id, product_id, SUM(quantity), SUM(quantity * CAST(round(price_per_item * 100) AS INTEGER))
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL
+    GROUP BY user_id, product_id
+    ''',
+]
+
+def upgrade(c):
+    for table, create_sql in TABLES.items():
+        rebuild_table(c, table, create_sql)
+
+    # ตารางสรุปเปลี่ยนคอลัมน์เงินเป็นสตางค์: สร้างใหม่ทั้งหมดแล้วคำนวณจากข้อมูลจริง
+    for table in ('sales', 'orders', 'payments', 'products'):
+        for event in ('insert', 'update', 'delete'):
+            c.execute(f'DROP TRIGGER IF EXISTS trg_{table}_summary_{event}')
+    c.execute('DROP TABLE IF EXISTS user_summary')
+    c.execute('DROP TABLE IF EXISTS product_profit_summary')
+    for statement in SUMMARY_TABLES:
+        c.execute(statement)
+    for table, (columns, delta) in SUMMARY_DELTAS.items():
+        for statement in delta_triggers('summary', table, columns, delta):
+            c.execute(statement)
+    for statement in SUMMARY_FILL:
+        c.execute(statement)
@@ -0,0 +1,79 @@
+"""
+Daily/monthly sales rollup tables, their triggers and the compaction
+watermark. Filled from sales when the tables are first created.
+"""
+from migrate import delta_triggers
+
+TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, product_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+        user_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, product_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        compacted_before INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO rollup_state (id, compacted_before) VALUES (1, 0)',
+]
+
+COLUMNS = 'user_id, product_id, quantity, price_per_item, sale_date, deleted_at'
+
+DELTA = '''
+        INSERT INTO sales_rollup_daily (user_id, day, product_id, quantity, revenue_satang, sales_count)
+        SELECT {row}.user_id, {row}.sale_ts / 86400, COALESCE({row}.product_id, 0), {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}1
+        WHERE {row}.deleted_at IS NULL AND {row}.user_id IS NOT NULL AND {row}.sale_ts IS NOT NULL AND {row}.sale_ts / 86400 >= (SELECT compacted_before FROM rollup_state WHERE id = 1)
+        ON CONFLICT(user_id, day, product_id) DO UPDATE SET quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count;
+        INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count)
+        SELECT {row}.user_id, strftime('%Y-%m', {row}.sale_ts, 'unixepoch'), COALESCE({row}.product_id, 0), {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}1
+        WHERE {row}.deleted_at IS NULL AND {row}.user_id IS NOT NULL AND {row}.sale_ts IS NOT NULL AND {row}.sale_ts / 86400 < (SELECT compacted_before FROM rollup_state WHERE id = 1)
+        ON CONFLICT(user_id, month, product_id) DO UPDATE SET quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count;'''
+
+FILL = [
+    '''
+    INSERT INTO sales_rollup_daily (user_id, day, product_id, quantity, revenue_satang, sales_count)
+    SELECT user_id, sale_ts / 86400 AS day, COALESCE(product_id, 0), SUM(quantity), SUM(quantity * price_per_item_satang), COUNT(*)
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL
+          AND sale_ts / 86400 >= (SELECT compacted_before FROM rollup_state WHERE id = 1)
+    GROUP BY user_id, day, COALESCE(product_id, 0)
+    ''',
+    '''
+    INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count)
+    SELECT user_id, strftime('%Y-%m', sale_ts, 'unixepoch') AS month, COALESCE(product_id, 0),
+           SUM(quantity), SUM(quantity * price_per_item_satang), COUNT(*)
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL
+          AND sale_ts / 86400 < (SELECT compacted_before FROM rollup_state WHERE id = 1)
+    GROUP BY user_id, month, COALESCE(product_id, 0)
+    ''',
+]
+
+def upgrade(c):
+    for statement in TABLES + delta_triggers('rollup', 'sales', COLUMNS, DELTA):
+        c.execute(statement)
+    for statement in FILL:
+        c.execute(statement)
@@ -0,0 +1,276 @@
+"""
+Cost-of-goods engine (cogs.py): cogs_state, cogs_layers, cogs_pending and
+their triggers, sales.cost_satang, an index on products(user_id, factory_sku)
+and cost columns on the summary and rollup tables. Every SKU is queued for a
+replay in cogs_pending; init_db() applies the queue after migrating (or run
+python cogs.py refresh), which writes the existing sales' costs.
+"""
+from migrate import delta_triggers
+
+COGS_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_state (
+        user_id INTEGER NOT NULL,
+        factory_sku TEXT NOT NULL,
+        on_hand INTEGER NOT NULL DEFAULT 0,
+        average_cost REAL NOT NULL DEFAULT 0,
+        last_cost_satang INTEGER NOT NULL DEFAULT 0,
+        unit_cost_satang INTEGER NOT NULL DEFAULT 0,
+        frontier_ts INTEGER NOT NULL DEFAULT 0,
+        frontier_rank INTEGER NOT NULL DEFAULT 0,
+        frontier_id INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, factory_sku)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_layers (
+        user_id INTEGER NOT NULL,
+        factory_sku TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        remaining INTEGER NOT NULL,
+        unit_cost_satang INTEGER NOT NULL,
+        PRIMARY KEY (user_id, factory_sku, ts, order_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cogs_pending (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        factory_sku TEXT,
+        kind TEXT NOT NULL,
+        ref_id INTEGER,
+        ts INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_cogs_pending_user ON cogs_pending(user_id)',
+]
+
+COGS_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT NEW.user_id, NEW.factory_sku, 'order', NEW.order_id, NEW.order_ts WHERE NEW.deleted_at IS NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_update AFTER UPDATE OF user_id, factory_sku, quantity, cost_per_item, order_date, deleted_at ON orders BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, OLD.factory_sku, 'replay', NULL, NULL;
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT NEW.user_id, NEW.factory_sku, 'replay', NULL, NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_delete AFTER DELETE ON orders BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, OLD.factory_sku, 'replay', NULL, NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_insert AFTER INSERT ON sales BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT NEW.user_id, (SELECT factory_sku FROM products WHERE product_id = NEW.product_id), 'sale', NEW.sale_id, NEW.sale_ts WHERE NEW.deleted_at IS NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_update AFTER UPDATE OF user_id, product_id, quantity, sale_date, deleted_at ON sales BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, (SELECT factory_sku FROM products WHERE product_id = OLD.product_id), 'replay', NULL, NULL;
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT NEW.user_id, (SELECT factory_sku FROM products WHERE product_id = NEW.product_id), 'replay', NULL, NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_delete AFTER DELETE ON sales BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, (SELECT factory_sku FROM products WHERE product_id = OLD.product_id), 'replay', NULL, NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_products_cogs_update AFTER UPDATE OF user_id, factory_sku ON products BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, OLD.factory_sku, 'replay', NULL, NULL;
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT NEW.user_id, NEW.factory_sku, 'replay', NULL, NULL;
+    END
+    ''',
+]
+
+SUMMARY_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        total_revenue_satang INTEGER NOT NULL DEFAULT 0,
+        total_items_sold INTEGER NOT NULL DEFAULT 0,
+        total_order_costs_satang INTEGER NOT NULL DEFAULT 0,
+        total_payments_satang INTEGER NOT NULL DEFAULT 0,
+        total_stock INTEGER NOT NULL DEFAULT 0,
+        total_cogs_satang INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS product_profit_summary (
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity_sold INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, product_id)
+    )
+    ''',
+]
+
+# table -> (columns that affect the totals, what one row adds or takes away)
+SUMMARY_DELTAS = {
+    'sales': ('user_id, product_id, quantity, price_per_item, deleted_at, cost_satang', '''
+        INSERT INTO user_summary (user_id, total_revenue_satang, total_items_sold, total_cogs_satang)
+        SELECT {row}.user_id, {minus}({row}.quantity * CAST(round({row}.price_per_item * 100) AS INTEGER)), {minus}({row}.quantity), {minus}(COALESCE({row}.cost_satang, 0)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_revenue_satang = total_revenue_satang + excluded.total_revenue_satang, total_items_sold = total_items_sold + excluded.total_items_sold, total_cogs_satang = total_cogs_satang + excluded.total_cogs_satang;
+        INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang, cost_satang)
+        SELECT {row}.user_id, {row}.product_id, {minus}{row}.quantity, {minus}({row}.quantity * CAST(round({row}.price_per_item * 100) AS INTEGER)),
+               {minus}COALESCE({row}.cost_satang, 0)
+        WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id, product_id) DO UPDATE SET
+            quantity_sold = quantity_sold + excluded.quantity_sold,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            cost_satang = cost_satang + excluded.cost_satang;'''),
+    'orders': ('user_id, quantity, cost_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_order_costs_satang)
+        SELECT {row}.user_id, {minus}({row}.quantity * CAST(round({row}.cost_per_item * 100) AS INTEGER)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_order_costs_satang = total_order_costs_satang + excluded.total_order_costs_satang;'''),
+    'payments': ('user_id, amount, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_payments_satang)
+        SELECT {row}.user_id, {minus}(CAST(round({row}.amount * 100) AS INTEGER)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_payments_satang = total_payments_satang + excluded.total_payments_satang;'''),
+    'products': ('user_id, stock, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_stock)
+        SELECT {row}.user_id, {minus}({row}.stock) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_stock = total_stock + excluded.total_stock;'''),
+}
+
+ROLLUP_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, product_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+        user_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, product_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+ROLLUP_COLUMNS = 'user_id, product_id, quantity, price_per_item, sale_date, deleted_at, cost_satang'
+
+ROLLUP_DELTA = '''
+        INSERT INTO sales_rollup_daily (user_id, day, product_id, quantity, revenue_satang, sales_count, cost_satang)
+        SELECT {row}.user_id, {row}.sale_ts / 86400, COALESCE({row}.product_id, 0), {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}1, {minus}COALESCE({row}.cost_satang, 0)
+        WHERE {row}.deleted_at IS NULL AND {row}.user_id IS NOT NULL AND {row}.sale_ts IS NOT NULL AND {row}.sale_ts / 86400 >= (SELECT compacted_before FROM rollup_state WHERE id = 1)
+        ON CONFLICT(user_id, day, product_id) DO UPDATE SET quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count,
+            cost_satang = cost_satang + excluded.cost_satang;
+        INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count, cost_satang)
+        SELECT {row}.user_id, strftime('%Y-%m', {row}.sale_ts, 'unixepoch'), COALESCE({row}.product_id, 0), {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}1, {minus}COALESCE({row}.cost_satang, 0)
+        WHERE {row}.deleted_at IS NULL AND {row}.user_id IS NOT NULL AND {row}.sale_ts IS NOT NULL AND {row}.sale_ts / 86400 < (SELECT compacted_before FROM rollup_state WHERE id = 1)
+        ON CONFLICT(user_id, month, product_id) DO UPDATE SET quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count,
+            cost_satang = cost_satang + excluded.cost_satang;'''
+
+# ต้นทุนยังว่างทุกแถวตอนนี้ (cost_satang เป็น NULL) ค่าต้นทุนเข้าตารางผ่าน trigger เมื่อ replay เขียน sales.cost_satang
+FILL = [
+    '''
+    INSERT INTO user_summary (user_id, total_revenue_satang, total_items_sold, total_order_costs_satang, total_payments_satang, total_stock)
+    SELECT user_id, SUM(total_revenue_satang), SUM(total_items_sold), SUM(total_order_costs_satang), SUM(total_payments_satang),
+           SUM(total_stock)
+    FROM (
+        SELECT user_id, quantity * CAST(round(price_per_item * 100) AS INTEGER) AS total_revenue_satang, quantity AS total_items_sold,
+               0 AS total_order_costs_satang, 0 AS total_payments_satang, 0 AS total_stock
+        FROM sales WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, quantity * CAST(round(cost_per_item * 100) AS INTEGER), 0, 0 FROM orders WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, CAST(round(amount * 100) AS INTEGER), 0 FROM payments WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, 0, stock FROM products WHERE deleted_at IS NULL
+    )
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ''',
+    '''
+    INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang)
+    SELECT user_id, product_id, SUM(quantity), SUM(quantity * CAST(round(price_per_item * 100) AS INTEGER))
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL
+    GROUP BY user_id, product_id
+    ''',
+    '''
+    INSERT INTO sales_rollup_daily (user_id, day, product_id, quantity, revenue_satang, sales_count)
+    SELECT user_id, sale_ts / 86400 AS day, COALESCE(product_id, 0), SUM(quantity), SUM(quantity * price_per_item_satang), COUNT(*)
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL
+          AND sale_ts / 86400 >= (SELECT compacted_before FROM rollup_state WHERE id = 1)
+    GROUP BY user_id, day, COALESCE(product_id, 0)
+    ''',
+    '''
+    INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count)
+    SELECT user_id, strftime('%Y-%m', sale_ts, 'unixepoch') AS month, COALESCE(product_id, 0),
+           SUM(quantity), SUM(quantity * price_per_item_satang), COUNT(*)
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL
+          AND sale_ts / 86400 < (SELECT compacted_before FROM rollup_state WHERE id = 1)
+    GROUP BY user_id, month, COALESCE(product_id, 0)
+    ''',
+    # replay ทุก SKU ที่มีใบสั่งซื้อหรือสินค้า (เหมือน cogs.all_skus())
+    '''
+    INSERT INTO cogs_pending (user_id, factory_sku, kind)
+    SELECT user_id, factory_sku, 'replay' FROM orders WHERE deleted_at IS NULL AND user_id IS NOT NULL
+    UNION
+    SELECT user_id, factory_sku, 'replay' FROM products WHERE user_id IS NOT NULL
+    ''',
+]
+
+def upgrade(c):
+    # ฐานข้อมูลที่สร้างระหว่างที่ 0001/0006 ประกาศ cost_satang ไว้เองจะมีคอลัมน์นี้อยู่แล้ว
+    existing = {row[1] for row in c.execute('PRAGMA table_info(sales)')}
+    if 'cost_satang' not in existing:
+        c.execute('ALTER TABLE sales ADD COLUMN cost_satang INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_products_user_factory_sku ON products(user_id, factory_sku)')
+    for statement in COGS_TABLES + COGS_TRIGGERS:
+        c.execute(statement)
+
+    # ตารางสรุปและ rollup มีคอลัมน์ต้นทุนเพิ่ม: สร้างใหม่ (rollup_state/watermark เก็บไว้เหมือนเดิม)
+    for table in ('sales', 'orders', 'payments', 'products'):
+        for event in ('insert', 'update', 'delete'):
+            c.execute(f'DROP TRIGGER IF EXISTS trg_{table}_summary_{event}')
+    for event in ('insert', 'update', 'delete'):
+        c.execute(f'DROP TRIGGER IF EXISTS trg_sales_rollup_{event}')
+    for table in ('user_summary', 'product_profit_summary', 'sales_rollup_daily', 'sales_rollup_monthly'):
+        c.execute(f'DROP TABLE IF EXISTS {table}')
+    for statement in SUMMARY_TABLES + ROLLUP_TABLES:
+        c.execute(statement)
+    for table, (columns, delta) in SUMMARY_DELTAS.items():
+        for statement in delta_triggers('summary', table, columns, delta):
+            c.execute(statement)
+    for statement in delta_triggers('rollup', 'sales', ROLLUP_COLUMNS, ROLLUP_DELTA):
+        c.execute(statement)
+    for statement in FILL:
+        c.execute(statement)
@@ -0,0 +1,46 @@
+"""
+Trash retention (retention.py): partial indexes on deleted_at for the
+purge's range scans and the retention_runs log. The cost-of-goods delete
+triggers are recreated so purging already soft-deleted rows queues nothing.
+"""
+
+SCHEMA = [
+    'CREATE INDEX IF NOT EXISTS idx_sales_trash ON sales(deleted_at) WHERE deleted_at IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_orders_trash ON orders(deleted_at) WHERE deleted_at IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_products_trash ON products(deleted_at) WHERE deleted_at IS NOT NULL',
+    '''
+    CREATE TABLE IF NOT EXISTS retention_runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        seconds REAL NOT NULL,
+        rows_archived INTEGER NOT NULL,
+        rows_purged INTEGER NOT NULL,
+        pages_freed INTEGER NOT NULL,
+        bytes_reclaimed INTEGER NOT NULL,
+        tables TEXT NOT NULL
+    )
+    ''',
+]
+
+COGS_DELETE_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_orders_cogs_delete AFTER DELETE ON orders WHEN OLD.deleted_at IS NULL BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, OLD.factory_sku, 'replay', NULL, NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_sales_cogs_delete AFTER DELETE ON sales WHEN OLD.deleted_at IS NULL BEGIN
+        INSERT INTO cogs_pending (user_id, factory_sku, kind, ref_id, ts)
+        SELECT OLD.user_id, (SELECT factory_sku FROM products WHERE product_id = OLD.product_id), 'replay', NULL, NULL;
+    END
+    ''',
+]
+
+def upgrade(c):
+    for statement in SCHEMA:
+        c.execute(statement)
+    c.execute('DROP TRIGGER IF EXISTS trg_orders_cogs_delete')
+    c.execute('DROP TRIGGER IF EXISTS trg_sales_cogs_delete')
+    for statement in COGS_DELETE_TRIGGERS:
+        c.execute(statement)
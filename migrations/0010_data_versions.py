@@ -0,0 +1,23 @@
+"""
+Per-user data version counters (versions.py) behind the ETags and the
+response cache of the read-heavy JSON endpoints. Users start at version 0.
+"""
+
+BUMP = '''
+        INSERT INTO data_versions (user_id, version) VALUES ({user}, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;'''
+
+def upgrade(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    for table in ('products', 'orders', 'sales', 'payments'):
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table} '
+                  f"WHEN NEW.user_id IS NOT NULL BEGIN{BUMP.format(user='NEW.user_id')}\nEND")
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update AFTER UPDATE ON {table} '
+                  f"WHEN NEW.user_id IS NOT NULL BEGIN{BUMP.format(user='NEW.user_id')}\nEND")
+        c.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table} '
+                  f"WHEN OLD.user_id IS NOT NULL BEGIN{BUMP.format(user='OLD.user_id')}\nEND")
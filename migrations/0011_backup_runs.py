@@ -0,0 +1,18 @@
+"""
+Online backups (backup.py): the backup_runs log that /metrics reads the
+last run from.
+"""
+
+def upgrade(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            id INTEGER PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            path TEXT NOT NULL,
+            ok INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            bytes INTEGER NOT NULL,
+            compressed_bytes INTEGER NOT NULL,
+            details TEXT NOT NULL
+        )
+    ''')
@@ -0,0 +1,38 @@
+"""
+The summary triggers read the generated *_satang columns (0006) instead of
+converting the REAL columns themselves. Both give the same integer, so the
+stored totals stay as they are.
+"""
+from migrate import delta_triggers
+
+# table -> (columns that affect the totals, what one row adds or takes away)
+DELTAS = {
+    'sales': ('user_id, product_id, quantity, price_per_item, deleted_at, cost_satang', '''
+        INSERT INTO user_summary (user_id, total_revenue_satang, total_items_sold, total_cogs_satang)
+        SELECT {row}.user_id, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}({row}.quantity), {minus}(COALESCE({row}.cost_satang, 0)) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_revenue_satang = total_revenue_satang + excluded.total_revenue_satang, total_items_sold = total_items_sold + excluded.total_items_sold, total_cogs_satang = total_cogs_satang + excluded.total_cogs_satang;
+        INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang, cost_satang)
+        SELECT {row}.user_id, {row}.product_id, {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang),
+               {minus}COALESCE({row}.cost_satang, 0)
+        WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id, product_id) DO UPDATE SET
+            quantity_sold = quantity_sold + excluded.quantity_sold,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            cost_satang = cost_satang + excluded.cost_satang;'''),
+    'orders': ('user_id, quantity, cost_per_item, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_order_costs_satang)
+        SELECT {row}.user_id, {minus}({row}.quantity * {row}.cost_per_item_satang) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_order_costs_satang = total_order_costs_satang + excluded.total_order_costs_satang;'''),
+    'payments': ('user_id, amount, deleted_at', '''
+        INSERT INTO user_summary (user_id, total_payments_satang)
+        SELECT {row}.user_id, {minus}({row}.amount_satang) WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET total_payments_satang = total_payments_satang + excluded.total_payments_satang;'''),
+}
+
+def upgrade(c):
+    # ตาราง products ไม่มีคอลัมน์เงิน trigger ของมันเหมือนเดิม
+    for table, (columns, delta) in DELTAS.items():
+        for event in ('insert', 'update', 'delete'):
+            c.execute(f'DROP TRIGGER IF EXISTS trg_{table}_summary_{event}')
+        for statement in delta_triggers('summary', table, columns, delta):
+            c.execute(statement)
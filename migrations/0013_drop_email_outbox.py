@@ -0,0 +1,9 @@
+"""
+The email outbox moved to the auth database (see mailer.py). The old table
+here still holds the plaintext OTP body of every login, so it is dropped
+rather than copied; a code still pending in it would have expired anyway.
+"""
+
+def upgrade(c):
+    c.execute('DROP INDEX IF EXISTS idx_email_outbox_due')
+    c.execute('DROP TABLE IF EXISTS email_outbox')
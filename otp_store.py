@@ -0,0 +1,213 @@
+"""
+Expiring store for OTP challenges (registration and login 2FA).
+
+Codes live outside the users table with an integer epoch expiry, so issuing
+and checking a code never takes the inventory database's write lock. Two
+backends share one interface:
+
+    SQLiteBackend  separate database file (AUTH_DATABASE_PATH), shared by all workers
+    MemoryBackend  per-process dict, only for a single worker or tests
+
+A sweeper thread deletes expired challenges and finished rate-limit windows.
+"""
+import hmac
+import os
+import random
+import sqlite3
+import string
+import threading
+import time
+
+OTP_BACKEND = os.environ.get('OTP_BACKEND', 'sqlite')
+AUTH_DATABASE = os.environ.get('AUTH_DATABASE_PATH', 'auth.db')
+OTP_TTL_SECONDS = int(os.environ.get('OTP_TTL_SECONDS', 600))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+# จำนวนรหัสที่ขอได้ต่ออีเมลในหนึ่งช่วงเวลา
+OTP_RATE_LIMIT = int(os.environ.get('OTP_RATE_LIMIT', 5))
+OTP_RATE_WINDOW_SECONDS = int(os.environ.get('OTP_RATE_WINDOW_SECONDS', 900))
+OTP_SWEEP_SECONDS = float(os.environ.get('OTP_SWEEP_SECONDS', 60))
+
+
+class RateLimited(Exception):
+    """Raised when an email asked for too many codes within the rate-limit window."""
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._challenges = {}  # key -> [code, expires_at, attempts, user_id]
+        self._windows = {}     # key -> [window_ends_at, hits]
+        self._lock = threading.Lock()
+
+    def put(self, key, code, expires_at, user_id):
+        with self._lock:
+            self._challenges[key] = [code, expires_at, 0, user_id]
+
+    def take(self, key, code, now):
+        """Removes and returns (user_id,) if the code matches and is unexpired, else None."""
+        with self._lock:
+            entry = self._challenges.get(key)
+            if entry and entry[1] > now and hmac.compare_digest(entry[0].encode(), code.encode()):
+                del self._challenges[key]
+                return (entry[3],)
+            return None
+
+    def fail(self, key, max_attempts):
+        with self._lock:
+            entry = self._challenges.get(key)
+            if entry is None:
+                return
+            entry[2] += 1
+            if entry[2] >= max_attempts:
+                del self._challenges[key]
+
+    def hit(self, key, now, window):
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] <= now:
+                entry = self._windows[key] = [now + window, 0]
+            entry[1] += 1
+            return entry[1]
+
+    def sweep(self, now):
+        with self._lock:
+            expired = [key for key, entry in self._challenges.items() if entry[1] <= now]
+            for key in expired:
+                del self._challenges[key]
+            for key in [key for key, entry in self._windows.items() if entry[0] <= now]:
+                del self._windows[key]
+            return len(expired)
+
+
+class SQLiteBackend:
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS otp_challenges (
+            key TEXT PRIMARY KEY,
+            code TEXT NOT NULL,
+            expires_at INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_otp_challenges_expires ON otp_challenges(expires_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS otp_rate (
+            key TEXT PRIMARY KEY,
+            window_ends_at INTEGER NOT NULL,
+            hits INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]
+
+    def __init__(self, database=AUTH_DATABASE):
+        self.database = database
+        self._local = threading.local()
+        with self._conn() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _conn(self):
+        # หนึ่ง connection ต่อ thread (request threads + sweeper) ใช้ autocommit ทุกคำสั่ง
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.database, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def put(self, key, code, expires_at, user_id):
+        self._conn().execute('INSERT OR REPLACE INTO otp_challenges (key, code, expires_at, attempts, user_id) VALUES (?, ?, ?, 0, ?)',
+                             (key, code, expires_at, user_id))
+
+    def take(self, key, code, now):
+        # ลบแบบ atomic: ส่งรหัสเดียวกันพร้อมกันสองครั้งจะผ่านได้แค่ครั้งเดียว
+        return self._conn().execute('DELETE FROM otp_challenges WHERE key = ? AND code = ? AND expires_at > ? RETURNING user_id',
+                                    (key, code, now)).fetchone()
+
+    def fail(self, key, max_attempts):
+        conn = self._conn()
+        conn.execute('UPDATE otp_challenges SET attempts = attempts + 1 WHERE key = ?', (key,))
+        conn.execute('DELETE FROM otp_challenges WHERE key = ? AND attempts >= ?', (key, max_attempts))
+
+    def hit(self, key, now, window):
+        return self._conn().execute('''
+            INSERT INTO otp_rate (key, window_ends_at, hits) VALUES (?, ?, 1)
+            ON CONFLICT(key) DO UPDATE SET
+                hits = CASE WHEN window_ends_at <= ? THEN 1 ELSE hits + 1 END,
+                window_ends_at = CASE WHEN window_ends_at <= ? THEN excluded.window_ends_at ELSE window_ends_at END
+            RETURNING hits
+        ''', (key, now + window, now, now)).fetchone()[0]
+
+    def sweep(self, now):
+        conn = self._conn()
+        removed = conn.execute('DELETE FROM otp_challenges WHERE expires_at <= ?', (now,)).rowcount
+        conn.execute('DELETE FROM otp_rate WHERE window_ends_at <= ?', (now,))
+        return removed
+
+
+class OTPStore:
+    """Issues and checks one-time codes, keyed by purpose ('register', 'login') and email."""
+
+    def __init__(self, backend, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS,
+                 rate_limit=OTP_RATE_LIMIT, rate_window=OTP_RATE_WINDOW_SECONDS, length=6):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.length = length
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+        self.swept = 0
+
+    def issue(self, purpose, email, user_id=None):
+        """Returns a new code for (purpose, email), replacing any earlier one."""
+        now = int(time.time())
+        if self.backend.hit(f'rate:{email.lower()}', now, self.rate_window) > self.rate_limit:
+            raise RateLimited(f'Too many codes requested for {email}')
+        code = ''.join(random.SystemRandom().choices(string.digits, k=self.length))
+        self.backend.put(f'{purpose}:{email.lower()}', code, now + self.ttl, user_id)
+        self.start_sweeper()
+        return code
+
+    def verify(self, purpose, email, code):
+        """
+        Consumes the code if it is correct and unexpired. Returns (True, user_id)
+        on success, (False, None) otherwise; too many wrong codes discard it.
+        """
+        key = f'{purpose}:{email.lower()}'
+        row = self.backend.take(key, (code or '').strip(), int(time.time()))
+        if row is None:
+            self.backend.fail(key, self.max_attempts)
+            return False, None
+        return True, row[0]
+
+    def sweep(self):
+        removed = self.backend.sweep(int(time.time()))
+        self.swept += removed
+        return removed
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                print(f"ERROR: [otp_store] - sweep: {e}")
+
+    def start_sweeper(self, interval=OTP_SWEEP_SECONDS):
+        """Starts the background sweeper once per process (again after a fork)."""
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_forever, args=(interval,), name='otp-sweeper', daemon=True).start()
+
+def create_store(backend=OTP_BACKEND):
+    if backend == 'memory':
+        return OTPStore(MemoryBackend())
+    if backend == 'sqlite':
+        return OTPStore(SQLiteBackend())
+    raise ValueError(f'Unknown OTP_BACKEND: {backend}')
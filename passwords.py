@@ -0,0 +1,162 @@
+"""
+Password hashing service.
+
+Hashing and verification run in a small process pool (or inline when
+PASSWORD_WORKERS=0) behind a concurrency limit, so a burst of logins cannot
+occupy every web worker's CPU. New hashes use PASSWORD_SCHEME (bcrypt by
+default); stored hashes of another scheme or a lower cost still verify and
+are reported for rehashing after a successful login.
+
+Supported formats:
+    bcrypt   $2b$<rounds>$...                   (needs the bcrypt package)
+    pbkdf2   pbkdf2:sha256:<iterations>$salt$hash  (werkzeug format)
+    scrypt   scrypt:<n>:<r>:<p>$salt$hash          (werkzeug format, verify only)
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+try:
+    import bcrypt
+except ImportError:  # bcrypt อยู่ใน requirements.txt แต่ยังใช้ pbkdf2 ได้ถ้าไม่ได้ติดตั้ง
+    bcrypt = None
+
+PASSWORD_SCHEME = os.environ.get('PASSWORD_SCHEME', 'bcrypt' if bcrypt else 'pbkdf2')
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 11))
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', 600000))
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+PASSWORD_MAX_CONCURRENT = int(os.environ.get('PASSWORD_MAX_CONCURRENT', 4))
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_QUEUE_TIMEOUT', 10))
+
+# ขอบบนของแต่ละช่องใน histogram (มิลลิวินาที) ช่องสุดท้ายคือ "มากกว่านั้น"
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class HasherBusy(Exception):
+    """Raised when no hashing slot becomes free within PASSWORD_QUEUE_TIMEOUT."""
+
+
+def identify(stored):
+    """Returns (scheme, cost) of a stored hash, or (None, None) if unknown."""
+    if not stored:
+        return None, None
+    if stored.startswith(('$2a$', '$2b$', '$2y$')):
+        return 'bcrypt', int(stored.split('$')[2])
+    method = stored.split('$', 1)[0]
+    if method.startswith('pbkdf2:'):
+        parts = method.split(':')
+        return 'pbkdf2', int(parts[2]) if len(parts) > 2 else 0
+    if method.startswith('scrypt'):
+        return 'scrypt', None
+    return None, None
+
+# --- งานที่รันใน process pool (ต้องเป็นฟังก์ชันระดับ module เพื่อให้ pickle ได้) ---
+
+def _hash(password, scheme, cost):
+    if scheme == 'bcrypt':
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(cost)).decode('ascii')
+    if scheme == 'pbkdf2':
+        return generate_password_hash(password, method=f'pbkdf2:sha256:{cost}')
+    raise ValueError(f'Unsupported password scheme: {scheme}')
+
+def _verify(stored, password):
+    scheme, _ = identify(stored)
+    if scheme == 'bcrypt':
+        if bcrypt is None:
+            raise RuntimeError('bcrypt hash found but the bcrypt package is not installed')
+        return bcrypt.checkpw(password.encode('utf-8'), stored.encode('ascii'))
+    if scheme in ('pbkdf2', 'scrypt'):
+        return check_password_hash(stored, password)
+    return False
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords off the request thread with bounded concurrency."""
+
+    def __init__(self, scheme=PASSWORD_SCHEME, bcrypt_rounds=BCRYPT_ROUNDS, pbkdf2_iterations=PBKDF2_ITERATIONS,
+                 workers=PASSWORD_WORKERS, max_concurrent=PASSWORD_MAX_CONCURRENT, timeout=PASSWORD_QUEUE_TIMEOUT):
+        if scheme == 'bcrypt' and bcrypt is None:
+            raise RuntimeError('PASSWORD_SCHEME=bcrypt needs the bcrypt package')
+        if scheme not in ('bcrypt', 'pbkdf2'):
+            raise ValueError(f'Unsupported password scheme: {scheme}')
+        self.scheme = scheme
+        self.costs = {'bcrypt': bcrypt_rounds, 'pbkdf2': pbkdf2_iterations}
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.rejected = 0
+        # operation -> [count per bucket..., overflow]
+        self.histogram = {op: [0] * (len(LATENCY_BUCKETS_MS) + 1) for op in ('hash', 'verify')}
+        self.totals = {op: 0.0 for op in ('hash', 'verify')}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # spawn: ไม่ fork process ที่มี thread อื่นทำงานอยู่ (เช่น mail dispatcher)
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, op, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy(f'No password hashing slot free after {self.timeout}s')
+        started = time.perf_counter()
+        try:
+            if self.workers > 0:
+                return self._pool().submit(func, *args).result()
+            return func(*args)
+        finally:
+            self._slots.release()
+            self._observe(op, (time.perf_counter() - started) * 1000)
+
+    def _observe(self, op, elapsed_ms):
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.histogram[op][index] += 1
+            self.totals[op] += elapsed_ms
+
+    def hash(self, password):
+        return self._run('hash', _hash, password, self.scheme, self.costs[self.scheme])
+
+    def needs_rehash(self, stored):
+        scheme, cost = identify(stored)
+        return scheme != self.scheme or cost is None or cost < self.costs[scheme]
+
+    def verify(self, stored, password):
+        """
+        Returns (ok, new_hash). new_hash is set when the password was correct
+        but stored uses an old scheme/cost; the caller should save it.
+        """
+        ok = self._run('verify', _verify, stored, password)
+        if ok and self.needs_rehash(stored):
+            return True, self.hash(password)
+        return ok, None
+
+    def stats(self):
+        with self._lock:
+            stats = {'scheme': self.scheme, 'cost': self.costs[self.scheme], 'rejected': self.rejected,
+                     'buckets_ms': list(LATENCY_BUCKETS_MS)}
+            for op, counts in self.histogram.items():
+                count = sum(counts)
+                stats[op] = {'count': count, 'histogram': list(counts),
+                             'avg_ms': self.totals[op] / count if count else 0.0}
+            return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
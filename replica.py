@@ -0,0 +1,257 @@
+"""
+Read routing for the reporting routes (dashboard, accounting, data
+management, performance data and reports). Writes always go to the primary
+connection, get_db_connection() in app.py. REPORT_READS picks where the
+reporting reads go:
+
+- primary: the request's own connection, as before.
+- snapshot (default): a separate pool of query_only connections to the same
+  file. A request reads the whole page from one WAL snapshot (one read
+  transaction), and long reports cannot take the connections that writes
+  need.
+- replica: a copy of the database made with the sqlite3 backup() API and
+  refreshed every REPLICA_REFRESH_SECONDS. Reports never open the primary
+  file, so they do not compete with writers for its page cache or hold back
+  its WAL checkpoints. Data is at most REPLICA_MAX_STALENESS seconds old:
+  while the replica is older than that (or missing), reads use the snapshot
+  pool instead.
+
+A new copy is written next to the replica and renamed over it. Open replica
+connections keep reading the old file, and the pool reopens them when
+they are next checked out. Every worker runs a refresher thread, and a
+lock file ensures only one of them copies at a time. With gevent workers,
+backup() would block the worker while it copies. Run the refresher as its
+own process and set REPLICA_REFRESHER=off:
+
+    python replica.py            # one refresh
+    python replica.py --loop     # refresh every REPLICA_REFRESH_SECONDS
+"""
+import argparse
+import fcntl
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from database import BUSY_TIMEOUT_MS, CACHE_SIZE_KB, DATABASE, MMAP_SIZE, POOL_SIZE, ConnectionPool, CooperativeConnection
+from metrics import TracedConnection
+
+REPORT_READS = os.environ.get('REPORT_READS', 'snapshot')
+REPORT_POOL_SIZE = int(os.environ.get('REPORT_POOL_SIZE', POOL_SIZE))
+REPLICA_PATH = os.environ.get('REPLICA_PATH', os.path.splitext(DATABASE)[0] + '-replica.db')
+REPLICA_MAX_STALENESS = float(os.environ.get('REPLICA_MAX_STALENESS', 60))
+REPLICA_REFRESH_SECONDS = float(os.environ.get('REPLICA_REFRESH_SECONDS', REPLICA_MAX_STALENESS / 2))
+# 'thread' = refresher thread ในทุก worker, 'off' = รัน python replica.py --loop แยกเอง
+REPLICA_REFRESHER = os.environ.get('REPLICA_REFRESHER', 'thread')
+
+READ_MODES = ('primary', 'snapshot', 'replica')
+
+
+class SnapshotPool(ConnectionPool):
+    """Read-only connections to the primary file, each checked out inside a read transaction."""
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def acquire(self):
+        conn = super().acquire()
+        # snapshot เริ่มที่ SELECT แรก และจบเมื่อ release() rollback
+        conn.execute('BEGIN')
+        return conn
+
+
+def _file_id(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+class ReplicaPool(ConnectionPool):
+    """Read-only connections to the replica file, reopened after each refresh."""
+
+    def _connect(self):
+        file_id = _file_id(self.database)
+        # connection class เดียวกับ ConnectionPool: release() ใต้ gevent อ่าน busy_retries
+        busy_timeout_ms = 0 if self.cooperative else BUSY_TIMEOUT_MS
+        conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True, timeout=busy_timeout_ms / 1000,
+                               check_same_thread=False,
+                               factory=CooperativeConnection if self.cooperative else TracedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.file_id = file_id
+        return conn
+
+    def acquire(self):
+        conn = super().acquire()
+        if conn.file_id == _file_id(self.database):
+            return conn
+        conn.close()
+        try:
+            conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+
+def replica_age(path=REPLICA_PATH):
+    """Seconds since the replica's snapshot was taken, or None when there is no replica."""
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+def refresh_replica(database=DATABASE, replica=REPLICA_PATH, min_age=0):
+    """
+    Copies the database into `replica` and returns the seconds it took.
+    Returns None when another process is refreshing, or when the replica is
+    younger than min_age by the time the lock is held.
+    """
+    with open(f'{replica}.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        age = replica_age(replica)
+        if age is not None and age < min_age:
+            return None
+        started = time.time()
+        temporary = f'{replica}.{os.getpid()}.tmp'
+        try:
+            source = sqlite3.connect(database)
+            copy = sqlite3.connect(temporary)
+            try:
+                # ขั้นเดียวจบ = read transaction เดียวบน WAL ผู้เขียนไม่ต้องรอ และไม่ต้องเริ่มใหม่เมื่อมีการเขียนระหว่างทาง
+                source.backup(copy)
+                copy.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                copy.close()
+                source.close()
+            # mtime = เวลาที่ถ่าย snapshot ใช้วัดความเก่าได้จากทุก process
+            os.utime(temporary, (started, started))
+            os.replace(temporary, replica)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return time.time() - started
+
+
+class ReportReader:
+    """Hands out reporting connections according to REPORT_READS (per process)."""
+
+    def __init__(self, mode=REPORT_READS, database=DATABASE, replica=REPLICA_PATH, size=REPORT_POOL_SIZE,
+                 max_staleness=REPLICA_MAX_STALENESS, refresh_seconds=REPLICA_REFRESH_SECONDS):
+        if mode not in READ_MODES:
+            raise ValueError(f'Unknown REPORT_READS: {mode}')
+        self.mode = mode
+        self.database = database
+        self.replica = replica
+        self.size = size
+        self.max_staleness = max_staleness
+        self.refresh_seconds = refresh_seconds
+        self.pid = None
+        self._snapshot = self._replica = None
+        self._lock = threading.Lock()
+        self.fallbacks = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh_seconds = 0.0
+
+    def _pools(self):
+        with self._lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self._snapshot = SnapshotPool(self.database, self.size)
+                self._replica = ReplicaPool(self.replica, self.size) if self.mode == 'replica' else None
+                if self._replica is not None and REPLICA_REFRESHER == 'thread':
+                    threading.Thread(target=self._refresh_forever, name='replica-refresher', daemon=True).start()
+            return self._snapshot, self._replica
+
+    def acquire(self):
+        """A read-only connection; give it back with release()."""
+        snapshot, replica = self._pools()
+        if replica is not None:
+            age = replica_age(self.replica)
+            if age is not None and age <= self.max_staleness:
+                conn = replica.acquire()
+                conn.report_pool = replica
+                return conn
+            with self._lock:
+                self.fallbacks += 1
+        conn = snapshot.acquire()
+        conn.report_pool = snapshot
+        return conn
+
+    def release(self, conn):
+        conn.report_pool.release(conn)
+
+    def refresh(self):
+        """Refreshes the replica unless it is already younger than refresh_seconds."""
+        try:
+            took = refresh_replica(self.database, self.replica, min_age=self.refresh_seconds)
+        except (sqlite3.Error, OSError) as e:
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"ERROR: [replica] - refresh: {e}")
+            return None
+        if took is not None:
+            with self._lock:
+                self.refreshes += 1
+                self.last_refresh_seconds = took
+        return took
+
+    def _refresh_forever(self):
+        while True:
+            self.refresh()
+            age = replica_age(self.replica) or 0.0
+            time.sleep(max(1.0, self.refresh_seconds - age))
+
+    def stats(self):
+        if self.mode == 'primary' or self.pid != os.getpid():
+            return None
+        stats = {
+            'snapshot_pool': self._snapshot.stats(),
+            'fallbacks': self.fallbacks,
+        }
+        if self._replica is not None:
+            age = replica_age(self.replica)
+            stats.update({
+                'replica_pool': self._replica.stats(),
+                'replica_age_seconds': age if age is not None else -1,
+                'replica_max_staleness_seconds': self.max_staleness,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'last_refresh_seconds': self.last_refresh_seconds,
+            })
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Refresh the reporting replica with the backup API.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--replica', default=REPLICA_PATH)
+    parser.add_argument('--loop', action='store_true', help=f'refresh every REPLICA_REFRESH_SECONDS ({REPLICA_REFRESH_SECONDS:g}s)')
+    args = parser.parse_args(argv)
+
+    while True:
+        took = refresh_replica(args.database, args.replica, min_age=REPLICA_REFRESH_SECONDS if args.loop else 0)
+        if took is None:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} replica is fresh or being refreshed by another process")
+        else:
+            size = os.path.getsize(args.replica)
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {args.replica} refreshed: {size / 1048576:.1f} MB in {took:.2f}s")
+        if not args.loop:
+            break
+        time.sleep(max(1.0, REPLICA_REFRESH_SECONDS - (replica_age(args.replica) or 0.0)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
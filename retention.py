@@ -0,0 +1,280 @@
+"""
+Retention job for soft-deleted rows (the trash bin).
+
+Rows whose deleted_at is older than the table's retention period are copied
+into the archive database (ARCHIVE_DATABASE_PATH, attached as `archive`)
+and then deleted from the hot table, a bounded batch per transaction so
+the web workers are never locked out for long. Afterwards freed pages are
+returned to the file system with PRAGMA incremental_vacuum.
+
+A batch is archived and deleted in two transactions: with WAL a commit that
+spans two database files is not atomic across them, so the copy commits
+first (INSERT OR REPLACE, safe to repeat) and the delete re-checks
+deleted_at, so a row restored in between stays where it is.
+
+Rows that live rows still point at are kept: products with sales, and orders
+with live payments.
+
+    python retention.py                     # one run with the configured retention
+    python retention.py --dry-run           # count what would be purged
+    python retention.py --loop              # run every RETENTION_INTERVAL_SECONDS
+    python retention.py --enable-incremental-vacuum   # one-time VACUUM of an older database
+
+Retention per table: RETENTION_DAYS (default 30) or RETENTION_DAYS_<TABLE>,
+e.g. RETENTION_DAYS_SALES=90.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+ARCHIVE_DATABASE = os.environ.get('ARCHIVE_DATABASE_PATH', 'archive.db')
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 30))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+# หยุดพักระหว่าง batch ให้ request ที่รอ write lock ได้ทำงาน
+RETENTION_PAUSE_SECONDS = float(os.environ.get('RETENTION_PAUSE_SECONDS', 0.05))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', 86400))
+VACUUM_STEP_PAGES = int(os.environ.get('RETENTION_VACUUM_STEP_PAGES', 1000))
+
+# table -> (primary key, extra condition a purgeable row must meet).
+# sales ก่อน products: สินค้าที่ขายไปแล้วลบได้เมื่อรายการขายของมันถูกลบไปก่อน
+RETENTION_TABLES = {
+    'sales': ('sale_id', ''),
+    'orders': ('order_id', 'AND NOT EXISTS (SELECT 1 FROM payments pay WHERE pay.order_id = t.order_id AND pay.deleted_at IS NULL)'),
+    'products': ('product_id', 'AND NOT EXISTS (SELECT 1 FROM sales s WHERE s.product_id = t.product_id)'),
+}
+
+RETENTION_SCHEMA = [
+    f'CREATE INDEX IF NOT EXISTS idx_{table}_trash ON {table}(deleted_at) WHERE deleted_at IS NOT NULL'
+    for table in RETENTION_TABLES
+] + [
+    '''
+    CREATE TABLE IF NOT EXISTS retention_runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        seconds REAL NOT NULL,
+        rows_archived INTEGER NOT NULL,
+        rows_purged INTEGER NOT NULL,
+        pages_freed INTEGER NOT NULL,
+        bytes_reclaimed INTEGER NOT NULL,
+        tables TEXT NOT NULL
+    )
+    ''',
+]
+
+def create_retention_tables(c):
+    for statement in RETENTION_SCHEMA:
+        c.execute(statement)
+
+def retention_days(table):
+    return int(os.environ.get(f'RETENTION_DAYS_{table.upper()}', RETENTION_DAYS))
+
+def cutoff_for(table, now=None):
+    """deleted_at values older than this string are expired (same format soft_delete() writes)."""
+    now = now or datetime.now()
+    return (now - timedelta(days=retention_days(table))).strftime('%Y-%m-%d %H:%M:%S')
+
+def attach_archive(conn, path=ARCHIVE_DATABASE):
+    if not any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        conn.execute('PRAGMA archive.journal_mode = WAL')
+
+def ensure_archive_table(conn, table):
+    """
+    Creates archive.<table> with the hot table's columns (generated columns
+    become plain ones) plus archived_at, and adds columns added since.
+    """
+    key = RETENTION_TABLES[table][0]
+    columns = [(row[1], row[2]) for row in conn.execute(f'PRAGMA main.table_xinfo({table})') if row[6] in (0, 2, 3)]
+    existing = {row[1] for row in conn.execute(f'PRAGMA archive.table_info({table})')}
+    if not existing:
+        definitions = ', '.join(f'{name} {kind}' for name, kind in columns)
+        conn.execute(f'CREATE TABLE archive.{table} ({definitions}, archived_at TEXT NOT NULL, PRIMARY KEY ({key}))')
+    else:
+        for name, kind in columns:
+            if name not in existing:
+                conn.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {kind}')
+    return [name for name, _ in columns]
+
+def _expired_ids(conn, table, cutoff, limit):
+    key, condition = RETENTION_TABLES[table]
+    return [row[0] for row in conn.execute(f'''
+        SELECT t.{key} FROM {table} t
+        WHERE t.deleted_at IS NOT NULL AND t.deleted_at < ? {condition}
+        ORDER BY t.deleted_at
+        LIMIT ?
+    ''', (cutoff, limit))]
+
+def count_expired(conn, table, cutoff):
+    key, condition = RETENTION_TABLES[table]
+    return conn.execute(f'SELECT COUNT(*) FROM {table} t WHERE t.deleted_at IS NOT NULL AND t.deleted_at < ? {condition}',
+                        (cutoff,)).fetchone()[0]
+
+def purge_table(conn, table, cutoff, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_PAUSE_SECONDS, archive=True):
+    """Archives and deletes expired rows of one table in batches. Returns (archived, purged)."""
+    key, condition = RETENTION_TABLES[table]
+    columns = ', '.join(ensure_archive_table(conn, table)) if archive else None
+    archived = purged = 0
+    while True:
+        ids = _expired_ids(conn, table, cutoff, batch_size)
+        if not ids:
+            break
+        placeholders = ', '.join('?' * len(ids))
+        if archive:
+            with conn:
+                archived += conn.execute(f'''
+                    INSERT OR REPLACE INTO archive.{table} ({columns}, archived_at)
+                    SELECT {columns}, datetime('now') FROM main.{table} WHERE {key} IN ({placeholders})
+                ''', ids).rowcount
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            deleted = conn.execute(f'''
+                DELETE FROM main.{table} AS t
+                WHERE t.{key} IN ({placeholders}) AND t.deleted_at IS NOT NULL AND t.deleted_at < ? {condition}
+            ''', ids + [cutoff]).rowcount
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        purged += deleted
+        if not deleted:
+            break  # ทุกแถวใน batch ถูกกู้คืนไปแล้วระหว่างทาง อย่าวนซ้ำที่เดิม
+        if pause:
+            time.sleep(pause)
+    return archived, purged
+
+def _pages(conn):
+    return conn.execute('PRAGMA main.page_count').fetchone()[0], conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+
+def incremental_vacuum(conn, step=VACUUM_STEP_PAGES):
+    """Returns free pages to the OS a step at a time. Returns pages released (0 if auto_vacuum is not INCREMENTAL)."""
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        return 0
+    released = 0
+    while True:
+        free = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+        if not free:
+            break
+        conn.execute(f'PRAGMA main.incremental_vacuum({min(step, free)})').fetchall()
+        after = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+        if after >= free:
+            break
+        released += free - after
+    conn.execute('PRAGMA main.wal_checkpoint(PASSIVE)')
+    return released
+
+def run(conn, tables=None, now=None, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_PAUSE_SECONDS,
+        archive_path=ARCHIVE_DATABASE, dry_run=False):
+    """
+    One retention pass over `tables` (default: all). Returns a metrics dict:
+    per-table rows archived/purged plus pages and bytes reclaimed. The run
+    is also logged to retention_runs.
+    """
+    started = time.perf_counter()
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    page_size = conn.execute('PRAGMA main.page_size').fetchone()[0]
+    page_count, free_before = _pages(conn)
+    metrics = {'tables': {}, 'dry_run': dry_run}
+    if archive_path and not dry_run:
+        attach_archive(conn, archive_path)
+    for table in tables or RETENTION_TABLES:
+        cutoff = cutoff_for(table, now)
+        if dry_run:
+            metrics['tables'][table] = {'cutoff': cutoff, 'expired': count_expired(conn, table, cutoff)}
+            continue
+        table_started = time.perf_counter()
+        archived, purged = purge_table(conn, table, cutoff, batch_size, pause, archive=bool(archive_path))
+        metrics['tables'][table] = {'cutoff': cutoff, 'archived': archived, 'purged': purged,
+                                    'seconds': round(time.perf_counter() - table_started, 3)}
+    if dry_run:
+        return metrics
+
+    _, free_after_purge = _pages(conn)
+    released = incremental_vacuum(conn)
+    page_count_after, free_after = _pages(conn)
+    metrics.update({
+        'pages_freed': max(free_after_purge - free_before, 0),
+        'pages_released': released,
+        'bytes_reclaimed': (page_count - page_count_after) * page_size,
+        'bytes_free_in_file': free_after * page_size,
+        'auto_vacuum': conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] == 2,
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    with conn:
+        conn.execute('''
+            INSERT INTO retention_runs (started_at, seconds, rows_archived, rows_purged, pages_freed, bytes_reclaimed, tables)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (started_at, metrics['seconds'], sum(t['archived'] for t in metrics['tables'].values()),
+              sum(t['purged'] for t in metrics['tables'].values()), metrics['pages_freed'], metrics['bytes_reclaimed'],
+              json.dumps(metrics['tables'])))
+    return metrics
+
+def last_run(conn):
+    """The most recent run from retention_runs (None before the first one), for status pages and metrics."""
+    row = conn.execute('''
+        SELECT started_at, seconds, rows_archived, rows_purged, pages_freed, bytes_reclaimed, tables
+        FROM retention_runs ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+    if row is None:
+        return None
+    keys = ['started_at', 'seconds', 'rows_archived', 'rows_purged', 'pages_freed', 'bytes_reclaimed']
+    result = dict(zip(keys, row[:6]))
+    result['tables'] = json.loads(row[6])
+    return result
+
+def enable_incremental_vacuum(conn):
+    """Switches an existing database to auto_vacuum=INCREMENTAL (needs a full VACUUM; run offline)."""
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+def _print_metrics(metrics):
+    for table, figures in metrics['tables'].items():
+        if metrics['dry_run']:
+            print(f"  {table:<10} {figures['expired']:>10,} expired (deleted before {figures['cutoff']})")
+        else:
+            print(f"  {table:<10} {figures['purged']:>10,} purged, {figures['archived']:,} archived "
+                  f"(deleted before {figures['cutoff']}) in {figures['seconds']}s")
+    if not metrics['dry_run']:
+        print(f"  pages freed {metrics['pages_freed']:,}, released to the OS {metrics['pages_released']:,}, "
+              f"{metrics['bytes_reclaimed'] / 1048576:.2f} MiB reclaimed in {metrics['seconds']}s")
+        if not metrics['auto_vacuum']:
+            print('  auto_vacuum is not INCREMENTAL: freed pages stay in the file for reuse '
+                  '(run with --enable-incremental-vacuum once to change that)')
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Archive and purge expired soft-deleted rows.')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--archive', default=ARCHIVE_DATABASE, help="archive database path ('' to purge without archiving)")
+    parser.add_argument('--table', action='append', choices=sorted(RETENTION_TABLES), help='only these tables (repeatable)')
+    parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='only count the expired rows')
+    parser.add_argument('--loop', action='store_true', help=f'repeat every RETENTION_INTERVAL_SECONDS ({RETENTION_INTERVAL_SECONDS:g}s)')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='switch the database to auto_vacuum=INCREMENTAL with a full VACUUM, then exit')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, timeout=30)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    if args.enable_incremental_vacuum:
+        print(f"auto_vacuum INCREMENTAL: {enable_incremental_vacuum(conn)}")
+        return 0
+    create_retention_tables(conn)
+    conn.commit()
+    while True:
+        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} retention run on {args.database}{' (dry run)' if args.dry_run else ''}")
+        _print_metrics(run(conn, args.table, batch_size=args.batch_size, archive_path=args.archive, dry_run=args.dry_run))
+        if not args.loop:
+            break
+        time.sleep(RETENTION_INTERVAL_SECONDS)
+    conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
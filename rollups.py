@@ -0,0 +1,314 @@
+"""
+Time-bucketed sales rollups for historical reporting.
+
+sales_rollup_daily holds quantity, revenue, cost of goods sold (satang)
+and sale count per (user, day, product); days are counted from the epoch (sale_ts / 86400).
+Triggers on sales keep it current on every write path, including late
+edits of old sales and soft delete/restore. The compaction job folds whole
+months older than ROLLUP_KEEP_DAYS into sales_rollup_monthly and moves the
+rollup_state watermark; from then on the triggers apply changes to those
+months directly to the monthly rows.
+
+sales_report() answers any date range from the rollups: daily rows after
+the watermark, monthly rows for compacted months fully inside the range,
+and the raw sales rows for the rest (partial compacted months, or day/week
+buckets inside compacted history).
+
+    python rollups.py compact [--keep-days N]
+    python rollups.py rebuild
+    python rollups.py verify
+"""
+import argparse
+import os
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+ROLLUP_KEEP_DAYS = int(os.environ.get('ROLLUP_KEEP_DAYS', 400))
+EPOCH = date(1970, 1, 1)
+
+ROLLUP_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, product_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+        user_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        sales_count INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, product_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        compacted_before INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO rollup_state (id, compacted_before) VALUES (1, 0)',
+]
+
+WATERMARK = '(SELECT compacted_before FROM rollup_state WHERE id = 1)'
+ROLLUP_MEASURES = 'quantity, revenue_satang, sales_count, cost_satang'
+ADD_EXCLUDED = '''quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count,
+            cost_satang = cost_satang + excluded.cost_satang'''
+
+def _delta(row, sign):
+    """UPSERTs that add (sign=1) or remove (sign=-1) one sales row's contribution."""
+    minus = '-' if sign < 0 else ''
+    live = f'{row}.deleted_at IS NULL AND {row}.user_id IS NOT NULL AND {row}.sale_ts IS NOT NULL'
+    values = f'{minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang), {minus}1, {minus}COALESCE({row}.cost_satang, 0)'
+    return f'''
+        INSERT INTO sales_rollup_daily (user_id, day, product_id, quantity, revenue_satang, sales_count, cost_satang)
+        SELECT {row}.user_id, {row}.sale_ts / 86400, COALESCE({row}.product_id, 0), {values}
+        WHERE {live} AND {row}.sale_ts / 86400 >= {WATERMARK}
+        ON CONFLICT(user_id, day, product_id) DO UPDATE SET {ADD_EXCLUDED};
+        INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count, cost_satang)
+        SELECT {row}.user_id, strftime('%Y-%m', {row}.sale_ts, 'unixepoch'), COALESCE({row}.product_id, 0), {values}
+        WHERE {live} AND {row}.sale_ts / 86400 < {WATERMARK}
+        ON CONFLICT(user_id, month, product_id) DO UPDATE SET {ADD_EXCLUDED};'''
+
+def rollup_triggers():
+    columns = 'user_id, product_id, quantity, price_per_item, sale_date, deleted_at, cost_satang'
+    added = _delta('NEW', 1)
+    removed = _delta('OLD', -1)
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_insert AFTER INSERT ON sales BEGIN{added}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_update AFTER UPDATE OF {columns} ON sales BEGIN{removed}{added}\nEND',
+        f'CREATE TRIGGER IF NOT EXISTS trg_sales_rollup_delete AFTER DELETE ON sales BEGIN{removed}\nEND',
+    ]
+
+def create_rollup_tables(c):
+    """Creates the rollup tables and triggers, filling them on first creation."""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales_rollup_daily'").fetchone()
+    for statement in ROLLUP_SCHEMA + rollup_triggers():
+        c.execute(statement)
+    if not exists:
+        rebuild(c)
+
+EXPECTED_DAILY_SQL = f'''
+    SELECT user_id, sale_ts / 86400 AS day, COALESCE(product_id, 0) AS product_id,
+           SUM(quantity) AS quantity, SUM(quantity * price_per_item_satang) AS revenue_satang, COUNT(*) AS sales_count,
+           SUM(COALESCE(cost_satang, 0)) AS cost_satang
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL AND sale_ts / 86400 >= {WATERMARK}
+    GROUP BY user_id, day, COALESCE(product_id, 0)
+'''
+
+EXPECTED_MONTHLY_SQL = f'''
+    SELECT user_id, strftime('%Y-%m', sale_ts, 'unixepoch') AS month, COALESCE(product_id, 0) AS product_id,
+           SUM(quantity) AS quantity, SUM(quantity * price_per_item_satang) AS revenue_satang, COUNT(*) AS sales_count,
+           SUM(COALESCE(cost_satang, 0)) AS cost_satang
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL AND sale_ts IS NOT NULL AND sale_ts / 86400 < {WATERMARK}
+    GROUP BY user_id, month, COALESCE(product_id, 0)
+'''
+
+def rebuild(c):
+    """Recomputes both rollup tables from sales inside the caller's transaction (keeps the watermark)."""
+    c.execute('DELETE FROM sales_rollup_daily')
+    c.execute('DELETE FROM sales_rollup_monthly')
+    c.execute(f'INSERT INTO sales_rollup_daily (user_id, day, product_id, {ROLLUP_MEASURES}) {EXPECTED_DAILY_SQL}')
+    c.execute(f'INSERT INTO sales_rollup_monthly (user_id, month, product_id, {ROLLUP_MEASURES}) {EXPECTED_MONTHLY_SQL}')
+
+def verify(conn):
+    """Returns a list of mismatches between the rollups and a fresh recompute."""
+    mismatches = []
+    for table, key, expected_sql in (('sales_rollup_daily', 'day', EXPECTED_DAILY_SQL),
+                                     ('sales_rollup_monthly', 'month', EXPECTED_MONTHLY_SQL)):
+        stored = {row[:3]: row[3:] for row in conn.execute(
+            f'SELECT user_id, {key}, product_id, {ROLLUP_MEASURES} FROM {table} WHERE sales_count != 0')}
+        for row in conn.execute(expected_sql):
+            have = stored.pop(tuple(row[:3]), None)
+            if have != tuple(row[3:]):
+                mismatches.append(f'{table} {tuple(row[:3])}: stored {have}, expected {tuple(row[3:])}')
+        for key_values, have in stored.items():
+            mismatches.append(f'{table} {key_values}: stored {have} but no live sales')
+    return mismatches
+
+def day_number(value):
+    return (value - EPOCH).days
+
+def compact(c, keep_days=ROLLUP_KEEP_DAYS, today=None):
+    """
+    Folds daily rows of whole months older than keep_days into monthly rows
+    and moves the watermark. Returns (new watermark date, daily rows removed).
+    Runs inside the caller's transaction.
+    """
+    today = today or date.today()
+    cutoff = (today - timedelta(days=keep_days)).replace(day=1)
+    cutoff_day = day_number(cutoff)
+    watermark = c.execute(WATERMARK[1:-1]).fetchone()[0]
+    if cutoff_day <= watermark:
+        return EPOCH + timedelta(days=watermark), 0
+    c.execute('''
+        INSERT INTO sales_rollup_monthly (user_id, month, product_id, quantity, revenue_satang, sales_count, cost_satang)
+        SELECT user_id, strftime('%Y-%m', day * 86400, 'unixepoch') AS month, product_id,
+               SUM(quantity), SUM(revenue_satang), SUM(sales_count), SUM(cost_satang)
+        FROM sales_rollup_daily
+        WHERE day < ?
+        GROUP BY user_id, month, product_id
+        ON CONFLICT(user_id, month, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            sales_count = sales_count + excluded.sales_count,
+            cost_satang = cost_satang + excluded.cost_satang
+    ''', (cutoff_day,))
+    removed = c.execute('DELETE FROM sales_rollup_daily WHERE day < ?', (cutoff_day,)).rowcount
+    c.execute('UPDATE rollup_state SET compacted_before = ? WHERE id = 1', (cutoff_day,))
+    # แถวที่ยอดเป็นศูนย์หมดแล้ว (ขายแล้วลบทิ้งทั้งหมด) ไม่ต้องเก็บไว้
+    c.execute('DELETE FROM sales_rollup_daily WHERE sales_count = 0')
+    c.execute('DELETE FROM sales_rollup_monthly WHERE sales_count = 0')
+    return cutoff, removed
+
+# --- Reports ---
+
+# granularity -> SQL label for a bucket, given an SQL expression for the day number.
+BUCKET_LABELS = {
+    'day': lambda d: f"date({d} * 86400, 'unixepoch')",
+    'week': lambda d: f"date((({d} + 3) / 7 * 7 - 3) * 86400, 'unixepoch')",  # Monday of the week
+    'month': lambda d: f"strftime('%Y-%m', {d} * 86400, 'unixepoch')",
+}
+
+def _month_start(value):
+    return value.replace(day=1)
+
+def _next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def _raw_part(label, start, end):
+    """Raw sales between two dates (end exclusive), for ranges the rollups cannot answer."""
+    return (f'''
+        SELECT {label('s.sale_ts / 86400')} AS bucket, COALESCE(s.product_id, 0) AS product_id,
+               SUM(s.quantity) AS quantity, SUM(s.quantity * s.price_per_item_satang) AS revenue_satang,
+               SUM(COALESCE(s.cost_satang, 0)) AS cost_satang
+        FROM sales s
+        WHERE s.user_id = ? AND s.deleted_at IS NULL AND s.sale_date >= ? AND s.sale_date < ?
+        GROUP BY bucket, COALESCE(s.product_id, 0)
+    ''', [start.isoformat(), end.isoformat()])
+
+def sales_report(conn, user_id, granularity='day', start=None, end=None, by_product=False):
+    """
+    Quantity, revenue and cost per bucket for sales dated start <= sale < end
+    (dates; None means unbounded), optionally per product. Cost is the sum
+    of sales.cost_satang kept by the COGS engine (cogs.py).
+    """
+    label = BUCKET_LABELS[granularity]
+    watermark = EPOCH + timedelta(days=conn.execute(WATERMARK[1:-1]).fetchone()[0])
+    parts = []
+    params = []
+
+    # 1. หลัง watermark: ตาราง daily
+    daily_start = max(start, watermark) if start else watermark
+    if end is None or daily_start < end:
+        sql = f'''
+            SELECT {label('day')} AS bucket, product_id, SUM(quantity) AS quantity, SUM(revenue_satang) AS revenue_satang,
+                   SUM(cost_satang) AS cost_satang
+            FROM sales_rollup_daily
+            WHERE user_id = ? AND day >= ?{' AND day < ?' if end else ''} AND sales_count != 0
+            GROUP BY bucket, product_id
+        '''
+        parts.append(sql)
+        params += [user_id, day_number(daily_start)] + ([day_number(end)] if end else [])
+
+    # 2. ก่อน watermark: เดือนที่อยู่ในช่วงครบทั้งเดือนใช้ตาราง monthly ที่เหลืออ่านจาก sales
+    compacted_end = min(end, watermark) if end else watermark
+    if start is None or start < compacted_end:
+        if granularity == 'month':
+            first_full = start if start is None or start == _month_start(start) else _next_month(start)
+            # compacted_end อยู่ต้นเดือนเสมอ (compact ตัดที่ต้นเดือน) เว้นแต่ end อยู่กลางเดือน
+            last_full = _month_start(compacted_end)
+            if first_full is None or first_full < last_full:
+                sql = '''
+                    SELECT month AS bucket, product_id, SUM(quantity) AS quantity, SUM(revenue_satang) AS revenue_satang,
+                           SUM(cost_satang) AS cost_satang
+                    FROM sales_rollup_monthly
+                    WHERE user_id = ? AND month < ?{} AND sales_count != 0
+                    GROUP BY bucket, product_id
+                '''.format(' AND month >= ?' if first_full else '')
+                parts.append(sql)
+                params += [user_id, last_full.strftime('%Y-%m')] + ([first_full.strftime('%Y-%m')] if first_full else [])
+                if start and start < first_full:
+                    sql, extra = _raw_part(label, start, first_full)
+                    parts.append(sql)
+                    params += [user_id] + extra
+                if last_full < compacted_end:
+                    sql, extra = _raw_part(label, last_full, compacted_end)
+                    parts.append(sql)
+                    params += [user_id] + extra
+            else:
+                sql, extra = _raw_part(label, start or EPOCH, compacted_end)
+                parts.append(sql)
+                params += [user_id] + extra
+        else:
+            sql, extra = _raw_part(label, start or EPOCH, compacted_end)
+            parts.append(sql)
+            params += [user_id] + extra
+
+    if not parts:
+        return []
+    if by_product:
+        product_columns = 'parts.product_id, p.name, p.sku, p.details, '
+        join = 'LEFT JOIN products p ON p.product_id = parts.product_id AND p.user_id = ?'
+        group = 'parts.bucket, parts.product_id'
+        params.append(user_id)
+    else:
+        product_columns, join, group = '', '', 'parts.bucket'
+    sql = f'''
+        WITH parts AS ({' UNION ALL '.join(parts)})
+        SELECT parts.bucket, {product_columns}
+               SUM(parts.quantity) AS quantity,
+               SUM(parts.revenue_satang) AS revenue_satang,
+               SUM(parts.cost_satang) AS cost_satang
+        FROM parts
+        {join}
+        GROUP BY {group}
+        ORDER BY {group}
+    '''
+    return conn.execute(sql, params).fetchall()
+
+def main(argv=None):
+    from database import DATABASE
+
+    parser = argparse.ArgumentParser(description='Maintain the sales rollup tables.')
+    parser.add_argument('command', choices=['compact', 'rebuild', 'verify'])
+    parser.add_argument('--keep-days', type=int, default=ROLLUP_KEEP_DAYS,
+                        help='keep daily rows for at least this many days (compact)')
+    parser.add_argument('--database', default=DATABASE)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database, timeout=30)
+    if args.command == 'compact':
+        conn.execute('BEGIN IMMEDIATE')
+        cutoff, removed = compact(conn, args.keep_days)
+        conn.commit()
+        print(f'Daily rollups before {cutoff} are monthly now ({removed:,} daily rows folded).')
+    elif args.command == 'rebuild':
+        with conn:
+            rebuild(conn)
+        print('Rollup tables rebuilt.')
+
+    mismatches = verify(conn)
+    conn.close()
+    for line in mismatches:
+        print(line)
+    print(f'{len(mismatches)} mismatches.')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
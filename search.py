@@ -0,0 +1,74 @@
+"""
+Product search for the form SKU/details pickers.
+
+products_fts is an FTS5 index over name, sku, factory_sku and details of live
+products. Each row also carries an "owner" token (u<user_id>) so a search
+only walks the current user's postings. Triggers on products (created by
+migration 0004) keep it in sync with every write path. If SQLite was built
+without FTS5 the search falls back to prefix LIKE queries.
+"""
+import re
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+def has_search_index(conn):
+    """
+    True when the migrations created products_fts. Pooled connections
+    (metrics.TracedConnection) remember the answer, so sqlite_master is
+    read once per connection instead of on every search.
+    """
+    found = getattr(conn, 'has_search_index', None)
+    if found is None:
+        found = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone() is not None
+        if hasattr(conn, '__dict__'):  # sqlite3.Connection ธรรมดาเก็บ attribute ไม่ได้
+            conn.has_search_index = found
+    return found
+
+def _match_expression(user_id, text):
+    """
+    Builds an FTS5 query: every typed word as a quoted prefix, all required.
+    The words are limited to the searchable columns, otherwise "u" would
+    match every row's owner token.
+    """
+    words = [w for w in re.split(r'[\s#/,.()"]+', text) if w]
+    terms = ' AND '.join('"{}"*'.format(w.replace('"', '""')) for w in words)
+    return f'owner:"u{user_id}" AND {{name sku factory_sku details}} : ({terms})' if terms else None
+
+def search_products(conn, user_id, text, limit=SEARCH_LIMIT):
+    """Returns up to `limit` of the user's live products best matching `text`."""
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if has_search_index(conn):
+        expression = _match_expression(user_id, text)
+        if expression is None:
+            return []
+        return conn.execute('''
+            SELECT p.product_id, p.name, p.sku, p.factory_sku, p.details, p.stock
+            FROM products_fts f
+            JOIN products p ON p.product_id = f.rowid AND p.user_id = ?
+            WHERE products_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        ''', (user_id, expression, limit)).fetchall()
+
+    text = text.strip()
+    if not text:
+        return []
+    prefix = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    return conn.execute(r'''
+        SELECT product_id, name, sku, factory_sku, details, stock
+        FROM products
+        WHERE user_id = ? AND deleted_at IS NULL
+          AND (sku LIKE ? ESCAPE '\' OR name LIKE ? ESCAPE '\' OR factory_sku LIKE ? ESCAPE '\' OR details LIKE ? ESCAPE '\')
+        ORDER BY sku, details
+        LIMIT ?
+    ''', (user_id, prefix, prefix, prefix, prefix, limit)).fetchall()
+
+def product_variants(conn, user_id, sku):
+    """Returns every live (details) variant of one SKU, for the details picker."""
+    return conn.execute('''
+        SELECT product_id, name, sku, factory_sku, details, stock
+        FROM products
+        WHERE user_id = ? AND sku = ? AND deleted_at IS NULL
+        ORDER BY details
+    ''', (user_id, sku)).fetchall()
@@ -0,0 +1,196 @@
+"""
+Batched write path for the multi-row stock-in, stock-out and order forms.
+
+Each form is grouped in one linear pass, the products it touches are looked
+up with a single query, and all inserts/updates are applied with
+executemany() inside one explicit transaction. Every function returns one
+result dict per submitted row so callers can report what happened.
+
+Stock-out decrements with `UPDATE ... WHERE stock >= ?` under BEGIN
+IMMEDIATE, so concurrent workers selling the same variant can never take
+stock below zero; a row that does not fit is reported, not sold.
+benchmarks/stock_contention.py checks this with several processes.
+"""
+from datetime import datetime
+
+# SQLite caps the number of bound variables per statement; keep lookups well below it.
+LOOKUP_CHUNK = 400
+
+def group_rows(groups, group_index_list, *row_lists):
+    """
+    Pairs every sub-row with its parent group in one pass.
+    Yields (row_index, group, row_values) for rows whose group_index points at
+    an existing group, in submission order.
+    """
+    for i, group_index in enumerate(group_index_list):
+        try:
+            index = int(group_index)
+            if index < 0:
+                continue  # ดัชนีติดลบจะไปชี้กลุ่มท้ายรายการ ถือว่าไม่มีกลุ่มนี้
+            group = groups[index]
+        except (ValueError, IndexError):
+            continue
+        values = tuple(row_list[i] if i < len(row_list) else '' for row_list in row_lists)
+        yield i, group, values
+
+def find_products(conn, user_id, keys):
+    """Returns {(sku, details): product_id} for the given keys, in chunked queries."""
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        placeholders = ', '.join(['(?, ?)'] * len(chunk))
+        params = [value for key in chunk for value in key] + [user_id]
+        rows = conn.execute(f'''
+            WITH wanted(sku, details) AS (VALUES {placeholders})
+            SELECT p.product_id, p.sku, p.details
+            FROM wanted w
+            JOIN products p ON p.user_id = ? AND p.sku = w.sku AND p.details = w.details
+            ORDER BY p.product_id
+        ''', params).fetchall()
+        for row in rows:
+            found.setdefault((row['sku'], row['details']), row['product_id'])
+    return found
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def stock_in(conn, user_id, product_name_list, sku_list, factory_sku_list, details_list, quantity_list, group_index_list):
+    """
+    Adds stock for each (sku, details) row; unknown variants are created.
+    Row status: 'updated', 'inserted', 'skipped' (missing fields) or 'invalid'.
+    """
+    groups = list(zip(product_name_list, sku_list, factory_sku_list))
+    results = []
+    pending = []
+    for i, (product_name, sku, factory_sku), (details, quantity) in group_rows(groups, group_index_list, details_list, quantity_list):
+        result = {'row': i, 'sku': sku, 'details': details, 'quantity': quantity, 'status': 'skipped'}
+        results.append(result)
+        if not (product_name and sku and factory_sku and details and quantity):
+            continue
+        quantity_int = _parse_int(quantity)
+        if quantity_int is None:
+            result['status'] = 'invalid'
+            continue
+        result['quantity'] = quantity_int
+        pending.append((result, product_name, sku, factory_sku, details, quantity_int))
+
+    if not pending:
+        return results
+
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        existing = find_products(conn, user_id, [(row[2], row[4]) for row in pending])
+        updates = []
+        new_products = {}
+        for result, product_name, sku, factory_sku, details, quantity_int in pending:
+            key = (sku, details)
+            if key in existing:
+                updates.append((quantity_int, existing[key]))
+                result['status'] = 'updated'
+            elif key in new_products:
+                # ตัวเลือกเดียวกันซ้ำในฟอร์มเดียว: รวมจำนวนเข้ากับแถวที่กำลังจะสร้าง
+                new_products[key][4] += quantity_int
+                result['status'] = 'updated'
+            else:
+                new_products[key] = [product_name, sku, factory_sku, details, quantity_int, created_at, user_id]
+                result['status'] = 'inserted'
+
+        conn.executemany('UPDATE products SET stock = stock + ? WHERE product_id = ?', updates)
+        conn.executemany('INSERT INTO products (name, sku, factory_sku, details, stock, created_at, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [tuple(values) for values in new_products.values()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+def stock_out(conn, user_id, sku_list, details_list, quantity_list, price_list, group_index_list):
+    """
+    Records a sale and decrements stock for each row, never below zero.
+    Row status: 'sold' (with 'stock_left'), 'insufficient_stock' (with
+    'available'), 'not_found', 'skipped' (missing fields) or 'invalid'.
+    """
+    results = []
+    pending = []
+    for i, sku, (details, quantity, price) in group_rows(sku_list, group_index_list, details_list, quantity_list, price_list):
+        result = {'row': i, 'sku': sku, 'details': details, 'quantity': quantity, 'status': 'skipped'}
+        results.append(result)
+        if not (details and quantity and price):
+            continue
+        quantity_int = _parse_int(quantity)
+        price_float = _parse_float(price)
+        if quantity_int is None or price_float is None or quantity_int <= 0:
+            result['status'] = 'invalid'
+            continue
+        result['quantity'] = quantity_int
+        pending.append((result, sku, details, quantity_int, price_float))
+
+    if not pending:
+        return results
+
+    # ค้นหาสินค้าก่อนขอ write lock: ช่วงที่ถือ lock เหลือแค่ UPDATE แบบมีเงื่อนไขกับ INSERT
+    product_ids = find_products(conn, user_id, [(row[1], row[2]) for row in pending])
+    sale_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        sales = []
+        for result, sku, details, quantity_int, price_float in pending:
+            product_id = product_ids.get((sku, details))
+            if product_id is None:
+                result['status'] = 'not_found'
+                continue
+            # ตัดสต็อกเฉพาะเมื่อยังพอ: สอง worker ขาย SKU เดียวกันพร้อมกันก็ไม่ติดลบ
+            row = conn.execute('UPDATE products SET stock = stock - ? WHERE product_id = ? AND user_id = ? AND stock >= ? RETURNING stock',
+                               (quantity_int, product_id, user_id, quantity_int)).fetchone()
+            if row is None:
+                available = conn.execute('SELECT stock FROM products WHERE product_id = ? AND user_id = ?', (product_id, user_id)).fetchone()
+                result['status'] = 'insufficient_stock'
+                result['available'] = available[0] if available else 0
+                continue
+            sales.append((product_id, quantity_int, price_float, sale_date, user_id))
+            result['status'] = 'sold'
+            result['stock_left'] = row[0]
+
+        conn.executemany('INSERT INTO sales (product_id, quantity, price_per_item, sale_date, user_id) VALUES (?, ?, ?, ?, ?)', sales)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+def insert_orders(conn, user_id, product_details_list, factory_sku_list, quantity_list, cost_per_item_list):
+    """
+    Inserts one purchase order per complete row.
+    Row status: 'inserted', 'skipped' (missing fields) or 'invalid'.
+    """
+    order_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    results = []
+    orders = []
+    for i, (product_details, factory_sku, quantity, cost_per_item) in enumerate(zip(product_details_list, factory_sku_list, quantity_list, cost_per_item_list)):
+        result = {'row': i, 'factory_sku': factory_sku, 'quantity': quantity, 'status': 'skipped'}
+        results.append(result)
+        if not (product_details and factory_sku and quantity and cost_per_item):
+            continue
+        quantity_int = _parse_int(quantity)
+        cost_float = _parse_float(cost_per_item)
+        if quantity_int is None or cost_float is None:
+            result['status'] = 'invalid'
+            continue
+        orders.append((product_details, factory_sku, quantity_int, cost_float, order_date, user_id))
+        result['status'] = 'inserted'
+
+    if orders:
+        with conn:
+            conn.executemany('INSERT INTO orders (product_details, factory_sku, quantity, cost_per_item, order_date, user_id) VALUES (?, ?, ?, ?, ?, ?)', orders)
+    return results
@@ -0,0 +1,245 @@
+"""
+Materialized per-user dashboard aggregates.
+
+user_summary holds one row of running totals per user and
+product_profit_summary holds units sold, revenue and cost per product. Both are
+kept up to date by SQLite triggers on sales, orders, payments and products,
+so every write path (forms, edits, soft delete, restore) maintains them.
+Money totals are integer satang, so incremental updates never drift.
+
+    python summary.py rebuild   # recompute everything from the base tables
+    python summary.py verify    # compare stored totals with a fresh recompute
+"""
+import re
+import sqlite3
+import sys
+
+SUMMARY_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER PRIMARY KEY,
+        total_revenue_satang INTEGER NOT NULL DEFAULT 0,
+        total_items_sold INTEGER NOT NULL DEFAULT 0,
+        total_order_costs_satang INTEGER NOT NULL DEFAULT 0,
+        total_payments_satang INTEGER NOT NULL DEFAULT 0,
+        total_stock INTEGER NOT NULL DEFAULT 0,
+        total_cogs_satang INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS product_profit_summary (
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity_sold INTEGER NOT NULL DEFAULT 0,
+        revenue_satang INTEGER NOT NULL DEFAULT 0,
+        cost_satang INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, product_id)
+    )
+    ''',
+]
+
+def baht(value):
+    return value / 100
+
+# What each live row (deleted_at IS NULL) of a base table adds to user_summary:
+# table -> (columns that affect the totals, {summary column: expression}).
+# The *_satang columns are generated from the REAL ones, so updates list the REAL columns.
+USER_SUMMARY_SOURCES = {
+    'sales': ('user_id, product_id, quantity, price_per_item, deleted_at, cost_satang',
+              {'total_revenue_satang': 'quantity * price_per_item_satang', 'total_items_sold': 'quantity',
+               'total_cogs_satang': 'COALESCE(cost_satang, 0)'}),
+    'orders': ('user_id, quantity, cost_per_item, deleted_at',
+               {'total_order_costs_satang': 'quantity * cost_per_item_satang'}),
+    'payments': ('user_id, amount, deleted_at',
+                 {'total_payments_satang': 'amount_satang'}),
+    'products': ('user_id, stock, deleted_at',
+                 {'total_stock': 'stock'}),
+}
+
+# The same figures as one aggregate per table, used by rebuild() and verify().
+USER_SUMMARY_COLUMNS = ['total_revenue_satang', 'total_items_sold', 'total_order_costs_satang', 'total_payments_satang', 'total_stock',
+                        'total_cogs_satang']
+
+def _delta(table, row, sign):
+    """UPSERT statements that add (sign=1) or remove (sign=-1) one row's contribution."""
+    minus = '-' if sign < 0 else ''
+    expressions = USER_SUMMARY_SOURCES[table][1]
+    columns = ', '.join(expressions)
+    values = ', '.join(f'{minus}({_qualify(e, row)})' for e in expressions.values())
+    updates = ', '.join(f'{c} = {c} + excluded.{c}' for c in expressions)
+    body = f'''
+        INSERT INTO user_summary (user_id, {columns})
+        SELECT {row}.user_id, {values} WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id) DO UPDATE SET {updates};'''
+    if table == 'sales':
+        body += f'''
+        INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang, cost_satang)
+        SELECT {row}.user_id, {row}.product_id, {minus}{row}.quantity, {minus}({row}.quantity * {row}.price_per_item_satang),
+               {minus}COALESCE({row}.cost_satang, 0)
+        WHERE {row}.deleted_at IS NULL
+        ON CONFLICT(user_id, product_id) DO UPDATE SET
+            quantity_sold = quantity_sold + excluded.quantity_sold,
+            revenue_satang = revenue_satang + excluded.revenue_satang,
+            cost_satang = cost_satang + excluded.cost_satang;'''
+    return body
+
+def _qualify(expression, row):
+    """Prefixes the column names in `expression` (lower case, not followed by "(") with NEW./OLD."""
+    return re.sub(r'\b([a-z_]+)\b(?!\()', rf'{row}.\1', expression)
+
+def summary_triggers():
+    """Returns the CREATE TRIGGER statements that keep the summary tables current."""
+    statements = []
+    for table, (columns, _) in USER_SUMMARY_SOURCES.items():
+        added = _delta(table, 'NEW', 1)
+        removed = _delta(table, 'OLD', -1)
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_insert AFTER INSERT ON {table} BEGIN{added}\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_update AFTER UPDATE OF {columns} ON {table} BEGIN{removed}{added}\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_delete AFTER DELETE ON {table} BEGIN{removed}\nEND',
+        ]
+    return statements
+
+def create_summary_tables(c):
+    """Creates the summary tables and triggers, filling them on first creation."""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_summary'").fetchone()
+    for statement in SUMMARY_TABLES + summary_triggers():
+        c.execute(statement)
+    if not exists:
+        rebuild(c)
+
+EXPECTED_USER_SUMMARY_SQL = '''
+    SELECT user_id,
+           SUM(total_revenue_satang) AS total_revenue_satang, SUM(total_items_sold) AS total_items_sold,
+           SUM(total_order_costs_satang) AS total_order_costs_satang, SUM(total_payments_satang) AS total_payments_satang,
+           SUM(total_stock) AS total_stock, SUM(total_cogs_satang) AS total_cogs_satang
+    FROM (
+        SELECT user_id, quantity * price_per_item_satang AS total_revenue_satang, quantity AS total_items_sold,
+               0 AS total_order_costs_satang, 0 AS total_payments_satang, 0 AS total_stock,
+               COALESCE(cost_satang, 0) AS total_cogs_satang
+        FROM sales WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, quantity * cost_per_item_satang, 0, 0, 0 FROM orders WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, amount_satang, 0, 0 FROM payments WHERE deleted_at IS NULL
+        UNION ALL
+        SELECT user_id, 0, 0, 0, 0, stock, 0 FROM products WHERE deleted_at IS NULL
+    )
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+'''
+
+EXPECTED_PRODUCT_SUMMARY_SQL = '''
+    SELECT user_id, product_id, SUM(quantity) AS quantity_sold, SUM(quantity * price_per_item_satang) AS revenue_satang,
+           SUM(COALESCE(cost_satang, 0)) AS cost_satang
+    FROM sales
+    WHERE deleted_at IS NULL AND user_id IS NOT NULL
+    GROUP BY user_id, product_id
+'''
+
+def rebuild(c):
+    """Recomputes both summary tables from scratch inside the caller's transaction."""
+    c.execute('DELETE FROM user_summary')
+    c.execute('DELETE FROM product_profit_summary')
+    c.execute(f'INSERT INTO user_summary (user_id, {", ".join(USER_SUMMARY_COLUMNS)}) {EXPECTED_USER_SUMMARY_SQL}')
+    c.execute(f'INSERT INTO product_profit_summary (user_id, product_id, quantity_sold, revenue_satang, cost_satang) {EXPECTED_PRODUCT_SUMMARY_SQL}')
+
+def verify(conn, tolerance=0):
+    """
+    Compares the stored summaries with a fresh recompute.
+    Returns a list of human-readable mismatches (empty when everything matches).
+    """
+    def differs(a, b):
+        return abs((a or 0) - (b or 0)) > tolerance
+
+    mismatches = []
+    stored = {row[0]: row[1:] for row in conn.execute(f'SELECT user_id, {", ".join(USER_SUMMARY_COLUMNS)} FROM user_summary')}
+    for row in conn.execute(EXPECTED_USER_SUMMARY_SQL).fetchall():
+        have = stored.pop(row[0], (0,) * len(USER_SUMMARY_COLUMNS))
+        for column, expected, actual in zip(USER_SUMMARY_COLUMNS, row[1:], have):
+            if differs(expected, actual):
+                mismatches.append(f'user {row[0]}: {column} is {actual}, expected {expected}')
+    for user_id, have in stored.items():
+        if any(differs(value, 0) for value in have):
+            mismatches.append(f'user {user_id}: has totals {have} but no live rows')
+
+    stored = {(row[0], row[1]): row[2:] for row in conn.execute(
+        'SELECT user_id, product_id, quantity_sold, revenue_satang, cost_satang FROM product_profit_summary')}
+    for row in conn.execute(EXPECTED_PRODUCT_SUMMARY_SQL).fetchall():
+        have = stored.pop((row[0], row[1]), (0, 0, 0))
+        if any(differs(expected, actual) for expected, actual in zip(row[2:], have)):
+            mismatches.append(f'user {row[0]} product {row[1]}: stored {have}, expected {tuple(row[2:])}')
+    for key, have in stored.items():
+        if any(differs(value, 0) for value in have):
+            mismatches.append(f'user {key[0]} product {key[1]}: stored {have} but no live sales')
+    return mismatches
+
+PRODUCT_FIGURES_SQL = '''
+    SELECT p.name, p.details, p.stock, p.deleted_at,
+           COALESCE(ps.quantity_sold, 0) AS quantity_sold,
+           COALESCE(ps.revenue_satang, 0) AS revenue_satang,
+           COALESCE(ps.cost_satang, 0) AS cost_satang,
+           COALESCE(cs.unit_cost_satang, 0) AS unit_cost_satang
+    FROM products p
+    LEFT JOIN product_profit_summary ps ON ps.user_id = p.user_id AND ps.product_id = p.product_id
+    LEFT JOIN cogs_state cs ON cs.user_id = p.user_id AND cs.factory_sku = p.factory_sku
+    WHERE p.user_id = ?
+'''
+
+def dashboard_figures(conn, user_id):
+    """
+    Returns the dashboard totals for one user from the summary tables.
+    Cost of goods sold is the sum of sales.cost_satang (see cogs.py) and
+    stock is valued at the SKU's current unit cost from cogs_state.
+    Everything is summed in integer satang and returned in baht.
+    """
+    totals = conn.execute('SELECT * FROM user_summary WHERE user_id = ?', (user_id,)).fetchone()
+    totals = {c: (totals[c] if totals else 0) for c in USER_SUMMARY_COLUMNS}
+
+    stock_value = 0
+    product_profit = {}
+    for product in conn.execute(PRODUCT_FIGURES_SQL, (user_id,)):
+        if product['deleted_at'] is None:
+            stock_value += product['unit_cost_satang'] * product['stock']
+        if product['quantity_sold']:
+            product_key = f"{product['name']} ({product['details']})"
+            profit = product['revenue_satang'] - product['cost_satang']
+            product_profit[product_key] = product_profit.get(product_key, 0) + profit
+
+    revenue = totals['total_revenue_satang']
+    cost_of_goods_sold = totals['total_cogs_satang']
+    net_profit = revenue - cost_of_goods_sold
+    top_products = sorted(product_profit.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        'total_revenue': baht(revenue),
+        'total_items_sold': totals['total_items_sold'],
+        'total_cost_of_goods_sold': baht(cost_of_goods_sold),
+        'net_profit': baht(net_profit),
+        'net_profit_margin': (net_profit / revenue * 100) if revenue > 0 else 0,
+        'current_stock_value': baht(stock_value),
+        'top_profitable_products': [(name, baht(profit)) for name, profit in top_products],
+        'total_outstanding': baht(totals['total_order_costs_satang'] - totals['total_payments_satang']),
+        'total_stock_remaining': totals['total_stock'],
+    }
+
+def main(command='verify'):
+    from database import DATABASE
+
+    conn = sqlite3.connect(DATABASE)
+    if command == 'rebuild':
+        with conn:
+            rebuild(conn)
+        print('Summary tables rebuilt.')
+    elif command != 'verify':
+        print(f'Unknown command: {command} (use rebuild or verify)')
+        return 2
+
+    mismatches = verify(conn)
+    conn.close()
+    for line in mismatches:
+        print(line)
+    print(f'{len(mismatches)} mismatches.')
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,60 @@
+"""
+Per-user data version counters for conditional GETs and the response cache.
+
+data_versions holds one counter per user. Triggers on products, orders,
+sales and payments bump it on every insert, update and delete, so every
+write path changes it without the route having to remember:
+- the forms, edits, soft delete and restore
+- the importer and the retention purge
+- cost updates from cogs.py
+
+A read endpoint turns (user, version) into an ETag and a response cache
+key (see conditional_response in app.py). A write therefore never has to
+invalidate a cache entry: the next read simply looks up a new key.
+"""
+
+VERSIONED_TABLES = ('products', 'orders', 'sales', 'payments')
+
+VERSION_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''',
+]
+
+def _bump(user):
+    return f'''
+        INSERT INTO data_versions (user_id, version) VALUES ({user}, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;'''
+
+def version_triggers():
+    statements = []
+    for table in VERSIONED_TABLES:
+        statements += [
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table} '
+            f'WHEN NEW.user_id IS NOT NULL BEGIN{_bump("NEW.user_id")}\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update AFTER UPDATE ON {table} '
+            f'WHEN NEW.user_id IS NOT NULL BEGIN{_bump("NEW.user_id")}\nEND',
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table} '
+            f'WHEN OLD.user_id IS NOT NULL BEGIN{_bump("OLD.user_id")}\nEND',
+        ]
+    return statements
+
+def create_version_tables(c):
+    for statement in VERSION_SCHEMA + version_triggers():
+        c.execute(statement)
+
+def data_version(conn, user_id):
+    """The user's current version (0 before their first write)."""
+    row = conn.execute('SELECT version FROM data_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def bump_all(c):
+    """Bumps every user's version, e.g. after a bulk load that ran with the triggers dropped."""
+    c.execute('''
+        INSERT INTO data_versions (user_id, version)
+        SELECT id, 1 FROM users WHERE true
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    ''')